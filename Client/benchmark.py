@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fail2ban-sync 客户端同步性能测试
+
+使用模拟的fail2ban（fail2ban-client替身脚本或fake_fail2ban_server.py的socket替身，
+均可配置命令延迟）和本地模拟同步服务器，连续执行若干个同步周期（run_sync_cycle），
+统计每个阶段的调用次数和耗时：
+
+    get_banned_ips / _read_jail_banned_ips   读取本地封禁IP
+    sync_remote_state / get_remote_changes   增量同步
+    get_remote_banned_ips / get_remote_allowed_ips / _fetch_remote_ip_list   下载远端列表
+    compare_ip_lists                         比较本地和远端列表
+    add_ips_to_fail2ban / allow_ips_in_fail2ban                              执行banip/unbanip
+    _send_banned_ips_batch                   上传本地封禁IP（其中每批之后的固定等待单独记为 sleep）
+
+以及fail2ban-client调用次数、子进程数、与服务器之间传输的字节数和内存峰值。各阶段耗时为
+包含其内部调用的累计时间，并行处理多个jail时累计时间可能大于周期耗时。
+
+用法示例：
+    python3 benchmark.py --local 50000 --remote 200000 --cycles 3
+    python3 benchmark.py --fail2ban socket --latency 0.002 --jails 4
+    python3 benchmark.py --set delta_sync=false --set local_state_max_age=0 --output baseline.json
+    python3 benchmark.py --output after.json --compare baseline.json
+"""
+
+import argparse
+import gzip
+import ipaddress
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = 'benchmark-token'
+
+# 计时的客户端函数
+PHASES = [
+    'get_banned_ips', '_read_jail_banned_ips', 'sync_remote_state', 'get_remote_changes', 'get_remote_banned_ips',
+    'get_remote_allowed_ips', '_fetch_remote_ip_list', 'compare_ip_lists', 'add_ips_to_fail2ban',
+    'allow_ips_in_fail2ban', '_send_banned_ips_batch',
+]
+
+# fail2ban-client替身：jail的封禁IP保存在状态目录的 <jail>.txt 中（每行一个IP），
+# 每次调用记入calls.log，封禁/解禁时更新dbfile的修改时间（模拟fail2ban数据库）
+FAIL2BAN_CLIENT_STUB = '''#!{python}
+import os, sys, time
+STATE_DIR = {state_dir!r}
+time.sleep({latency!r})
+with open(os.path.join(STATE_DIR, 'calls.log'), 'a') as f:
+    f.write(' '.join(sys.argv[1:3]) + '\\n')
+args = sys.argv[1:]
+def read(jail):
+    path = os.path.join(STATE_DIR, jail + '.txt')
+    if not os.path.exists(path):
+        sys.stderr.write("Sorry but the jail '%s' does not exist\\n" % jail)
+        sys.exit(255)
+    with open(path) as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+if len(args) == 2 and args[0] == 'status':
+    ips = read(args[1])
+    sys.stdout.write("Status for the jail: %s\\n|- Filter\\n|  |- Currently failed:\\t0\\n|  |- Total failed:\\t0\\n"
+                     "|  `- File list:\\t\\n`- Actions\\n   |- Currently banned:\\t%d\\n   |- Total banned:\\t%d\\n"
+                     "   `- Banned IP list:\\t%s\\n" % (args[1], len(ips), len(ips), ' '.join(ips)))
+elif len(args) >= 4 and args[0] == 'set' and args[2] in ('banip', 'unbanip'):
+    current = read(args[1])
+    if args[2] == 'banip':
+        with open(os.path.join(STATE_DIR, args[1] + '.txt'), 'a') as f:
+            f.write(''.join(ip + '\\n' for ip in args[3:]))
+    else:
+        removed = set(args[3:])
+        with open(os.path.join(STATE_DIR, args[1] + '.txt'), 'w') as f:
+            f.write(''.join(ip + '\\n' for ip in current if ip not in removed))
+    with open({dbfile!r}, 'a'):
+        os.utime({dbfile!r})
+    print(len(args) - 3)
+else:
+    sys.stderr.write('Invalid command\\n')
+    sys.exit(255)
+'''
+
+
+def log_message(message):
+    """打印带时间戳的日志消息"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def generate_ip(index):
+    """按序号生成互不相同的IPv4地址"""
+    return str(ipaddress.IPv4Address((index * 2654435761 + 16777216) % (1 << 32)))
+
+
+def build_dataset(local, remote, overlap, allowed, jails):
+    """本地封禁IP为序号 [0, local)，远端封禁IP从 local*(1-overlap) 开始，与本地列表的后overlap部分重叠；
+    远端允许IP取自本地独有的IP（这些IP会在本地被解禁）"""
+    jail_names = [f'jail{i}' for i in range(jails)]
+    remote_start = int(local * (1 - overlap))
+    allowed = min(allowed, remote_start)
+
+    def items(start, count):
+        return [(jail_names[index % jails], generate_ip(index)) for index in range(start, start + count)]
+
+    return jail_names, items(0, local), items(remote_start, remote), items(0, allowed)
+
+
+class MockSyncServer(ThreadingHTTPServer):
+    """模拟同步服务器：/get_ips、/get_allowed_ips（ETag、gzip）、/add_ips、/changes，并统计传输字节数"""
+    daemon_threads = True
+
+    def __init__(self, port, blocked, allowed):
+        self.lock = threading.Lock()
+        self.blocked = dict((ip, jail) for jail, ip in blocked)
+        self.allowed = dict((ip, jail) for jail, ip in allowed)
+        # 变更日志，序号即列表下标+1
+        self.changes = []
+        self.bodies = {}
+        self.stats = {'requests': 0, 'bytes_received': 0, 'bytes_sent': 0, 'add_ips_requests': 0, 'ips_uploaded': 0}
+        super().__init__(('127.0.0.1', port), MockRequestHandler)
+
+    def list_body(self, path, gzip_ok):
+        # 列表按当前版本（变更日志长度）缓存，版本变化后重新生成
+        version = len(self.changes)
+        key = (path, gzip_ok)
+        cached = self.bodies.get(key)
+        if cached is None or cached[0] != version:
+            grouped = {}
+            for ip, jail in (self.blocked if path == '/get_ips' else self.allowed).items():
+                grouped.setdefault(jail, []).append(ip)
+            body = json.dumps({'jails': grouped, 'total_items': sum(map(len, grouped.values())),
+                               'search_ip': ''}).encode('utf-8')
+            if gzip_ok:
+                body = gzip.compress(body, compresslevel=6)
+            cached = (version, f'"{path.strip("/")}-{version}"', body)
+            self.bodies[key] = cached
+        return cached[1], cached[2]
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+            self.server.stats['bytes_sent'] += len(body)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode('utf-8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        if url.path == '/_stats':
+            with server.lock:
+                stats = dict(server.stats)
+            self.send_body(200, json.dumps(stats).encode('utf-8'))
+            return
+        if self.headers.get('Authorization') != f'Bearer {TOKEN}':
+            self.send_body(401, b'Unauthorized Access', 'text/html')
+            return
+        if url.path in ('/get_ips', '/get_allowed_ips'):
+            gzip_ok = 'gzip' in self.headers.get('Accept-Encoding', '')
+            with server.lock:
+                etag, body = server.list_body(url.path, gzip_ok)
+            headers = [('ETag', etag)]
+            if self.headers.get('If-None-Match') == etag:
+                self.send_body(304, b'', headers=headers)
+            else:
+                self.send_body(200, body, headers=headers + ([('Content-Encoding', 'gzip')] if gzip_ok else []))
+        elif url.path == '/changes':
+            since = parse_qs(url.query).get('since')
+            with server.lock:
+                cursor = len(server.changes)
+                if since is None or not 0 <= int(since[0]) <= cursor:
+                    payload = {'reset': True, 'cursor': cursor, 'changes': [], 'has_more': False}
+                else:
+                    start = int(since[0])
+                    changes = server.changes[start:start + 10000]
+                    payload = {'reset': False, 'cursor': start + len(changes), 'changes': changes,
+                               'has_more': start + len(changes) < cursor}
+            self.send_json(200, payload)
+        else:
+            self.send_json(404, {'error': 'Not Found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.stats['bytes_received'] += len(body)
+        if self.headers.get('Authorization') != f'Bearer {TOKEN}':
+            self.send_body(401, b'Unauthorized Access', 'text/html')
+            return
+        if urlparse(self.path).path != '/add_ips':
+            self.send_json(404, {'error': 'Not Found'})
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        jail = data.get('jail', '')
+        with server.lock:
+            # 与真实服务器一致：已被远程允许的IP不会因客户端上报重新封禁
+            added = [ip for ip in data.get('ips', []) if ip not in server.blocked and ip not in server.allowed]
+            for ip in added:
+                server.blocked[ip] = jail
+                server.changes.append({'ip_address': ip, 'status': 'blocked', 'jail': jail})
+            server.stats['add_ips_requests'] += 1
+            server.stats['ips_uploaded'] += len(data.get('ips', []))
+        self.send_json(201, {'message': 'IP地址已添加', 'added_ips': added})
+
+
+def serve_mock(args):
+    """--serve-mock 的子进程：运行模拟同步服务器"""
+    _, _, remote, allowed = build_dataset(args.local, args.remote, args.overlap, args.allowed, args.jails)
+    server = MockSyncServer(args.serve_mock, remote, allowed)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+class PhaseTimer:
+    """替换客户端模块中的函数，统计每个阶段的调用次数和累计耗时"""
+
+    def __init__(self, module):
+        self.module = module
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+
+    def wrap(self, name):
+        function = getattr(self.module, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+
+        setattr(self.module, name, timed)
+
+    def install(self):
+        for name in PHASES:
+            self.wrap(name)
+        # 统计客户端模块中的sleep（上传每批之后的固定等待）
+        original_sleep = time.sleep
+
+        def timed_sleep(seconds):
+            caller = sys._getframe(1).f_globals.get('__name__')
+            start = time.perf_counter()
+            original_sleep(seconds)
+            if caller == self.module.__name__:
+                self.record('sleep', time.perf_counter() - start)
+
+        time.sleep = timed_sleep
+        # 统计子进程数（fail2ban-client调用）
+        original_run = subprocess.run
+
+        def counted_run(*args, **kwargs):
+            self.record('subprocess', 0.0)
+            return original_run(*args, **kwargs)
+
+        subprocess.run = counted_run
+
+    def take(self):
+        with self._lock:
+            stats, self.stats = self.stats, {}
+        return {name: {'calls': entry['calls'], 'seconds': round(entry['seconds'], 4)}
+                for name, entry in sorted(stats.items())}
+
+
+def reset_peak_rss():
+    # 写入5到clear_refs重置进程的VmHWM（Linux 4.0+），失败时峰值为整个进程生命周期的峰值
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_mock_stats(port):
+    import requests
+    return requests.get(f'http://127.0.0.1:{port}/_stats', timeout=10).json()
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"模拟服务器进程已退出，退出码: {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("等待模拟服务器启动超时")
+
+
+def wait_for_socket(path, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"fail2ban替身进程已退出，退出码: {process.returncode}")
+        if os.path.exists(path):
+            return
+        time.sleep(0.1)
+    raise RuntimeError("等待fail2ban socket替身启动超时")
+
+
+def apply_overrides(config, overrides):
+    """按已有配置项的类型转换 --set 的取值"""
+    for key, value in overrides:
+        current = config.get(key)
+        if isinstance(current, bool):
+            config[key] = value.lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(current, int):
+            config[key] = int(value)
+        elif isinstance(current, float):
+            config[key] = float(value)
+        else:
+            config[key] = value
+
+
+def print_report(results):
+    for cycle in results['cycles']:
+        print(f"\n第 {cycle['cycle']} 个同步周期：耗时 {cycle['seconds']} 秒，fail2ban-client 调用 {cycle['fail2ban_client_calls']} 次，"
+              f"子进程 {cycle['subprocesses']} 个，上传 {cycle['bytes_uploaded']} 字节，下载 {cycle['bytes_downloaded']} 字节，"
+              f"内存峰值 {cycle['peak_rss_bytes'] / 1048576:.1f} MB"
+              + (f"（Python分配峰值 {cycle['tracemalloc_peak_bytes'] / 1048576:.1f} MB）"
+                 if cycle.get('tracemalloc_peak_bytes') is not None else ''))
+        print(f"{'阶段':<28}{'调用次数':>8}{'累计秒数':>12}")
+        for name, entry in cycle['phases'].items():
+            print(f"{name:<28}{entry['calls']:>8}{entry['seconds']:>12}")
+
+
+def print_comparison(results, baseline):
+    """与之前保存的结果比较每个周期的总耗时和各阶段耗时"""
+    print(f"\n与 {baseline.get('version') or '基准结果'} 比较")
+    for cycle, old in zip(results['cycles'], baseline.get('cycles', [])):
+        print(f"\n第 {cycle['cycle']} 个同步周期：{old['seconds']} -> {cycle['seconds']} 秒")
+        for name, entry in cycle['phases'].items():
+            old_entry = old['phases'].get(name)
+            if old_entry and old_entry['seconds'] != entry['seconds']:
+                print(f"  {name:<28}{old_entry['seconds']:>10} -> {entry['seconds']:<10}")
+
+
+def get_version():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fail2ban-sync 客户端同步性能测试')
+    parser.add_argument('--local', type=int, default=50000, help='本地fail2ban中已封禁的IP数（平均分布在各jail中）')
+    parser.add_argument('--remote', type=int, default=200000, help='服务器上的封禁IP数')
+    parser.add_argument('--overlap', type=float, default=0.5, help='本地封禁IP中已在服务器封禁列表中的比例')
+    parser.add_argument('--allowed', type=int, default=1000, help='服务器上的允许IP数（取自本地独有的封禁IP，会在本地被解禁）')
+    parser.add_argument('--jails', type=int, default=2, help='jail数')
+    parser.add_argument('--fail2ban', choices=('cli', 'socket'), default='cli',
+                        help='模拟fail2ban的方式：fail2ban-client替身脚本或fake_fail2ban_server.py的socket替身')
+    parser.add_argument('--latency', type=float, default=0.0, help='每条fail2ban命令的模拟延迟（秒）')
+    parser.add_argument('--cycles', type=int, default=2, help='连续执行的同步周期数（第一个周期为全量同步）')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='覆盖客户端配置项，如 delta_sync=false、jail_workers=1，可多次指定')
+    parser.add_argument('--tracemalloc', action='store_true', help='同时统计Python内存分配峰值（会明显降低速度）')
+    parser.add_argument('--work-dir', help='工作目录（默认使用临时目录并在结束后删除）')
+    parser.add_argument('--output', default='client_benchmark_results.json', help='结果JSON文件路径')
+    parser.add_argument('--compare', help='与之前保存的结果JSON比较')
+    parser.add_argument('--serve-mock', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_mock:
+        return serve_mock(args)
+
+    overrides = []
+    for item in args.set:
+        key, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f"无效的配置项: {item}")
+        overrides.append((key.strip(), value.strip()))
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='f2bsync-client-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    state_dir = os.path.join(work_dir, 'fail2ban')
+    os.makedirs(state_dir, exist_ok=True)
+    dbfile = os.path.join(state_dir, 'fail2ban.sqlite3')
+    open(dbfile, 'a').close()
+    calls_log = os.path.join(state_dir, 'calls.log')
+
+    jail_names, local, _, _ = build_dataset(args.local, args.remote, args.overlap, args.allowed, args.jails)
+    processes = []
+    try:
+        # 本地封禁IP
+        socket_path = os.path.join(work_dir, 'fail2ban.sock')
+        if args.fail2ban == 'cli':
+            for jail in jail_names:
+                with open(os.path.join(state_dir, f'{jail}.txt'), 'w') as f:
+                    f.write(''.join(f'{ip}\n' for ip_jail, ip in local if ip_jail == jail))
+            bin_dir = os.path.join(work_dir, 'bin')
+            os.makedirs(bin_dir, exist_ok=True)
+            stub = os.path.join(bin_dir, 'fail2ban-client')
+            with open(stub, 'w') as f:
+                f.write(FAIL2BAN_CLIENT_STUB.format(python=sys.executable, state_dir=state_dir, latency=args.latency,
+                                                    dbfile=dbfile))
+            os.chmod(stub, 0o755)
+            os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+            # socket不存在时客户端使用fail2ban-client
+            socket_path = os.path.join(work_dir, 'no-fail2ban.sock')
+        else:
+            banned_file = os.path.join(state_dir, 'banned.txt')
+            with open(banned_file, 'w') as f:
+                f.write(''.join(f'{jail} {ip}\n' for jail, ip in local))
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(SCRIPT_DIR, 'fake_fail2ban_server.py'), '--socket', socket_path,
+                 '--jails', ','.join(jail_names), '--latency', str(args.latency), '--banned', banned_file,
+                 '--dbfile', dbfile], stdout=subprocess.DEVNULL))
+            wait_for_socket(socket_path, processes[-1])
+
+        port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve-mock', str(port), '--local', str(args.local),
+             '--remote', str(args.remote), '--overlap', str(args.overlap), '--allowed', str(args.allowed),
+             '--jails', str(args.jails)]))
+        wait_for_port(port, processes[-1])
+        log_message(f"模拟服务器已启动，端口: {port}；本地封禁 {args.local} 个IP，远端封禁 {args.remote} 个IP，"
+                    f"{len(jail_names)} 个jail，fail2ban替身: {args.fail2ban}")
+
+        sys.path.insert(0, SCRIPT_DIR)
+        import client
+        # 只把日志写入文件，控制台只输出测试结果
+        logger = client.setup_logging(os.path.join(work_dir, 'client.log'), 100 * 1048576, 1, console=False)
+        config = client.load_config(logger)
+        config['server'] = {'protocol': 'http', 'host': '127.0.0.1', 'port': str(port)}
+        config['auth'] = {'token': TOKEN}
+        config['fail2ban'] = {'jails': jail_names, 'jail': jail_names[0], 'socket': socket_path,
+                              'batch_size': client.DEFAULT_FAIL2BAN_BATCH_SIZE, 'dbfile': dbfile}
+        config['state_file'] = os.path.join(work_dir, 'sync_state.json')
+        config['local_state_file'] = os.path.join(work_dir, 'local_state.json')
+        config['list_cache_dir'] = os.path.join(work_dir, 'list_cache')
+        apply_overrides(config, overrides)
+
+        timer = PhaseTimer(client)
+        timer.install()
+        results = {
+            'version': get_version(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dataset': {'local': args.local, 'remote': args.remote, 'overlap': args.overlap,
+                        'allowed': args.allowed, 'jails': args.jails},
+            'fail2ban': args.fail2ban,
+            'latency': args.latency,
+            'config_overrides': dict(overrides),
+            'cycles': [],
+        }
+        # 守护进程模式下跨周期保留的内存状态
+        cache = {}
+        for index in range(1, args.cycles + 1):
+            before = get_mock_stats(port)
+            calls_before = sum(1 for _ in open(calls_log)) if os.path.exists(calls_log) else 0
+            reset_peak_rss()
+            if args.tracemalloc:
+                tracemalloc.start()
+            start = time.perf_counter()
+            exit_code = client.run_sync_cycle(config, logger, cache)
+            seconds = time.perf_counter() - start
+            traced_peak = None
+            if args.tracemalloc:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            after = get_mock_stats(port)
+            phases = timer.take()
+            calls_after = sum(1 for _ in open(calls_log)) if os.path.exists(calls_log) else 0
+            cycle = {
+                'cycle': index,
+                'exit_code': exit_code,
+                'seconds': round(seconds, 4),
+                'phases': {name: entry for name, entry in phases.items() if name != 'subprocess'},
+                'subprocesses': phases.get('subprocess', {}).get('calls', 0),
+                'fail2ban_client_calls': calls_after - calls_before,
+                # 不含本次统计本身的/_stats请求
+                'requests': after['requests'] - before['requests'] - 1,
+                'bytes_uploaded': after['bytes_received'] - before['bytes_received'],
+                'bytes_downloaded': after['bytes_sent'] - before['bytes_sent'] - len(json.dumps(before)),
+                'ips_uploaded': after['ips_uploaded'] - before['ips_uploaded'],
+                'peak_rss_bytes': peak_rss_bytes(),
+                'tracemalloc_peak_bytes': traced_peak,
+            }
+            results['cycles'].append(cycle)
+            log_message(f"第 {index} 个同步周期完成，耗时 {cycle['seconds']} 秒")
+        client.reset_http_session()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_report(results)
+    if baseline is not None:
+        print_comparison(results, baseline)
+    log_message(f"结果已保存到 {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -4,15 +4,24 @@ import json
 import ast
 import re
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
 import configparser
+import queue
+import atexit
 import socket
+import ipaddress
 from datetime import datetime
 import time
 import sys
 import gzip
 import io
+import signal
+import random
+import argparse
+import threading
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 
 # 默认配置
@@ -25,40 +34,79 @@ DEFAULT_CLIENT_CONFIG = {
     'logging': {
         'log_file': 'client.log',
         'max_bytes': '1048576',
-        'backup_count': '3'
+        'backup_count': '3',
+        'log_level': 'INFO',
+        'log_queue': 'true'
     },
     'fail2ban': {
         'jails': 'sshd'  # 支持多个jail，用逗号分隔
     }
 }
 
-def setup_logging(log_file, max_bytes, backup_count):
+# 守护进程模式下跨同步周期复用的HTTP会话（保持长连接，避免每次重新建立TCP/TLS连接）
+_http_session = None
+
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        _http_session.mount('http://', adapter)
+        _http_session.mount('https://', adapter)
+    return _http_session
+
+def reset_http_session():
+    global _http_session
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+
+# 队列日志的后台线程：同步线程只把日志记录放入队列，由该线程写入文件和控制台
+_log_listener = None
+
+def stop_log_listener():
+    """写出队列中剩余的日志并停止后台日志线程"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+atexit.register(stop_log_listener)
+
+def setup_logging(log_file, max_bytes, backup_count, log_level='INFO', log_queue=True, console=True):
+    global _log_listener
     logger = logging.getLogger('ip_client')
-    logger.setLevel(logging.INFO)
+    logger.setLevel(getattr(logging, log_level, logging.INFO))
     
-    # 清除已有的handler，避免重复添加
-    if logger.handlers:
-        for handler in logger.handlers:
-            logger.removeHandler(handler)
+    # 清除已有的handler，避免重复添加（重新加载配置时也会调用）
+    stop_log_listener()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
     
     # 文件日志handler
-    file_handler = RotatingFileHandler(
+    handlers = [RotatingFileHandler(
         log_file,
         maxBytes=int(max_bytes),
         backupCount=int(backup_count)
-    )
-    file_handler.setLevel(logging.INFO)
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+    )]
+    if console:
+        handlers.append(logging.StreamHandler())
     
     # 设置日志格式
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+    for handler in handlers:
+        handler.setFormatter(formatter)
     
     # 添加handler
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if log_queue:
+        log_records = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(log_records))
+        _log_listener = QueueListener(log_records, *handlers, respect_handler_level=True)
+        _log_listener.start()
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
     
     return logger
 
@@ -104,21 +152,46 @@ def load_config(basic_logger=None):
     sync_remote_banned_ips = config.getboolean('DEFAULT', 'sync_remote_banned_ips', fallback=True)
     sync_local_banned_ips = config.getboolean('DEFAULT', 'sync_local_banned_ips', fallback=True)
     sync_allowed_ips = config.getboolean('DEFAULT', 'sync_allowed_ips', fallback=True)
+    sync_interval = config.getfloat('DEFAULT', 'sync_interval', fallback=60)
+    sync_jitter = config.getfloat('DEFAULT', 'sync_jitter', fallback=10)
+    jail_workers = config.getint('DEFAULT', 'jail_workers', fallback=4)
+    delta_sync = config.getboolean('DEFAULT', 'delta_sync', fallback=True)
+    stream_lists = config.getboolean('DEFAULT', 'stream_lists', fallback=True)
+    binary_lists = config.getboolean('DEFAULT', 'binary_lists', fallback=False)
+    aggregate_lists = config.getboolean('DEFAULT', 'aggregate_lists', fallback=False)
+    push_events = config.getboolean('DEFAULT', 'push_events', fallback=False)
+    state_file = config.get('DEFAULT', 'state_file', fallback='sync_state.json')
+    if not os.path.isabs(state_file):
+        state_file = os.path.join(script_dir, state_file)
+    local_state_file = config.get('DEFAULT', 'local_state_file', fallback='local_state.json')
+    if not os.path.isabs(local_state_file):
+        local_state_file = os.path.join(script_dir, local_state_file)
+    local_state_max_age = config.getfloat('DEFAULT', 'local_state_max_age', fallback=300)
+    # 列表缓存目录，留空表示不缓存
+    list_cache_dir = config.get('DEFAULT', 'list_cache_dir', fallback='list_cache').strip()
+    if list_cache_dir and not os.path.isabs(list_cache_dir):
+        list_cache_dir = os.path.join(script_dir, list_cache_dir)
     
     return {
         'server': {
             'host': config.get('server', 'host', fallback='192.168.1.1'),
             'port': config.get('server', 'port', fallback='5000'),
-            'protocol': config.get('server', 'protocol', fallback='http')
+            'protocol': config.get('server', 'protocol', fallback='http'),
+            'events_url': config.get('server', 'events_url', fallback='').strip()
         },
         'logging': {
             'log_file': config.get('logging', 'log_file', fallback='client.log'),
             'max_bytes': config.get('logging', 'max_bytes', fallback='1048576'),
-            'backup_count': config.get('logging', 'backup_count', fallback='3')
+            'backup_count': config.get('logging', 'backup_count', fallback='3'),
+            'log_level': config.get('logging', 'log_level', fallback='INFO').upper(),
+            'log_queue': config.getboolean('logging', 'log_queue', fallback=True)
         },
         'fail2ban': {
             'jails': jails,
-            'jail': jails[0] if jails else 'sshd'  # 向后兼容，返回第一个jail
+            'jail': jails[0] if jails else 'sshd',  # 向后兼容，返回第一个jail
+            'socket': config.get('fail2ban', 'socket', fallback=DEFAULT_FAIL2BAN_SOCKET),
+            'batch_size': config.getint('fail2ban', 'batch_size', fallback=DEFAULT_FAIL2BAN_BATCH_SIZE),
+            'dbfile': config.get('fail2ban', 'dbfile', fallback=DEFAULT_FAIL2BAN_DBFILE)
         },
         'auth': {
             'token': token
@@ -127,14 +200,56 @@ def load_config(basic_logger=None):
         'sync_remove_unlisted_ips': sync_remove_unlisted_ips,
         'sync_remote_banned_ips': sync_remote_banned_ips,
         'sync_local_banned_ips': sync_local_banned_ips,
-        'sync_allowed_ips': sync_allowed_ips
+        'sync_allowed_ips': sync_allowed_ips,
+        'delta_sync': delta_sync,
+        'stream_lists': stream_lists,
+        'binary_lists': binary_lists,
+        'aggregate_lists': aggregate_lists,
+        'push_events': push_events,
+        'state_file': state_file,
+        'local_state_file': local_state_file,
+        'local_state_max_age': local_state_max_age,
+        'list_cache_dir': list_cache_dir,
+        'sync_interval': sync_interval,
+        'sync_jitter': sync_jitter,
+        'jail_workers': jail_workers
     }
 
+def _read_jail_banned_ips(jail, socket_path=None):
+    """读取fail2ban中一个jail当前的封禁IP，失败时抛出RuntimeError
+
+    fail2ban服务端socket可用时直接取得IP列表，否则解析 fail2ban-client status 的输出
+    """
+    if socket_path and os.path.exists(socket_path):
+        try:
+            with Fail2BanSocketClient(socket_path) as f2b_socket:
+                status = f2b_socket.send(['status', jail])
+            for section, values in status:
+                if section == 'Actions':
+                    for name, value in values:
+                        if name == 'Banned IP list':
+                            return [str(ip) for ip in value]
+            raise RuntimeError("fail2ban返回的状态中没有封禁IP列表")
+        except OSError:
+            # socket不可用时改用fail2ban-client
+            pass
+    
+    result = subprocess.run(['fail2ban-client', 'status', jail],
+                            capture_output=True, text=True, timeout=10)
+    if result.returncode != 0:
+        raise RuntimeError(f"执行fail2ban-client命令失败: {result.stderr}")
+    
+    # 查找"Banned IP list:"行
+    for line in result.stdout.split('\n'):
+        if 'Banned IP list:' in line:
+            # 提取IP地址部分并分割多个IP
+            return line.split(':', 1)[1].split()
+    return []
+
 def get_banned_ips(config, logger=None, jail=None):
     """获取fail2ban中指定jail的封禁IP列表"""
     log_info = logger.info if logger else print    
     log_error = logger.error if logger else print
-    log_warning = logger.warning if logger and hasattr(logger, 'warning') else print
     
     try:
         # 获取主机名以增强日志上下文
@@ -146,34 +261,19 @@ def get_banned_ips(config, logger=None, jail=None):
         else:
             # 否则查询所有配置的jails
             jails_to_query = config['fail2ban']['jails']
+        socket_path = config.get('fail2ban', {}).get('socket')
         
         all_banned_ips = {}
        
         for current_jail in jails_to_query:
             log_info(f"[{host_name}] 开始获取 jail {current_jail} 的本地封禁IP")
-            # 调用fail2ban-client获取该jail的封禁IP
-            result = subprocess.run(['fail2ban-client', 'status', current_jail], 
-                                   capture_output=True, text=True, timeout=10)
-            
-            if result.returncode != 0:
-                log_error(f"[{host_name}] 执行fail2ban-client命令失败(jail: {current_jail}): {result.stderr}")
+            try:
+                banned_ips = _read_jail_banned_ips(current_jail, socket_path)
+            except (RuntimeError, subprocess.SubprocessError) as e:
+                log_error(f"[{host_name}] 获取 jail {current_jail} 的封禁IP失败: {str(e)}")
                 all_banned_ips[current_jail] = []
                 continue
             
-            # 解析输出获取IP
-            output = result.stdout
-            banned_ips = []
-            
-            # 查找"Banned IP list:"行
-            for line in output.split('\n'):
-                if 'Banned IP list:' in line:
-                    # 提取IP地址部分
-                    ip_part = line.split(':', 1)[1].strip()
-                    if ip_part:
-                        # 分割多个IP
-                        banned_ips = [ip.strip() for ip in ip_part.split()]
-                    break
-            
             all_banned_ips[current_jail] = banned_ips
             log_info(f"[{host_name}] 获取完成: jail {current_jail} 共有 {len(banned_ips)} 个本地封禁IP")
         
@@ -187,6 +287,94 @@ def get_banned_ips(config, logger=None, jail=None):
         # 如果指定了jail，返回空列表；否则返回空字典
         return [] if jail else {}
 
+class LocalBanCache:
+    """本地fail2ban封禁状态缓存，保存每个jail的封禁IP及最近一次核对的时间，持久化到local_state_file
+
+    fail2ban数据库文件（[fail2ban] dbfile）未变化且距上次核对不超过max_age秒时直接使用缓存，
+    不再读取jail状态；本客户端执行的banip/unbanip同时记入缓存。封禁到期不会修改fail2ban数据库，
+    因此max_age也是到期IP从缓存中消失的最长延迟。找不到数据库文件时每次都读取jail状态。
+    """
+
+    def __init__(self, state_file, max_age, dbfile, logger):
+        self.state_file = state_file
+        self.max_age = max_age
+        self.dbfile = dbfile
+        self.jails = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            if os.path.exists(state_file):
+                with open(state_file, 'r', encoding='utf-8') as f:
+                    for jail, entry in json.load(f).items():
+                        self.jails[jail] = {'ips': set(entry['ips']), 'checked': entry['checked'],
+                                            'signal': entry.get('signal')}
+        except Exception as e:
+            logger.warning("读取本地封禁状态文件失败，将重新读取fail2ban状态: %s", str(e))
+            self.jails = {}
+
+    def _signal(self):
+        """fail2ban数据库文件（及其WAL文件）的修改时间和大小，任何封禁/解禁都会改变它"""
+        if not self.dbfile:
+            return None
+        signal = []
+        for path in (self.dbfile, f"{self.dbfile}-wal"):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path == self.dbfile:
+                    return None
+                continue
+            signal.extend((stat.st_mtime_ns, stat.st_size))
+        return signal
+
+    def banned_ips(self, jail, socket_path, logger):
+        """返回jail的本地封禁IP列表，读取fail2ban状态失败时抛出RuntimeError"""
+        signal = self._signal()
+        with self._lock:
+            entry = self.jails.get(jail)
+            if (entry is not None and signal is not None and entry['signal'] == signal
+                    and 0 <= time.time() - entry['checked'] < self.max_age):
+                self.hits += 1
+                logger.info("fail2ban数据库未变化，使用缓存的 jail %s 本地封禁IP，共 %s 个", jail, len(entry['ips']))
+                return list(entry['ips'])
+        
+        checked = time.time()
+        ips = _read_jail_banned_ips(jail, socket_path)
+        with self._lock:
+            self.misses += 1
+            self.jails[jail] = {'ips': set(ips), 'checked': checked, 'signal': signal}
+            self.dirty = True
+        logger.info("已读取 jail %s 的本地封禁IP，共 %s 个", jail, len(ips))
+        return ips
+
+    def record(self, jail, banned=(), unbanned=()):
+        """记录本客户端对jail执行成功的banip/unbanip"""
+        with self._lock:
+            entry = self.jails.get(jail)
+            if entry is None:
+                return
+            entry['ips'].update(banned)
+            entry['ips'].difference_update(unbanned)
+            self.dirty = True
+
+    def save(self, logger):
+        """原子写入缓存文件，没有变化时跳过"""
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {jail: {'ips': sorted(entry['ips']), 'checked': entry['checked'], 'signal': entry['signal']}
+                    for jail, entry in self.jails.items()}
+            self.dirty = False
+        try:
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            logger.error("保存本地封禁状态文件失败: %s", str(e))
+
 def get_local_host_name( logger=None):
     log_func = logger.info if logger else print
     try:
@@ -287,7 +475,7 @@ def _send_banned_ips_batch(server_url, banned_ips, host_name, jail, token, log_f
                 }
                 
                 # 发送压缩后的请求
-                response = requests.post(url, headers=headers, data=compressed_data.read(), timeout=30)
+                response = get_http_session().post(url, headers=headers, data=compressed_data.read(), timeout=30)
             else:
                 # 数据较小时直接发送，避免压缩开销
                 headers = {
@@ -296,7 +484,7 @@ def _send_banned_ips_batch(server_url, banned_ips, host_name, jail, token, log_f
                 }
                 
                 # 直接发送未压缩数据
-                response = requests.post(url, headers=headers, json=data, timeout=30)
+                response = get_http_session().post(url, headers=headers, json=data, timeout=30)
                 
                 # 检查响应状态
             if response.status_code == 200 or response.status_code == 201:
@@ -337,26 +525,122 @@ def _send_banned_ips_batch(server_url, banned_ips, host_name, jail, token, log_f
 
 # send_banned_ips函数已在文件上方定义
 
-def main():
-    # 首先加载配置，获取日志设置
-    config = load_config()
-    
-    # 使用setup_logging函数配置完整的日志系统（包括文件和控制台）
+def setup_logging_from_config(config):
+    """使用配置中的日志设置创建带有文件和控制台处理器的logger"""
     log_config = config.get('logging', {})
-    log_file = log_config.get('log_file', 'client.log')
-    max_bytes = log_config.get('max_bytes', '1048576')
-    backup_count = log_config.get('backup_count', '3')
-    
-    # 调用setup_logging函数创建带有文件和控制台处理器的logger
-    basic_logger = setup_logging(log_file, max_bytes, backup_count)  
+    return setup_logging(
+        log_config.get('log_file', 'client.log'),
+        log_config.get('max_bytes', '1048576'),
+        log_config.get('backup_count', '3'),
+        log_level=log_config.get('log_level', 'INFO'),
+        log_queue=log_config.get('log_queue', True)
+    )
+
+class JailLoggerAdapter(logging.LoggerAdapter):
+    """并行处理多个jail时，为每条日志加上jail前缀，便于区分交错输出的日志"""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['jail']}] {msg}", kwargs
+
+def sync_jail(jail, config, basic_logger, server_url, token, host_name,
+              remote_banned_ips_data, remote_allowed_ips, f2b_socket_path, f2b_batch_size, local_bans=None):
+    """处理单个jail：获取本地封禁IP、应用允许/封禁规则并上传本地封禁IP
+
+    local_bans为LocalBanCache时优先使用缓存的本地封禁状态，并记录本次执行的banip/unbanip
+    """
+    jail_start = time.monotonic()
+    basic_logger.info("开始处理 jail: %s", jail)
+
+    # 获取该jail的本地封禁IP
+    try:
+        # 只获取一次本地封禁IP列表，用于后续所有操作
+        if local_bans is not None:
+            jail_banned_ips = local_bans.banned_ips(jail, f2b_socket_path, basic_logger)
+        else:
+            jail_banned_ips = get_banned_ips(config, basic_logger, jail=jail)
+        # 将jail_banned_ips赋值给local_banned_ips，避免重复获取
+        local_banned_ips = jail_banned_ips
+    except Exception as e:
+        basic_logger.error("获取 jail %s 的封禁IP时出错: %s", jail, str(e))
+        return False
+
+    # 应用允许IP规则到该jail
+    if config.get('sync_allowed_ips', True) and remote_allowed_ips:
+        basic_logger.info("开始应用允许IP规则到 jail: %s", jail)
+        # 获取该jail对应的远端封禁IP
+        remote_allowed_jailed_ips = remote_allowed_ips.get('jails', {})
+        remote_allowed_jailed_ips_data =  remote_allowed_jailed_ips.get(jail, [])
+        basic_logger.info("获取到 jail %s 的远端允许IP列表，共 %s 个IP", jail, len(remote_allowed_jailed_ips_data))
+        unbanned, _ = allow_ips_in_fail2ban(remote_allowed_jailed_ips_data, jail, basic_logger, f2b_socket_path,
+                                            f2b_batch_size)
+        if local_bans is not None:
+            local_bans.record(jail, unbanned=unbanned)
+        basic_logger.info("允许IP规则应用完成到 jail: %s", jail)
+
+    # 同步远端封禁IP到该jail
+    if config.get('sync_remote_banned_ips', True) and remote_banned_ips_data:
+        basic_logger.info("开始同步远端封禁IP到 jail: %s", jail)
+        # 复用已获取的local_banned_ips，不再重复获取IP列表
+
+        # 获取该jail对应的远端封禁IP
+        remote_jailed_ips = remote_banned_ips_data.get('jails', {})
+        jail_remote_ips =  remote_jailed_ips.get(jail, [])
+        basic_logger.info("获取到 jail %s 的远端封禁IP列表，共 %s 个IP", jail, len(jail_remote_ips))
+
+        # 比较差异，只获取需要添加的IP
+        to_add_ips, to_remove_ips = compare_ip_lists(jail_remote_ips, local_banned_ips)
+
+        if to_add_ips:
+            basic_logger.info("找到 %s 个需要添加到 jail %s 的IP", len(to_add_ips), jail)
+            banned, _ = add_ips_to_fail2ban(to_add_ips, jail, basic_logger, f2b_socket_path, f2b_batch_size)
+            if local_bans is not None:
+                local_bans.record(jail, banned=banned)
+        else:
+            basic_logger.info("jail %s 已包含所有远端封禁的IP，无需添加", jail)   
+        # 可选：处理需要移除的IP（如果需要）
+        if config.get('sync_remove_unlisted_ips', False) and to_remove_ips:
+            basic_logger.info("找到 %s 个需要从 jail %s 移除的IP", len(to_remove_ips), jail)
+            # 这里可以添加移除IP的逻辑
+            unbanned, _ = allow_ips_in_fail2ban(to_remove_ips, jail, basic_logger, f2b_socket_path, f2b_batch_size)
+            if local_bans is not None:
+                local_bans.record(jail, unbanned=unbanned)
+        else:
+            basic_logger.info("jail %s 已包含所有需要移除的IP，无需移除", jail)
+        basic_logger.info("远端封禁IP同步完成到 jail: %s", jail)
+
+    # 发送该jail的封禁IP到服务器
+    if jail_banned_ips and config.get('sync_local_banned_ips', True):
+        # 使用已获取的远端封禁IP（如果有），不再重复请求
+        # 如果远端列表为空，则所有本地IP都需要发送
+        if remote_banned_ips_data:
+            # 获取该jail对应的远端封禁IP
+            remote_jailed_ips = remote_banned_ips_data.get('jails', {})
+            jail_remote_ips = remote_jailed_ips.get(jail, [])
+            # 比较差异，只获取需要发送的IP
+            to_send_ips, _ = compare_ip_lists(jail_banned_ips, jail_remote_ips)
+        else:
+            to_send_ips = jail_banned_ips  # 远端为空时，所有本地封禁IP都需要上传
+        # 从服务器同步来的网段不作为本地封禁IP上传
+        to_send_ips = [ip for ip in to_send_ips if '/' not in ip]
+
+        if to_send_ips:
+            basic_logger.info("找到 %s 个需要从 jail %s 发送到服务器的IP", len(to_send_ips), jail)
+            success, failed = send_banned_ips(server_url, to_send_ips, host_name, jail, token, basic_logger)
+            if not success and failed:
+                basic_logger.error("jail %s 部分IP发送失败，共 %s 个", jail, len(failed))
+        else:
+            basic_logger.info("服务器已包含 jail %s 的所有本地封禁IP，无需发送", jail)
+
+    basic_logger.info("jail %s 处理完成", jail)
+    basic_logger.info("jail %s 处理耗时 %.2f 秒", jail, time.monotonic() - jail_start)
+    return True
+
+def run_sync_cycle(config, basic_logger, cache=None):
+    """执行一次完整的同步周期，cache用于守护进程模式下跨周期保留内存状态"""
+    if cache is None:
+        cache = {}
     
     try:
-        # 配置已经在函数开始处加载
-        
-        if not config:
-            basic_logger.error("无法加载配置文件")
-            return 1
-        
         # 获取配置参数
         server_config = config.get('server', {})
         protocol = server_config.get('protocol', 'http')
@@ -370,281 +654,741 @@ def main():
         # 获取所有配置的jail列表
         fail2ban_config = config.get('fail2ban', {})
         jails = fail2ban_config.get('jails', [])
+        f2b_socket_path = fail2ban_config.get('socket', DEFAULT_FAIL2BAN_SOCKET)
+        f2b_batch_size = fail2ban_config.get('batch_size', DEFAULT_FAIL2BAN_BATCH_SIZE)
         
         # 如果没有配置jails，使用单个jail作为后备
         if not jails:
             jail = fail2ban_config.get('jail', 'sshd')
             jails = [jail]
         
-        basic_logger.info(f"程序启动，服务器URL: {server_url}, Jails: {', '.join(jails)}")
+        basic_logger.info("程序启动，服务器URL: %s, Jails: %s", server_url, ', '.join(jails))
         
-        # 获取本地IP地址
-        host_name = get_local_host_name()
-        basic_logger.info(f"主机名: {host_name}")
+        # 获取本地主机名（守护进程模式下只获取一次）
+        if 'host_name' not in cache:
+            cache['host_name'] = get_local_host_name()
+            basic_logger.info("主机名: %s", cache['host_name'])
+        host_name = cache['host_name']
         
-        # 获取远端封禁IP（只获取一次，包含jail信息，用于所有jail）
-        remote_banned_ips_data = None
-        if config.get('sync_remote_banned_ips', True) or config.get('sync_local_banned_ips', True):
-            remote_banned_ips_data = get_remote_banned_ips(server_url, token, basic_logger)
+        # 本地封禁状态缓存（守护进程模式下跨周期复用，单次运行时从local_state_file读取）
+        local_bans = cache.get('local_bans')
+        if local_bans is None and config.get('local_state_max_age', 300) > 0:
+            local_bans = LocalBanCache(config['local_state_file'], config['local_state_max_age'],
+                                       fail2ban_config.get('dbfile', DEFAULT_FAIL2BAN_DBFILE), basic_logger)
+            cache['local_bans'] = local_bans
         
-        # 获取远端允许IP（只获取一次，用于所有jail）
+        need_remote_banned = config.get('sync_remote_banned_ips', True) or config.get('sync_local_banned_ips', True)
+        need_remote_allowed = config.get('sync_allowed_ips', True)
+        remote_banned_ips_data = None
         remote_allowed_ips = None
-        if config.get('sync_allowed_ips', True):
-            remote_allowed_ips = get_remote_allowed_ips(server_url, token, basic_logger)
+        stream_lists = config.get('stream_lists', True)
+        list_cache_dir = config.get('list_cache_dir')
+        binary_lists = config.get('binary_lists', False)
+        aggregate_lists = config.get('aggregate_lists', False)
         
-        # 遍历所有jail进行处理
-        for jail in jails:
-            basic_logger.info(f"开始处理 jail: {jail}")
+        if config.get('delta_sync', True) and (need_remote_banned or need_remote_allowed):
+            # 增量同步：只下载游标之后的变更，并应用到本地保存的远端视图
+            delta_banned, delta_allowed = sync_remote_state(server_url, token, config['state_file'], basic_logger,
+                                                             cache, stream_lists, list_cache_dir, jails, binary_lists)
+            remote_banned_ips_data = delta_banned if need_remote_banned else None
+            remote_allowed_ips = delta_allowed if need_remote_allowed else None
+            # 合并网段的封禁列表只能整体下载（列表未变化时服务器返回304），增量视图仍用于允许列表
+            if need_remote_banned and aggregate_lists:
+                remote_banned_ips_data = get_remote_banned_ips(server_url, token, basic_logger, stream_lists, list_cache_dir,
+                                                               jails, binary_lists, True)
+        else:
+            # 获取远端封禁IP（只获取一次，只包含本地配置的jail，用于所有jail）
+            if need_remote_banned:
+                remote_banned_ips_data = get_remote_banned_ips(server_url, token, basic_logger, stream_lists, list_cache_dir,
+                                                               jails, binary_lists, aggregate_lists)
             
-            # 获取该jail的本地封禁IP
+            # 获取远端允许IP（只获取一次，用于所有jail）
+            if need_remote_allowed:
+                remote_allowed_ips = get_remote_allowed_ips(server_url, token, basic_logger, stream_lists, list_cache_dir,
+                                                            jails, binary_lists)
+        
+        # 并行处理所有jail，工作线程数即全局并发上限
+        cycle_start = time.monotonic()
+        workers = max(1, min(config.get('jail_workers', 4), len(jails)))
+        
+        def run_jail(jail):
+            jail_logger = JailLoggerAdapter(basic_logger, {'jail': jail}) if workers > 1 else basic_logger
             try:
-                # 只获取一次本地封禁IP列表，用于后续所有操作
-                jail_banned_ips = get_banned_ips(config, basic_logger, jail=jail)
-                # 将jail_banned_ips赋值给local_banned_ips，避免重复获取
-                local_banned_ips = jail_banned_ips
+                return sync_jail(jail, config, jail_logger, server_url, token, host_name,
+                                 remote_banned_ips_data, remote_allowed_ips, f2b_socket_path, f2b_batch_size, local_bans)
             except Exception as e:
-                basic_logger.error(f"获取 jail {jail} 的封禁IP时出错: {str(e)}")
-                continue
-            
-            # 应用允许IP规则到该jail
-            if config.get('sync_allowed_ips', True) and remote_allowed_ips:
-                basic_logger.info(f"开始应用允许IP规则到 jail: {jail}")
-                # 获取该jail对应的远端封禁IP
-                remote_allowed_jailed_ips = remote_allowed_ips.get('jails', {})
-                remote_allowed_jailed_ips_data =  remote_allowed_jailed_ips.get(jail, [])
-                basic_logger.info(f"获取到 jail {jail} 的远端允许IP列表，共 {len(remote_allowed_jailed_ips_data)} 个IP")
-                allow_ips_in_fail2ban(remote_allowed_jailed_ips_data, jail, basic_logger)
-                basic_logger.info(f"允许IP规则应用完成到 jail: {jail}")
-            
-            # 同步远端封禁IP到该jail
-            if config.get('sync_remote_banned_ips', True) and remote_banned_ips_data:
-                basic_logger.info(f"开始同步远端封禁IP到 jail: {jail}")
-                # 复用已获取的local_banned_ips，不再重复获取IP列表
-                
-                # 获取该jail对应的远端封禁IP
-                remote_jailed_ips = remote_banned_ips_data.get('jails', {})
-                jail_remote_ips =  remote_jailed_ips.get(jail, [])
-                basic_logger.info(f"获取到 jail {jail} 的远端封禁IP列表，共 {len(jail_remote_ips)} 个IP")
-                
-                # 比较差异，只获取需要添加的IP
-                to_add_ips, to_remove_ips = compare_ip_lists(jail_remote_ips, local_banned_ips)
-                
-                if to_add_ips:
-                    basic_logger.info(f"找到 {len(to_add_ips)} 个需要添加到 jail {jail} 的IP")
-                    add_ips_to_fail2ban(to_add_ips, jail, basic_logger)
-                else:
-                    basic_logger.info(f"jail {jail} 已包含所有远端封禁的IP，无需添加")   
-                # 可选：处理需要移除的IP（如果需要）
-                if config.get('sync_remove_unlisted_ips', False) and to_remove_ips:
-                    basic_logger.info(f"找到 {len(to_remove_ips)} 个需要从 jail {jail} 移除的IP")
-                    # 这里可以添加移除IP的逻辑
-                    allow_ips_in_fail2ban(to_remove_ips, jail, basic_logger)
-                else:
-                    basic_logger.info(f"jail {jail} 已包含所有需要移除的IP，无需移除")
-                basic_logger.info(f"远端封禁IP同步完成到 jail: {jail}")
-            
-            # 发送该jail的封禁IP到服务器
-            if jail_banned_ips and config.get('sync_local_banned_ips', True):
-                # 使用已获取的远端封禁IP（如果有），不再重复请求
-                # 如果远端列表为空，则所有本地IP都需要发送
-                if remote_banned_ips_data:
-                    # 获取该jail对应的远端封禁IP
-                    remote_jailed_ips = remote_banned_ips_data.get('jails', {})
-                    jail_remote_ips = remote_jailed_ips.get(jail, [])
-                    # 比较差异，只获取需要发送的IP
-                    to_send_ips, _ = compare_ip_lists(jail_banned_ips, jail_remote_ips)
-                else:
-                    to_send_ips = jail_banned_ips  # 远端为空时，所有本地封禁IP都需要上传
-                
-                if to_send_ips:
-                    basic_logger.info(f"找到 {len(to_send_ips)} 个需要从 jail {jail} 发送到服务器的IP")
-                    success, failed = send_banned_ips(server_url, to_send_ips, host_name, jail, token, basic_logger)
-                    if not success and failed:
-                        basic_logger.error(f"jail {jail} 部分IP发送失败，共 {len(failed)} 个")
-                else:
-                    basic_logger.info(f"服务器已包含 jail {jail} 的所有本地封禁IP，无需发送")
-            
-            basic_logger.info(f"jail {jail} 处理完成")
+                basic_logger.error("处理 jail %s 时发生错误: %s", jail, str(e))
+                return False
+        
+        if workers == 1:
+            results = [run_jail(jail) for jail in jails]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jail') as executor:
+                results = list(executor.map(run_jail, jails))
+        
+        if local_bans is not None:
+            local_bans.save(basic_logger)
+            basic_logger.info("本地封禁状态缓存: 命中 %s 次，读取fail2ban状态 %s 次", local_bans.hits, local_bans.misses)
+        basic_logger.info("本次同步完成: 共 %s 个jail（成功 %s 个），并发数 %s，总耗时 %.2f 秒",
+                          len(jails), sum(1 for r in results if r), workers, time.monotonic() - cycle_start)
         return 0
     except Exception as e:
-        basic_logger.error(f"程序执行过程中发生错误: {str(e)}")
+        basic_logger.error("程序执行过程中发生错误: %s", str(e))
+        return 1
 
-def add_ips_to_fail2ban(ips, jail, logger):
-    if not ips:
-        logger.info("没有IP需要添加到Fail2Ban")
-        return
+# /events 连接的读取超时（秒），服务器默认每15秒发送一次心跳（events_heartbeat），超时说明连接已失效
+EVENTS_READ_TIMEOUT = 60
+
+class EventSubscriber(threading.Thread):
+    """订阅服务器的 /events 变更推送，在几秒内把远端封禁/放行应用到本地fail2ban
+
+    守护进程的同步周期仍按sync_interval执行，订阅连接断开期间由增量同步兜底；
+    重新连接时携带最后收到的游标（Last-Event-ID），断开期间的变更会被补发。
+    """
+
+    def __init__(self, config, logger, cache, wakeup_event, synced_event):
+        super().__init__(name='event-subscriber', daemon=True)
+        self.config = config
+        self.logger = logger
+        self.cache = cache
+        # 游标失效时唤醒主循环立即执行一次全量同步，并等待同步完成后重新订阅
+        self.wakeup_event = wakeup_event
+        self.synced_event = synced_event
+        self.stop_event = threading.Event()
+        self.response = None
+        server_config = config.get('server', {})
+        server_url = (f"{server_config.get('protocol', 'http')}://{server_config.get('host', 'localhost')}:"
+                      f"{server_config.get('port', '5000')}")
+        # /events 只由服务器的asyncio模式（async_server.py）提供，可以单独指定其地址
+        self.events_url = f"{(server_config.get('events_url') or server_url).rstrip('/')}/events"
+        self.token = config.get('auth', {}).get('token', '')
+        fail2ban_config = config.get('fail2ban', {})
+        self.jails = set(fail2ban_config.get('jails') or [fail2ban_config.get('jail', 'sshd')])
+        self.f2b_socket_path = fail2ban_config.get('socket', DEFAULT_FAIL2BAN_SOCKET)
+        self.f2b_batch_size = fail2ban_config.get('batch_size', DEFAULT_FAIL2BAN_BATCH_SIZE)
+
+    def stop(self):
+        self.stop_event.set()
+        self.synced_event.set()
+        response = self.response
+        if response is not None:
+            response.close()
+
+    def _sync_cursor(self):
+        # 等待主循环完成一次同步，从同步状态中取得游标（未启用增量同步时从服务器当前游标开始）
+        self.synced_event.wait()
+        self.synced_event.clear()
+        return self.cache.get('sync_state', {}).get('cursor')
+
+    def run(self):
+        cursor = self._sync_cursor()
+        max_delay = max(1.0, self.config.get('sync_interval', 60))
+        delay = 1.0
+        while not self.stop_event.is_set():
+            try:
+                result, cursor = self._listen(cursor)
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                self.logger.warning("变更推送连接中断 (%s): %s，%.0f 秒后重新连接", type(e).__name__, str(e), delay)
+                result = delay
+            finally:
+                self.response = None
+            if result == 'reset':
+                self.logger.info("变更推送游标已失效，等待全量同步完成后重新订阅")
+                self.synced_event.clear()
+                self.wakeup_event.set()
+                cursor = self._sync_cursor()
+                delay = 1.0
+            elif result == 'unsupported':
+                self.logger.warning("服务器不支持变更推送接口 %s（由服务器的 async_server.py 提供，可通过 [server] events_url 指定），"
+                                    "继续使用定时同步", self.events_url)
+                return
+            elif result is not None:
+                self.stop_event.wait(result)
+                delay = min(delay * 2, max_delay)
+            else:
+                delay = 1.0
+
+    def _listen(self, cursor):
+        """保持一个订阅连接直到其结束，返回 (后续动作, 最新游标)：None表示立即重新连接，
+        'reset'表示需要全量同步，'unsupported'表示服务器不支持，数字表示等待的秒数"""
+        headers = {'Authorization': f'Bearer {self.token}', 'Accept': 'text/event-stream'}
+        if cursor is not None:
+            headers['Last-Event-ID'] = str(cursor)
+        response = get_http_session().get(self.events_url, headers=headers, stream=True,
+                                          timeout=(10, EVENTS_READ_TIMEOUT))
+        self.response = response
+        try:
+            if response.status_code == 404:
+                return 'unsupported', cursor
+            if response.status_code != 200:
+                retry_after = response.headers.get('Retry-After', '')
+                self.logger.warning("订阅变更推送失败: HTTP %s，继续使用定时同步", response.status_code)
+                return float(retry_after) if retry_after.isdigit() else self.config.get('sync_interval', 60), cursor
+            
+            event, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if self.stop_event.is_set():
+                    break
+                if line:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'event':
+                        event = value
+                    elif field == 'data':
+                        data.append(value)
+                    continue
+                # 空行：一条事件结束
+                if event == 'ready':
+                    cursor = json.loads('\n'.join(data)).get('cursor', cursor)
+                    self.logger.info("已订阅服务器变更推送，游标: %s", cursor)
+                elif event == 'reset':
+                    return 'reset', cursor
+                elif event == 'changes':
+                    payload = json.loads('\n'.join(data))
+                    self._apply(payload.get('changes', []))
+                    cursor = payload.get('cursor', cursor)
+                event, data = None, []
+            return None, cursor
+        finally:
+            response.close()
+
+    def _apply(self, changes):
+        ban = {}
+        unban = {}
+        for change in changes:
+            ip = change.get('ip_address')
+            jail = change.get('jail')
+            if not ip or jail not in self.jails:
+                continue
+            if change.get('status') == 'blocked' and self.config.get('sync_remote_banned_ips', True):
+                ban.setdefault(jail, []).append(ip)
+            elif change.get('status') == 'allowed' and self.config.get('sync_allowed_ips', True):
+                unban.setdefault(jail, []).append(ip)
+        local_bans = self.cache.get('local_bans')
+        for jail, ips in unban.items():
+            self.logger.info("收到推送：jail %s 放行 %d 个IP", jail, len(ips))
+            unbanned, _ = allow_ips_in_fail2ban(ips, jail, self.logger, self.f2b_socket_path, self.f2b_batch_size)
+            if local_bans is not None:
+                local_bans.record(jail, unbanned=unbanned)
+        for jail, ips in ban.items():
+            self.logger.info("收到推送：jail %s 封禁 %d 个IP", jail, len(ips))
+            banned, _ = add_ips_to_fail2ban(ips, jail, self.logger, self.f2b_socket_path, self.f2b_batch_size)
+            if local_bans is not None:
+                local_bans.record(jail, banned=banned)
+
+def run_daemon(config, basic_logger):
+    """守护进程模式：常驻运行并按配置的间隔（加随机抖动）循环同步
+
+    SIGTERM/SIGINT 在当前周期结束后优雅退出，SIGHUP 重新加载 clientconfig.ini。
+    启用push_events时另有一个线程订阅服务器的变更推送，定时同步作为兜底。
+    """
+    stop_event = threading.Event()
+    reload_event = threading.Event()
+    wakeup_event = threading.Event()
+    synced_event = threading.Event()
+    subscriber = None
     
-    # 优化1: 批量处理 - 减少子进程创建开销
-    # 对于大量IP，建议分批处理以避免命令行过长
-    batch_size = 50  # 每批处理的IP数量
-    success_count = 0
-    failed_ips = []
+    def handle_stop(signum, frame):
+        stop_event.set()
+        wakeup_event.set()
     
-    # 分批处理IP列表
-    for i in range(0, len(ips), batch_size):
-        batch = ips[i:i+batch_size]
-        logger.info(f"正在处理IP批次 {i//batch_size + 1}/{(len(ips)-1)//batch_size + 1}, 共 {len(batch)} 个IP")
-        # 优化2: 对于少量IP使用单命令模式
-        if len(batch) <= 5:  # 少量IP仍保持逐个处理以获得更精确的错误报告
-            for ip in batch:
-                try:
-                    result = subprocess.run(['fail2ban-client', 'set', jail, 'banip', ip], 
-                                 capture_output=True, text=True, timeout=5)
-                    # 检查返回码而不仅仅是异常
-                    if result.returncode == 0:
-                        success_count += 1
-                        logger.info(f"[状态] jail {jail}: 成功封禁IP {ip}")
-                    else:
-                        failed_ips.append(ip)
-                        logger.warning(f"[状态] jail {jail}: 封禁IP {ip} 命令执行成功但返回非零码: {result.stderr}")
-                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-                    failed_ips.append(ip)
-                    logger.error(f"[状态] jail {jail}: 封禁IP {ip} 到Fail2Ban时出错: {str(e)}")
-        else:  # 大量IP使用批处理模式
+    def handle_reload(signum, frame):
+        reload_event.set()
+        wakeup_event.set()
+    
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, handle_reload)
+    
+    cache = {}
+    basic_logger.info("守护进程模式启动，同步间隔: %s 秒，随机抖动: %s 秒", config['sync_interval'], config['sync_jitter'])
+    if config.get('push_events'):
+        subscriber = EventSubscriber(config, basic_logger, cache, wakeup_event, synced_event)
+        subscriber.start()
+    
+    # 启动时随机延迟，避免大量客户端同时重启后集中请求服务器
+    wakeup_event.wait(random.uniform(0, config['sync_jitter']))
+    wakeup_event.clear()
+    
+    while not stop_event.is_set():
+        if reload_event.is_set():
+            reload_event.clear()
+            config = load_config()
+            basic_logger = setup_logging_from_config(config)
+            # 服务器地址或push_events可能已改变，重新建立订阅连接（先结束订阅，再关闭它使用的HTTP会话）
+            if subscriber is not None:
+                subscriber.stop()
+                subscriber = None
+            # 服务器地址可能已改变，重新建立HTTP会话；同步状态文件也可能已改变
+            reset_http_session()
+            cache.pop('sync_state', None)
+            cache.pop('local_bans', None)
+            synced_event.clear()
+            if config.get('push_events'):
+                subscriber = EventSubscriber(config, basic_logger, cache, wakeup_event, synced_event)
+                subscriber.start()
+            basic_logger.info("收到SIGHUP，配置已重新加载")
+        
+        cycle_start = time.monotonic()
+        run_sync_cycle(config, basic_logger, cache)
+        elapsed = time.monotonic() - cycle_start
+        synced_event.set()
+        
+        delay = max(0.0, config['sync_interval'] - elapsed) + random.uniform(0, config['sync_jitter'])
+        basic_logger.info("同步周期完成，耗时 %.2f 秒，%.1f 秒后开始下一次同步", elapsed, delay)
+        wakeup_event.wait(delay)
+        wakeup_event.clear()
+    
+    if subscriber is not None:
+        subscriber.stop()
+    reset_http_session()
+    basic_logger.info("守护进程已停止")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fail2BanSync 客户端')
+    parser.add_argument('--daemon', action='store_true',
+                        help='以守护进程模式常驻运行，按sync_interval循环同步')
+    args = parser.parse_args(argv)
+    
+    # 首先加载配置，获取日志设置
+    config = load_config()
+    
+    # 配置完整的日志系统（包括文件和控制台）
+    basic_logger = setup_logging_from_config(config)
+    
+    if not config:
+        basic_logger.error("无法加载配置文件")
+        return 1
+    
+    if args.daemon:
+        return run_daemon(config, basic_logger)
+    return run_sync_cycle(config, basic_logger)
+
+
+# fail2ban服务端socket协议的消息结束/关闭标记（与fail2ban-client使用相同的协议）
+FAIL2BAN_SOCKET_END = b'<F2B_END_COMMAND>'
+FAIL2BAN_SOCKET_CLOSE = b'<F2B_CLOSE_COMMAND>'
+DEFAULT_FAIL2BAN_SOCKET = '/var/run/fail2ban/fail2ban.sock'
+# fail2ban的持久化数据库，其修改时间用于判断本地封禁状态是否变化
+DEFAULT_FAIL2BAN_DBFILE = '/var/lib/fail2ban/fail2ban.sqlite3'
+# 每次banip/unbanip命令携带的最大IP数量
+DEFAULT_FAIL2BAN_BATCH_SIZE = 500
+# 通过fail2ban-client命令行传递IP时，单次调用参数的最大字节数
+FAIL2BAN_CLI_MAX_ARG_BYTES = 65536
+
+class Fail2BanSocketClient:
+    """直接连接fail2ban服务端的Unix socket，在一个连接上连续执行多条命令"""
+
+    def __init__(self, socket_path=DEFAULT_FAIL2BAN_SOCKET, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        self._sock = sock
+        return self
+
+    def send(self, command):
+        """发送一条命令并返回结果，fail2ban返回错误码时抛出RuntimeError"""
+        message = pickle.dumps([str(part) for part in command], pickle.HIGHEST_PROTOCOL)
+        self._sock.sendall(message + FAIL2BAN_SOCKET_END)
+        
+        response = b''
+        while response.rfind(FAIL2BAN_SOCKET_END, -32) == -1:
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise ConnectionResetError("fail2ban服务端关闭了连接")
+            response += chunk
+        code, result = pickle.loads(response[:response.rfind(FAIL2BAN_SOCKET_END)])
+        if code != 0:
+            raise RuntimeError(f"fail2ban命令执行失败: {result}")
+        return result
+
+    def close(self):
+        if self._sock is not None:
             try:
-                # 批处理模式 - 逐个处理IP以保证状态跟踪
-                logger.info(f"[状态] jail {jail}: 开始批量封禁 {len(batch)} 个IP")
-                for ip in batch:
-                    try:
-                        result = subprocess.run(['fail2ban-client', 'set', jail, 'banip', ip], 
-                                     capture_output=True, text=True, timeout=3, check=False)
-                        if result.returncode == 0:
-                            success_count += 1
-                        else:
-                            failed_ips.append(ip)
-                            logger.warning(f"[状态] jail {jail}: 批量封禁IP {ip} 失败")
-                    except Exception:
-                        failed_ips.append(ip)
-            except Exception as e:
-                logger.error(f"[状态] jail {jail}: 批处理IP时发生错误: {str(e)}")
-                # 如果批处理失败，尝试逐个处理剩余IP
-                logger.warning(f"[状态] jail {jail}: 开始尝试逐个处理失败的IP")
-                for ip in batch:
-                    try:
-                        result = subprocess.run(['fail2ban-client', 'set', jail, 'banip', ip], 
-                                     capture_output=True, text=True, timeout=3)
-                        if result.returncode == 0:
-                            success_count += 1
-                            logger.info(f"[状态] jail {jail}: 备用方式成功封禁IP {ip}")
-                        else:
-                            failed_ips.append(ip)
-                    except Exception:
-                        failed_ips.append(ip)
+                self._sock.sendall(FAIL2BAN_SOCKET_CLOSE + FAIL2BAN_SOCKET_END)
+            except Exception:
+                pass
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _chunk_ips(ips, batch_size, max_bytes=None):
+    """按IP数量（以及可选的参数总字节数）切分IP列表"""
+    chunk = []
+    chunk_bytes = 0
+    for ip in ips:
+        ip_bytes = len(ip) + 1
+        if chunk and (len(chunk) >= batch_size or (max_bytes and chunk_bytes + ip_bytes > max_bytes)):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(ip)
+        chunk_bytes += ip_bytes
+    if chunk:
+        yield chunk
+
+def _apply_fail2ban_action(ips, jail, action, logger, socket_path=DEFAULT_FAIL2BAN_SOCKET,
+                           batch_size=DEFAULT_FAIL2BAN_BATCH_SIZE):
+    """批量执行banip/unbanip，返回(成功IP列表, 失败IP列表)
+
+    优先通过fail2ban服务端socket在同一连接上发送多IP命令；socket不可用时
+    退回到单次携带多个IP的fail2ban-client调用。某批命令失败时对该批二分拆分，
+    直到定位出具体失败的IP，从而保留逐IP的成功/失败统计。
+    """
+    f2b_socket = None
+    if socket_path and os.path.exists(socket_path):
+        try:
+            f2b_socket = Fail2BanSocketClient(socket_path).connect()
+        except Exception as e:
+            logger.warning("[状态] jail %s: 无法连接fail2ban socket %s，改用fail2ban-client: %s",
+                           jail, socket_path, str(e))
+    
+    def execute(chunk):
+        try:
+            if f2b_socket is not None:
+                f2b_socket.send(['set', jail, action] + chunk)
+                return True
+            result = subprocess.run(['fail2ban-client', 'set', jail, action] + chunk,
+                                    capture_output=True, text=True, timeout=5 + len(chunk) * 0.05)
+            if result.returncode != 0:
+                logger.debug("[状态] jail %s: %s 返回非零码: %s", jail, action, result.stderr.strip())
+            return result.returncode == 0
+        except (RuntimeError, subprocess.SubprocessError) as e:
+            logger.debug("[状态] jail %s: %s 执行失败: %s", jail, action, e)
+            return False
+    
+    succeeded = []
+    failed = []
+    max_bytes = None if f2b_socket is not None else FAIL2BAN_CLI_MAX_ARG_BYTES
+    try:
+        chunks = list(_chunk_ips(ips, batch_size, max_bytes))
+        for index, chunk in enumerate(chunks, 1):
+            logger.debug("[状态] jail %s: 正在执行 %s 批次 %d/%d, 共 %d 个IP", jail, action, index, len(chunks), len(chunk))
+            pending = [chunk]
+            while pending:
+                part = pending.pop()
+                if execute(part):
+                    succeeded.extend(part)
+                elif len(part) == 1:
+                    failed.append(part[0])
+                else:
+                    # 批次失败：二分拆分后重试，定位具体失败的IP
+                    middle = len(part) // 2
+                    pending.append(part[middle:])
+                    pending.append(part[:middle])
+    except (OSError, ConnectionError) as e:
+        # socket连接中断或无法执行fail2ban-client：剩余IP视为失败，下一个同步周期会重新处理
+        logger.error("[状态] jail %s: 执行fail2ban命令时出错: %s", jail, str(e))
+        done = set(succeeded) | set(failed)
+        failed.extend(ip for ip in ips if ip not in done)
+    finally:
+        if f2b_socket is not None:
+            f2b_socket.close()
+    
+    return succeeded, failed
+
+# 失败的IP在警告日志中最多列出的数量，封禁风暴期间不把整批IP写入日志；完整列表在DEBUG级别记录
+FAILED_IPS_LOG_LIMIT = 20
+
+def _log_failed_ips(logger, jail, action_name, failed_ips):
+    if not failed_ips:
+        return
+    if len(failed_ips) <= FAILED_IPS_LOG_LIMIT:
+        logger.warning("[状态] jail %s: 以下IP%s失败: %s", jail, action_name, failed_ips)
+        return
+    logger.warning("[状态] jail %s: %d 个IP%s失败，前 %d 个: %s", jail, len(failed_ips), action_name,
+                   FAILED_IPS_LOG_LIMIT, failed_ips[:FAILED_IPS_LOG_LIMIT])
+    logger.debug("[状态] jail %s: %s失败的全部IP: %s", jail, action_name, failed_ips)
+
+def add_ips_to_fail2ban(ips, jail, logger, socket_path=DEFAULT_FAIL2BAN_SOCKET,
+                        batch_size=DEFAULT_FAIL2BAN_BATCH_SIZE):
+    if not ips:
+        logger.info("没有IP需要添加到Fail2Ban")
+        return [], []
+    
+    logger.info("[状态] jail %s: 开始批量封禁 %d 个IP", jail, len(ips))
+    succeeded, failed_ips = _apply_fail2ban_action(ips, jail, 'banip', logger, socket_path, batch_size)
     
     # 记录详细的统计信息
-    logger.info(f"[状态] jail {jail}: IP封禁操作完成 - 总计: {len(ips)} 个IP, 成功: {success_count}, 失败: {len(failed_ips)}")
-    if failed_ips:
-        logger.warning(f"[状态] jail {jail}: 以下IP封禁失败: {failed_ips}")
+    logger.info("[状态] jail %s: IP封禁操作完成 - 总计: %d 个IP, 成功: %d, 失败: %d", jail, len(ips), len(succeeded), len(failed_ips))
+    _log_failed_ips(logger, jail, '封禁', failed_ips)
+    return succeeded, failed_ips
 
-def allow_ips_in_fail2ban(ips, jail, logger):
+def allow_ips_in_fail2ban(ips, jail, logger, socket_path=DEFAULT_FAIL2BAN_SOCKET,
+                          batch_size=DEFAULT_FAIL2BAN_BATCH_SIZE):
     if not ips:
         logger.info("没有IP需要在Fail2Ban中被允许")
-        return
+        return [], []
     
-    # 优化1: 批量处理 - 减少子进程创建开销
-    batch_size = 50  # 每批处理的IP数量
-    success_count = 0
-    failed_ips = []
-    
-    # 分批处理IP列表
-    for i in range(0, len(ips), batch_size):
-        batch = ips[i:i+batch_size]
-        logger.info(f"正在处理IP解禁批次 {i//batch_size + 1}/{(len(ips)-1)//batch_size + 1}, 共 {len(batch)} 个IP")
-        
-        # 优化2: 根据IP数量选择不同的处理策略
-        if len(batch) <= 5:  # 少量IP保持逐个处理以获得更精确的错误报告
-            logger.info(f"[状态] jail {jail}: 开始逐个解禁 {len(batch)} 个IP")
-            for ip in batch:
-                try:
-                    result = subprocess.run(['fail2ban-client', 'set', jail, 'unbanip', ip], 
-                                 capture_output=True, text=True, timeout=5)
-                    if result.returncode == 0:
-                        success_count += 1
-                        logger.info(f"[状态] jail {jail}: 成功解禁IP {ip}")
-                    else:
-                        failed_ips.append(ip)
-                        logger.warning(f"[状态] jail {jail}: 解禁IP {ip} 返回非零码: {result.stderr}")
-                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-                    failed_ips.append(ip)
-                    logger.error(f"[状态] jail {jail}: 解禁IP {ip} 失败: {str(e)}")
-        else:  # 大量IP使用批处理模式
-            try:
-                logger.info(f"[状态] jail {jail}: 开始批量解禁 {len(batch)} 个IP")
-                for ip in batch:
-                    try:
-                        # 使用单独进程但减少不必要的参数
-                        result = subprocess.run(['fail2ban-client', 'set', jail, 'unbanip', ip], 
-                                     capture_output=True, text=True, timeout=3, check=False)
-                        if result.returncode == 0:
-                            success_count += 1
-                        else:
-                            failed_ips.append(ip)
-                            logger.warning(f"[状态] jail {jail}: 批量解禁IP {ip} 失败")
-                    except Exception:
-                        failed_ips.append(ip)
-            except Exception as e:
-                logger.error(f"[状态] jail {jail}: 批处理IP解禁时发生错误: {str(e)}")
-                # 如果批处理失败，尝试逐个处理剩余IP
-                logger.warning(f"[状态] jail {jail}: 开始尝试逐个处理解禁失败的IP")
-                for ip in batch:
-                    try:
-                        result = subprocess.run(['fail2ban-client', 'set', jail, 'unbanip', ip], 
-                                     capture_output=True, text=True, timeout=3)
-                        if result.returncode == 0:
-                            success_count += 1
-                            logger.info(f"[状态] jail {jail}: 备用方式成功解禁IP {ip}")
-                        else:
-                            failed_ips.append(ip)
-                    except Exception:
-                        failed_ips.append(ip)
+    logger.info("[状态] jail %s: 开始批量解禁 %d 个IP", jail, len(ips))
+    succeeded, failed_ips = _apply_fail2ban_action(ips, jail, 'unbanip', logger, socket_path, batch_size)
     
     # 记录详细的统计信息
-    logger.info(f"[状态] jail {jail}: IP解禁操作完成 - 总计: {len(ips)} 个IP, 成功: {success_count}, 失败: {len(failed_ips)}, 成功率: {success_count/len(ips)*100:.1f}%")
-    if failed_ips:
-        logger.warning(f"[状态] jail {jail}: 以下IP解禁失败: {failed_ips}")
+    logger.info("[状态] jail %s: IP解禁操作完成 - 总计: %d 个IP, 成功: %d, 失败: %d, 成功率: %.1f%%",
+                jail, len(ips), len(succeeded), len(failed_ips), len(succeeded) / len(ips) * 100)
+    _log_failed_ips(logger, jail, '解禁', failed_ips)
+    return succeeded, failed_ips
 
-def get_remote_banned_ips(server_url, token, logger):
-    """获取远端服务器上的封禁IP列表，包含jail信息"""
+# 服务器的二进制IP列表格式（Accept: application/x-ip-list），编码见服务端pack_ip_list()
+IP_LIST_MIMETYPE = 'application/x-ip-list'
+IP_LIST_MAGIC = b'F2BL\x01'
+
+def unpack_ip_list(data):
+    """解码二进制IP列表，返回 {jail: [ip, ...]}；数据不完整或格式错误时抛出ValueError"""
+    if not data.startswith(IP_LIST_MAGIC):
+        raise ValueError("不支持的二进制IP列表格式")
+    pos = len(IP_LIST_MAGIC)
+
+    def read_varint():
+        nonlocal pos
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def read_text():
+        nonlocal pos
+        size = read_varint()
+        pos += size
+        if pos > len(data):
+            raise IndexError
+        return data[pos - size:pos].decode('utf-8')
+
+    groups = {}
+    try:
+        for _ in range(read_varint()):
+            ips = groups.setdefault(read_text(), [])
+            # IPv4和IPv6地址均为升序整数的差值序列
+            for family, width in ((socket.AF_INET, 4), (socket.AF_INET6, 16)):
+                value = 0
+                for _ in range(read_varint()):
+                    value += read_varint()
+                    ips.append(socket.inet_ntop(family, value.to_bytes(width, 'big')))
+            for _ in range(read_varint()):
+                ips.append(read_text())
+    except (IndexError, OverflowError):
+        raise ValueError("二进制IP列表不完整")
+    if pos != len(data):
+        raise ValueError("二进制IP列表末尾有多余数据")
+    return groups
+
+def _group_items_by_jail(items, jailed_ips):
+    """将服务器返回的IP记录按jail分组追加到jailed_ips中"""
+    for item in items:
+        ip = item.get('ip_address')
+        jail = item.get('jail', 'unknown')
+        if ip:
+            if jail not in jailed_ips:
+                jailed_ips[jail] = []
+            jailed_ips[jail].append(ip)
+
+def _read_ndjson_ip_list(lines, jailed_ips, label, logger):
+    """逐行解析NDJSON流式响应，返回记录数；缺少结束标记（传输中断）时返回None"""
+    count = 0
+    batch = []
+    for line in lines:
+        if not line:
+            continue
+        item = json.loads(line)
+        if item.get('end'):
+            _group_items_by_jail(batch, jailed_ips)
+            return count
+        batch.append(item)
+        count += 1
+        if len(batch) >= 1000:
+            _group_items_by_jail(batch, jailed_ips)
+            batch = []
+    logger.error("远端%sIP流式响应不完整（缺少结束标记），已接收 %s 条记录", label, count)
+    return None
+
+def _parse_ip_list_body(content_type, body, jailed_ips, label, logger):
+    """解析IP列表响应体并按jail分组，返回记录数；NDJSON响应的body为逐行迭代的内容，不完整时返回None"""
+    if 'application/x-ndjson' in content_type:
+        return _read_ndjson_ip_list(body, jailed_ips, label, logger)
+    if IP_LIST_MIMETYPE in content_type:
+        try:
+            groups = unpack_ip_list(body)
+        except ValueError as e:
+            logger.error("远端%sIP二进制列表解析失败: %s", label, e)
+            return None
+        for jail, ips in groups.items():
+            jailed_ips.setdefault(jail, []).extend(ips)
+        return sum(len(ips) for ips in groups.values())
+    data = json.loads(body)
+    if 'items' not in data and 'jails' in data:
+        # 按jail过滤时服务器直接返回按jail分组的IP列表
+        for jail, ips in data['jails'].items():
+            jailed_ips.setdefault(jail, []).extend(ips)
+        return sum(len(ips) for ips in data['jails'].values())
+    # 从服务器响应中获取items列表
+    items = data.get('items', [])
+    _group_items_by_jail(items, jailed_ips)
+    return len(items)
+
+def _tee_lines(lines, f):
+    """逐行读取响应的同时写入文件"""
+    for line in lines:
+        f.write(line + b'\n')
+        yield line
+
+def _load_list_cache(cache_file, logger):
+    """读取上次保存的列表响应，返回 {'etag', 'content_type', 'body'}，不存在或已损坏时返回None"""
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = json.loads(f.readline())
+            cached['body'] = f.read()
+        return cached if cached.get('etag') else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("读取列表缓存文件失败，将重新下载: %s", str(e))
+        return None
+
+def _fetch_remote_ip_list(server_url, path, token, logger, label, stream=True, cache_dir=None, jails=None, binary=False,
+                          aggregate=False):
+    """内部函数：获取远端服务器上指定状态的IP列表并按jail分组，失败时返回None
+
+    stream为True时请求NDJSON流式响应并逐行解析，服务器不支持时回退到普通JSON。
+    cache_dir不为空时在该目录保存最近一次的响应及其ETag，下次请求携带If-None-Match，
+    服务器返回304（列表未变化）时直接使用保存的响应，不再重新下载。
+    jails不为空时只请求这些jail的IP，服务器返回按jail分组的精简列表。
+    binary为True时优先请求二进制IP列表格式（体积更小，但解析比JSON慢），服务器不支持时使用上述格式。
+    aggregate为True时请求服务器将密集的地址合并为网段（只对封禁列表有效）
+    """
+    cache_name = path.strip('/') + ('.aggregate' if aggregate else '')
+    cache_file = os.path.join(cache_dir, f"{cache_name}.cache") if cache_dir else None
     try:
-        url = f"{server_url}/get_ips"
+        url = f"{server_url}{path}"
         headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json'
         }
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            data = response.json()
-            # 从服务器响应中获取items列表
-            items = data.get('items', [])
-            
-            if items:
-                logger.info(f"成功获取到 {len(items)} 个远端封禁IP记录(包含jail信息)")
-                # 按jail分组的IP列表
-                jailed_ips = {}
-                for item in items:
-                    ip = item.get('ip_address')
-                    jail = item.get('jail', 'unknown')
-                    if ip:
-                        if jail not in jailed_ips:
-                            jailed_ips[jail] = []
-                        jailed_ips[jail].append(ip)
-                logger.info(f"按jail分组的远端封禁IP: {len(jailed_ips)}")
+        params = {}
+        accept = ['application/json']
+        if stream:
+            accept.insert(0, 'application/x-ndjson')
+            params['stream'] = 1
+        if binary:
+            accept.insert(0, IP_LIST_MIMETYPE)
+        if len(accept) > 1:
+            headers['Accept'] = ', '.join(accept)
+        if jails:
+            params['jail'] = list(jails)
+        if aggregate:
+            params['aggregate'] = 1
+        cached = _load_list_cache(cache_file, logger) if cache_file else None
+        if cached is not None:
+            headers['If-None-Match'] = cached['etag']
+        with get_http_session().get(url, headers=headers, params=params, timeout=30, stream=stream) as response:
+            # 按jail分组的IP列表
+            jailed_ips = {}
+            if response.status_code == 304 and cached is not None:
+                logger.info("远端%sIP列表未变化，使用本地保存的响应", label)
+                body = cached['body']
+                if 'application/x-ndjson' in cached['content_type']:
+                    body = body.splitlines()
+                count = _parse_ip_list_body(cached['content_type'], body, jailed_ips, label, logger)
+            elif response.status_code != 200:
+                logger.error("获取远端%sIP请求失败: HTTP %s", label, response.status_code)
+                return None
+            else:
+                content_type = response.headers.get('Content-Type', '')
+                etag = response.headers.get('ETag')
+                # 服务器返回ETag时边接收边写入临时文件，完整接收后替换原有的缓存文件
+                tmp_file = None
+                count = None
+                if cache_file and etag:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    tmp_file = open(f"{cache_file}.tmp", 'wb')
+                    tmp_file.write(json.dumps({'etag': etag, 'content_type': content_type}).encode('utf-8') + b'\n')
+                try:
+                    if 'application/x-ndjson' in content_type:
+                        body = response.iter_lines()
+                        if tmp_file:
+                            body = _tee_lines(body, tmp_file)
+                    else:
+                        body = response.content
+                        if tmp_file:
+                            tmp_file.write(body)
+                    count = _parse_ip_list_body(content_type, body, jailed_ips, label, logger)
+                finally:
+                    if tmp_file:
+                        tmp_file.close()
+                        if count is not None:
+                            os.replace(tmp_file.name, cache_file)
+                        else:
+                            os.remove(tmp_file.name)
+            if count is None:
+                return None
+
+            if count:
+                logger.info("成功获取到 %s 个远端%sIP记录(包含jail信息)", count, label)
+                logger.info("按jail分组的远端%sIP: %s", label, len(jailed_ips))
             else:
-                logger.warning("获取到空的远端封禁IP列表")
+                logger.warning("获取到空的远端%sIP列表", label)
             
-            # 返回包含jail信息的完整数据和按jail分组的IP列表
-            return {
-                'jails': jailed_ips if 'jailed_ips' in locals() else {}
-            }
-        else:
-            logger.error(f"获取远端封禁IP请求失败: HTTP {response.status_code}")
+            # 返回按jail分组的IP列表
+            return {'jails': jailed_ips}
     except Exception as e:
         error_type = type(e).__name__
-        logger.error(f"获取远端封禁IP时发生异常 ({error_type}): {str(e)}")
-    
-    # 返回空的结构，保持一致性
-    return {'jails': {}}
+        logger.error("获取远端%sIP时发生异常 (%s): %s", label, error_type, str(e))
+    return None
+
+def get_remote_banned_ips(server_url, token, logger, stream=True, cache_dir=None, jails=None, binary=False, aggregate=False):
+    """获取远端服务器上的封禁IP列表，包含jail信息；cache_dir用于保存响应以便条件请求，jails限定只获取哪些jail，
+    aggregate为True时密集的地址由服务器合并为网段"""
+    result = _fetch_remote_ip_list(server_url, '/get_ips', token, logger, '封禁', stream, cache_dir, jails, binary,
+                                   aggregate)
+    # 失败时返回空的结构，保持一致性
+    return result if result is not None else {'jails': {}}
+
+def _prefix_index(entries):
+    """提取列表中的网段条目（服务器合并的网段），返回 {(IP版本, 前缀长度): {网络地址整数}}"""
+    index = {}
+    for entry in entries:
+        if '/' not in entry:
+            continue
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        index.setdefault((network.version, network.prefixlen), set()).add(int(network.network_address))
+    return index
+
+def _covered_by(ip, index):
+    """判断IP是否落在index中的某个网段内：对出现过的每种前缀长度各做一次哈希查找"""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    value = int(addr)
+    for (version, prefixlen), networks in index.items():
+        shift = addr.max_prefixlen - prefixlen
+        if version == addr.version and (value >> shift) << shift in networks:
+            return True
+    return False
 
 def compare_ip_lists(remote_ips, local_ips):
     # 将列表转换为集合进行高效比较
@@ -657,48 +1401,158 @@ def compare_ip_lists(remote_ips, local_ips):
     # 计算需要移除的IP（本地有但远端没有的）
     to_remove = list(local_set - remote_set)
     
+    # 列表中包含网段时，落在对方某个网段内的IP视为对方已有
+    remote_prefixes = _prefix_index(remote_set)
+    if remote_prefixes:
+        to_remove = [ip for ip in to_remove if not _covered_by(ip, remote_prefixes)]
+    local_prefixes = _prefix_index(local_set)
+    if local_prefixes:
+        to_add = [ip for ip in to_add if not _covered_by(ip, local_prefixes)]
+    
     return to_add, to_remove
 
-def get_remote_allowed_ips(server_url, token, logger):
-    """获取远端服务器上的已允许IP列表"""
+def get_remote_allowed_ips(server_url, token, logger, stream=True, cache_dir=None, jails=None, binary=False):
+    """获取远端服务器上的已允许IP列表；cache_dir用于保存响应以便条件请求，jails限定只获取哪些jail"""
+    result = _fetch_remote_ip_list(server_url, '/get_allowed_ips', token, logger, '允许', stream, cache_dir, jails, binary)
+    return result if result is not None else {'jails': {}}
+
+def load_sync_state(state_file, logger):
+    """读取本地持久化的增量同步状态（游标及远端封禁/允许IP视图）"""
     try:
-        url = f"{server_url}/get_allowed_ips"
+        if os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if isinstance(state, dict) and isinstance(state.get('cursor'), int):
+                state.setdefault('blocked', {})
+                state.setdefault('allowed', {})
+                return state
+            logger.warning("同步状态文件格式无效，将执行全量同步: %s", state_file)
+    except Exception as e:
+        logger.warning("读取同步状态文件失败，将执行全量同步: %s", str(e))
+    return None
+
+def save_sync_state(state_file, state, logger):
+    """原子写入增量同步状态，避免进程中断时留下损坏的文件"""
+    try:
+        tmp_file = f"{state_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, state_file)
+    except Exception as e:
+        logger.error("保存同步状态文件失败: %s", str(e))
+
+def get_remote_changes(server_url, token, since, logger):
+    """获取服务器上游标之后的IP变更，服务器不支持或请求失败时返回None"""
+    try:
+        url = f"{server_url}/changes"
         headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json'
         }
-        response = requests.get(url, headers=headers, timeout=30)
+        params = {} if since is None else {'since': since}
+        response = get_http_session().get(url, headers=headers, params=params, timeout=30)
         
         if response.status_code == 200:
-            data = response.json()
-            # 从服务器响应中获取items列表
-            items = data.get('items', [])
-            
-            if items:
-                logger.info(f"成功获取到 {len(items)} 个远端允许IP记录(包含jail信息)")
-                # 按jail分组的IP列表
-                jailed_ips = {}
-                for item in items:
-                    ip = item.get('ip_address')
-                    jail = item.get('jail', 'unknown')
-                    if ip:
-                        if jail not in jailed_ips:
-                            jailed_ips[jail] = []
-                        jailed_ips[jail].append(ip)
-                logger.info(f"按jail分组的远端允许IP: {len(jailed_ips)}")
-            else:
-                logger.warning("获取到空的远端允许IP列表")
-            
-            # 返回包含jail信息的完整数据和按jail分组的IP列表
-            return {
-                'jails': jailed_ips if 'jailed_ips' in locals() else {}
-            }
+            return response.json()
+        elif response.status_code == 404:
+            logger.warning("服务器不支持增量同步接口 /changes，使用全量同步")
         else:
-            logger.error(f"获取远端允许IP请求失败: HTTP {response.status_code}")
+            logger.error("获取远端IP变更请求失败: HTTP %s", response.status_code)
     except Exception as e:
         error_type = type(e).__name__
-        logger.error(f"获取远端允许IP时发生异常 ({error_type}): {str(e)}")
-    return  {'jails': {}}
+        logger.error("获取远端IP变更时发生异常 (%s): %s", error_type, str(e))
+    return None
+
+def _apply_remote_changes(state, changes):
+    """将服务器返回的变更应用到本地保存的远端IP视图，视图限定了jail时只保留这些jail的IP"""
+    blocked = state['blocked']
+    allowed = state['allowed']
+    wanted = set(state['jails']) if state.get('jails') else None
+    for change in changes:
+        ip = change.get('ip_address')
+        if not ip:
+            continue
+        status = change.get('status')
+        jail = change.get('jail', 'unknown')
+        blocked.pop(ip, None)
+        allowed.pop(ip, None)
+        if wanted is not None and jail not in wanted:
+            continue
+        if status == 'blocked':
+            blocked[ip] = jail
+        elif status == 'allowed':
+            allowed[ip] = jail
+
+def _group_ips_by_jail(ip_jails):
+    """将 {IP: jail} 转换为与get_remote_banned_ips相同的按jail分组结构"""
+    jailed_ips = {}
+    for ip, jail in ip_jails.items():
+        jailed_ips.setdefault(jail, []).append(ip)
+    return {'jails': jailed_ips}
+
+def sync_remote_state(server_url, token, state_file, logger, cache=None, stream=True, list_cache_dir=None, jails=None,
+                      binary=False):
+    """增量同步远端封禁/允许IP，游标失效或没有本地状态时执行全量同步
+
+    cache用于守护进程模式下在内存中保留同步状态，避免每个周期重新读取状态文件。
+    jails不为空时只同步这些jail的IP，jail配置变化后执行一次全量同步。
+    返回 (远端封禁IP数据, 远端允许IP数据)，格式与get_remote_banned_ips相同
+    """
+    if cache is not None and 'sync_state' in cache:
+        state = cache.pop('sync_state')
+    else:
+        state = load_sync_state(state_file, logger)
+    jail_filter = sorted(set(jails)) if jails else None
+    if state is not None and state.get('jails') != jail_filter:
+        logger.info("本地jail配置已变化，执行全量同步")
+        state = None
+    
+    if state is not None:
+        cursor = state['cursor']
+        change_count = 0
+        while True:
+            data = get_remote_changes(server_url, token, cursor, logger)
+            if data is None or data.get('reset'):
+                if data is not None:
+                    logger.info("同步游标 %s 已过期，执行全量同步", cursor)
+                state = None
+                break
+            changes = data.get('changes', [])
+            _apply_remote_changes(state, changes)
+            change_count += len(changes)
+            cursor = data.get('cursor', cursor)
+            if not data.get('has_more'):
+                break
+        
+        if state is not None:
+            state['cursor'] = cursor
+            save_sync_state(state_file, state, logger)
+            if cache is not None:
+                cache['sync_state'] = state
+            logger.info("增量同步完成，应用 %s 个IP变更，当前游标: %s，远端封禁IP %s 个，远端允许IP %s 个",
+                        change_count, cursor, len(state['blocked']), len(state['allowed']))
+            return _group_ips_by_jail(state['blocked']), _group_ips_by_jail(state['allowed'])
+    
+    # 全量同步：先获取游标再下载列表，下载期间发生的变更会在下次增量同步时重放
+    data = get_remote_changes(server_url, token, None, logger)
+    banned = _fetch_remote_ip_list(server_url, '/get_ips', token, logger, '封禁', stream, list_cache_dir, jail_filter, binary)
+    allowed = _fetch_remote_ip_list(server_url, '/get_allowed_ips', token, logger, '允许', stream, list_cache_dir, jail_filter,
+                                    binary)
+    
+    if data is not None and banned is not None and allowed is not None:
+        state = {
+            'cursor': data.get('cursor', 0),
+            'jails': jail_filter,
+            'blocked': {ip: jail for jail, ips in banned['jails'].items() for ip in ips},
+            'allowed': {ip: jail for jail, ips in allowed['jails'].items() for ip in ips}
+        }
+        save_sync_state(state_file, state, logger)
+        if cache is not None:
+            cache['sync_state'] = state
+        logger.info("全量同步完成，当前游标: %s", state['cursor'])
+    
+    return (banned if banned is not None else {'jails': {}},
+            allowed if allowed is not None else {'jails': {}})
 
 # 最后一行需要确保是正确的main函数调用
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fail2ban服务端socket替身
+
+在没有安装fail2ban的环境中模拟 /var/run/fail2ban/fail2ban.sock，
+使用与fail2ban-client相同的pickle消息协议，支持以下命令：
+
+    ping
+    status [jail]
+    get <jail> banned
+    set <jail> banip <IP> [<IP> ...]
+    set <jail> unbanip <IP> [<IP> ...]
+
+用法示例：
+    python3 fake_fail2ban_server.py --socket /tmp/fail2ban.sock --jails sshd,nginx
+    # 在clientconfig.ini的[fail2ban]部分设置 socket = /tmp/fail2ban.sock
+
+    # 预先封禁文件中的IP（每行一个"jail IP"），封禁/解禁时更新dbfile的修改时间（模拟fail2ban数据库）
+    python3 fake_fail2ban_server.py --jails sshd --banned banned.txt --dbfile /tmp/fail2ban.sqlite3
+"""
+
+import argparse
+import ipaddress
+import os
+import pickle
+import socketserver
+import threading
+import time
+
+SOCKET_END = b'<F2B_END_COMMAND>'
+SOCKET_CLOSE = b'<F2B_CLOSE_COMMAND>'
+
+
+class FakeFail2Ban:
+    """内存中的jail和封禁列表"""
+
+    def __init__(self, jails, latency=0.0, dbfile=None):
+        self.jails = {jail: {} for jail in jails}
+        self.latency = latency
+        self.dbfile = dbfile
+        self.command_count = 0
+        self._lock = threading.Lock()
+
+    def load_banned(self, path):
+        """预先封禁文件中的IP，每行格式为“jail IP”"""
+        now = time.time()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                jail, _, ip = line.strip().partition(' ')
+                if ip:
+                    self._get_jail(jail)[ip] = now
+
+    def _touch_dbfile(self):
+        # fail2ban每次封禁/解禁都会写入其数据库
+        if self.dbfile:
+            with open(self.dbfile, 'a'):
+                os.utime(self.dbfile)
+
+    def _get_jail(self, name):
+        if name not in self.jails:
+            raise ValueError(f"Sorry but the jail '{name}' does not exist")
+        return self.jails[name]
+
+    def handle(self, command):
+        with self._lock:
+            self.command_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if command == ['ping']:
+            return 'pong'
+        if command and command[0] == 'status':
+            if len(command) == 1:
+                return [('Number of jail', len(self.jails)), ('Jail list', ', '.join(self.jails))]
+            banned = list(self._get_jail(command[1]))
+            return [
+                ('Filter', [('Currently failed', 0), ('Total failed', 0), ('File list', [])]),
+                ('Actions', [('Currently banned', len(banned)), ('Total banned', len(banned)),
+                             ('Banned IP list', banned)])
+            ]
+        if len(command) == 3 and command[0] == 'get' and command[2] == 'banned':
+            return list(self._get_jail(command[1]))
+        if len(command) >= 4 and command[0] == 'set' and command[2] in ('banip', 'unbanip'):
+            jail = self._get_jail(command[1])
+            ips = command[3:]
+            # 与fail2ban一致：任一IP（或网段）无效时整条命令失败
+            for ip in ips:
+                if '/' in ip:
+                    ipaddress.ip_network(ip, strict=False)
+                else:
+                    ipaddress.ip_address(ip)
+            with self._lock:
+                self._touch_dbfile()
+                if command[2] == 'banip':
+                    added = [ip for ip in ips if ip not in jail]
+                    jail.update((ip, time.time()) for ip in added)
+                    return len(added)
+                removed = [ip for ip in ips if jail.pop(ip, None) is not None]
+                return len(removed)
+        raise ValueError(f"Invalid command {command!r}")
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        buffer = b''
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+            while SOCKET_END in buffer:
+                message, buffer = buffer.split(SOCKET_END, 1)
+                if message.startswith(SOCKET_CLOSE):
+                    return
+                try:
+                    response = (0, self.server.fail2ban.handle(pickle.loads(message)))
+                except Exception as e:
+                    response = (1, e)
+                self.request.sendall(pickle.dumps(response, pickle.HIGHEST_PROTOCOL) + SOCKET_END)
+
+
+class FakeFail2BanServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, fail2ban):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.fail2ban = fail2ban
+        super().__init__(socket_path, RequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fail2ban服务端socket替身')
+    parser.add_argument('--socket', default='/tmp/fail2ban.sock', help='监听的Unix socket路径')
+    parser.add_argument('--jails', default='sshd', help='模拟的jail列表，多个jail用逗号分隔')
+    parser.add_argument('--latency', type=float, default=0.0, help='每条命令的模拟处理延迟（秒）')
+    parser.add_argument('--banned', help='预先封禁的IP列表文件，每行格式为 "jail IP"')
+    parser.add_argument('--dbfile', help='封禁/解禁时更新其修改时间的文件（模拟fail2ban数据库）')
+    args = parser.parse_args()
+
+    jails = [jail.strip() for jail in args.jails.split(',') if jail.strip()]
+    fail2ban = FakeFail2Ban(jails, args.latency, args.dbfile)
+    if args.banned:
+        fail2ban.load_banned(args.banned)
+    server = FakeFail2BanServer(args.socket, fail2ban)
+    print(f"fail2ban socket 替身已启动: {args.socket}，jails: {', '.join(jails)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -167,9 +167,11 @@ StartLimitBurst=5
 [Service]
 Type=simple
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$PYTHON_BIN $INSTALL_DIR/client.py
+# 守护进程模式常驻运行，同步间隔由clientconfig.ini中的sync_interval控制
+ExecStart=$PYTHON_BIN $INSTALL_DIR/client.py --daemon
+ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
-RestartSec=60
+RestartSec=10
 User=$USER
 Group=$USER
 # 日志配置
@@ -214,4 +216,5 @@ echo -e "\n💡 使用方法（重新安装/更新）:"
 SCRIPT_NAME=$(basename "$0")
 echo "  $SCRIPT_NAME <server_host>:<port> <token>"
 echo "  示例: $SCRIPT_NAME 192.168.1.100:5000 abcdef123456"
-echo -e "\n客户端将每60秒自动运行一次（通过RestartSec配置）"
\ No newline at end of file
+echo "  - 重新加载配置: sudo systemctl reload ${SERVICE_NAME}.service"
+echo -e "\n客户端以守护进程模式常驻运行，默认每60秒同步一次（通过clientconfig.ini中的sync_interval配置）"
\ No newline at end of file
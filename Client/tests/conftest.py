@@ -0,0 +1,13 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def client():
+    sys.path.insert(0, CLIENT_DIR)
+    return importlib.import_module('client')
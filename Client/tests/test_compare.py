@@ -0,0 +1,55 @@
+"""本地与远端列表比较：网段匹配（_prefix_index/_covered_by）与ipaddress的判断一致"""
+import ipaddress
+
+import pytest
+
+# 混合IPv4/IPv6、/0与/32、/128等边界前缀、非规范写法和无法解析的条目
+NETWORKS = ['10.1.0.0/16', '10.1.2.3/32', '192.0.2.7/29', '0.0.0.0/0', '2001:db8::/32',
+            '2001:db8:1::5/128', '::/0', '10.2.0.0/33', 'bad/24', '10.3.0.1']
+# 包括各网段的首尾地址和紧邻网段之外的地址
+IPS = ['10.1.0.0', '10.1.255.255', '10.0.255.255', '10.2.0.0', '10.1.2.3', '10.1.2.4',
+       '192.0.2.0', '192.0.2.7', '192.0.2.8', '8.8.8.8', '255.255.255.255', '2001:db8::1',
+       '2001:db8:ffff:ffff::', '2001:db9::', '2001:db8:1::5', '2001:db8:1::6', '::',
+       '::ffff:10.1.0.1', '10.3.0.1', 'not-an-ip', '']
+
+
+def reference_covered(ip, entries):
+    """逐个网段用ipaddress判断，只比较相同版本的地址和网段"""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    for entry in entries:
+        if '/' not in entry:
+            continue
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            continue
+        if network.version == addr.version and addr in network:
+            return True
+    return False
+
+
+@pytest.mark.parametrize('entries', [
+    NETWORKS,
+    [entry for entry in NETWORKS if not entry.endswith('/0')],
+    [entry for entry in NETWORKS if ':' not in entry],
+    [],
+], ids=['all', 'without-default-routes', 'ipv4-only', 'empty'])
+def test_covered_by_matches_ipaddress(client, entries):
+    index = client._prefix_index(entries)
+    for ip in IPS:
+        assert client._covered_by(ip, index) == reference_covered(ip, entries), ip
+
+
+def test_compare_ip_lists_treats_covered_ips_as_present(client):
+    to_add, to_remove = client.compare_ip_lists(['10.1.0.0/16', '10.9.0.1'], ['10.1.5.5', '10.9.0.2'])
+    assert sorted(to_add) == ['10.1.0.0/16', '10.9.0.1']
+    assert to_remove == ['10.9.0.2']
+
+
+def test_compare_ip_lists_without_networks(client):
+    to_add, to_remove = client.compare_ip_lists(['1.1.1.1', '2.2.2.2'], ['2.2.2.2', '3.3.3.3'])
+    assert to_add == ['1.1.1.1']
+    assert to_remove == ['3.3.3.3']
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fail2ban-sync 服务端 asyncio 模式（可选）
+
+只提供令牌认证的客户端API（/add_ips、/get_ips、/get_allowed_ips、/get_known_ips、/allow_ip、
+/changes、/events、/metrics），Web管理界面仍由 server.py 提供。与 server.py 使用同一个配置文件和数据库：
+
+- 每个连接只占用一个协程，大量客户端同时连接时不会占用大量系统线程
+- 所有写操作进入同一个队列，由唯一的写入任务按批在一个事务中提交（group commit），
+  写锁等待只发生在写入线程中
+- 读操作在独立的读取线程池中执行，WAL模式下不受写入影响
+- 启用ip_cache时完整列表直接返回内存缓存中预先生成并压缩的响应
+- /events 只由本模式提供，每个订阅连接只占用一个协程，同时最多保持 events_max_streams 个；
+  所有订阅连接共用一个变更检查任务，本进程的写入立即唤醒，其他进程的写入每隔 events_poll_interval 发现
+
+用法：
+    pip install uvicorn
+    python3 async_server.py --bind 0.0.0.0:5001
+    python3 async_server.py --bind unix:/run/fail2bansync/api.sock --readers 8
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import server as core
+
+logger = core.logger
+config = core.config
+
+
+class WriteQueue:
+    """单写入者队列：收集一段时间内的写操作，交给server.commit_write_group()在一个事务中提交"""
+
+    def __init__(self, batch_size, batch_delay):
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = max(0.0, batch_delay)
+        self.queue = asyncio.Queue()
+        # SQLite同一时刻只有一个写入者，写入固定在一个线程中执行
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self.task = None
+        # 统计信息
+        self.batches = 0
+        self.operations = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, kind, payload):
+        """提交写操作（类型与server.commit_write_group()相同），等待所在批次提交后返回其结果"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, payload, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # 在batch_delay内继续收集后续写操作，最多batch_size个
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # 相邻的封禁请求合并为一条UPSERT，同一IP被多个客户端同时上报时只产生一次状态变化
+            results = await loop.run_in_executor(
+                self.executor, core.commit_write_group, [(kind, payload) for kind, payload, _ in batch])
+            self.batches += 1
+            self.operations += len(batch)
+            core.metrics.observe('f2bsync_write_batch_operations', len(batch))
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+
+class ResponseRecorder:
+    """包装ASGI的send，记录响应状态码和实际发送的字节数"""
+
+    def __init__(self, send):
+        self.send = send
+        self.status = None
+        self.sent = 0
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message['type'] == 'http.response.body':
+            self.sent += len(message.get('body', b''))
+        await self.send(message)
+
+
+class AsyncAPI:
+    """令牌认证API的ASGI应用"""
+
+    def __init__(self, readers, batch_size, batch_delay):
+        self.readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix='sqlite-reader')
+        self.writer = WriteQueue(batch_size, batch_delay)
+        self.routes = {
+            ('POST', '/add_ips'): self.add_ips,
+            ('POST', '/allow_ip'): self.allow_ip,
+            ('GET', '/get_ips'): lambda request: self.get_ip_list(request, 'blocked'),
+            ('GET', '/get_allowed_ips'): lambda request: self.get_ip_list(request, 'allowed'),
+            ('GET', '/get_known_ips'): lambda request: self.get_ip_list(request, 'known'),
+            ('GET', '/changes'): self.get_changes,
+        }
+        # 处理函数自行发送响应的路由（流式响应等）
+        self.stream_routes = {
+            ('GET', '/events'): self.stream_events,
+            ('GET', '/metrics'): self.get_metrics,
+        }
+        # /events 订阅连接共用的变更检查任务：变更日志序号前进时触发changed并换成新的Event
+        self.changed = None
+        self.wake = None
+        self._notify = None
+        self.watcher = None
+        self.subscribers = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                core.ip_cache.load()
+                self.writer.start()
+                self.start_change_watcher()
+                core.start_status_sweeper()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                core.stop_status_sweeper(timeout=5)
+                await self.stop_change_watcher()
+                await self.writer.stop()
+                self.readers.shutdown(wait=True)
+                logger.info("写入队列统计: 提交 %s 批，共 %s 个写操作", self.writer.batches, self.writer.operations)
+                if core.ip_cache.enabled:
+                    logger.info("内存缓存统计: %s", core.ip_cache.format_stats())
+                logger.info("数据库连接池统计: %s", core.db_pool.stats())
+                core.db_pool.close_all()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        if not core.metrics.enabled:
+            await self.dispatch(scope, receive, send)
+            return
+        start = time.perf_counter()
+        recorder = ResponseRecorder(send)
+        uncompressed = await self.dispatch(scope, receive, recorder)
+        route_key = (scope['method'], scope['path'])
+        route = scope['path'] if route_key in self.routes or route_key in self.stream_routes else 'unmatched'
+        core.metrics.inc('f2bsync_http_requests_total',
+                         (('route', route), ('method', scope['method']), ('status', str(recorder.status))))
+        # 与Flask版本一致，流式响应不计入处理时间和响应字节数
+        if uncompressed is not None:
+            core.metrics.observe('f2bsync_http_request_duration_seconds', time.perf_counter() - start, (('route', route),))
+            core.metrics.inc('f2bsync_http_response_bytes_total', (('route', route), ('stage', 'uncompressed')), uncompressed)
+            core.metrics.inc('f2bsync_http_response_bytes_total', (('route', route), ('stage', 'sent')), recorder.sent)
+
+    # 处理请求，返回压缩前的响应体字节数，处理函数自行发送响应时返回None
+    async def dispatch(self, scope, receive, send):
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        route = (scope['method'], scope['path'])
+        handler = self.routes.get(route) or self.stream_routes.get(route)
+        if handler is None:
+            return await self.send_json(send, headers, {"error": "Not Found"}, 404)
+
+        # 与Flask版本一致的Bearer令牌认证
+        authorization = headers.get('authorization', '')
+        scheme, _, token = authorization.partition(' ')
+        client_name = core.TOKENS.get(token.strip()) if scheme.lower() == 'bearer' else None
+        if not client_name:
+            body = b'Unauthorized Access'
+            await self.send_response(send, 401, body, 'text/html; charset=utf-8',
+                                     [(b'www-authenticate', b'Bearer realm="Authentication Required"')])
+            return len(body)
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        request = {
+            'headers': headers,
+            'args': {key: values[0] for key, values in query.items()},
+            # 可重复出现的参数（如jail=）的全部取值
+            'query': query,
+            'body': body,
+            'client_name': client_name,
+            'client_ip': self.get_client_ip(headers, scope),
+            # 处理函数需要附加的响应头
+            'response_headers': [],
+        }
+        if route in self.stream_routes:
+            await handler(request, receive, send)
+            return None
+        try:
+            payload, status = await handler(request)
+        except Exception as e:
+            logger.error("客户端 %s (%s) 请求 %s 时出错: %s", client_name, request['client_ip'], scope['path'], e)
+            payload, status = {"error": "服务器内部错误"}, 500
+        extra_headers = request['response_headers']
+        if status == 304:
+            await self.send_response(send, 304, b'', 'application/json', extra_headers)
+            return 0
+        if isinstance(payload, core.CachedListBody):
+            return await self.send_cached_list(send, headers, payload, extra_headers)
+        return await self.send_json(send, headers, payload, status, extra_headers)
+
+    @staticmethod
+    def get_client_ip(headers, scope):
+        # 与server.get_client_ip()相同的优先级：X-Forwarded-For、X-Real-IP、连接地址
+        if headers.get('x-forwarded-for'):
+            return headers['x-forwarded-for'].split(',')[0].strip()
+        if headers.get('x-real-ip'):
+            return headers['x-real-ip'].strip()
+        client = scope.get('client')
+        return client[0] if client else ''
+
+    # 发送JSON响应，返回压缩前的字节数
+    async def send_json(self, send, request_headers, payload, status, extra_headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        uncompressed = len(body)
+        extra_headers = list(extra_headers)
+        # 与Flask版本的压缩配置一致：较大的响应在客户端支持时gzip压缩
+        if (len(body) >= core.app.config['COMPRESS_MIN_SIZE']
+                and 'gzip' in request_headers.get('accept-encoding', '')):
+            body = gzip.compress(body, compresslevel=core.app.config['COMPRESS_LEVEL'])
+            extra_headers.append((b'content-encoding', b'gzip'))
+            if not any(name == b'vary' for name, _ in extra_headers):
+                extra_headers.append((b'vary', b'Accept-Encoding'))
+        await self.send_response(send, status, body, 'application/json', extra_headers)
+        return uncompressed
+
+    async def send_cached_list(self, send, request_headers, entry, extra_headers=()):
+        if entry.gzip_body is not None and 'gzip' in request_headers.get('accept-encoding', ''):
+            await self.send_response(send, 200, entry.gzip_body, entry.mimetype,
+                                     [(b'content-encoding', b'gzip')] + list(extra_headers))
+        else:
+            await self.send_response(send, 200, entry.body, entry.mimetype, extra_headers)
+        return len(entry.body)
+
+    @staticmethod
+    def etag_matches(if_none_match, etag):
+        # If-None-Match使用弱比较，忽略W/前缀
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag.strip('"') == etag:
+                return True
+        return False
+
+    @staticmethod
+    async def send_response(send, status, body, content_type, extra_headers=()):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type.encode('latin-1')),
+                        (b'content-length', str(len(body)).encode('latin-1'))] + list(extra_headers),
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def start_change_watcher(self):
+        loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.wake = asyncio.Event()
+        self._notify = lambda: loop.call_soon_threadsafe(self.wake.set)
+        # 本进程写入线程提交后立即唤醒检查任务
+        core.change_notifier.add_callback(self._notify)
+        self.watcher = loop.create_task(self._watch_changes())
+
+    async def stop_change_watcher(self):
+        if self.watcher:
+            core.change_notifier.remove_callback(self._notify)
+            self.watcher.cancel()
+            try:
+                await self.watcher
+            except asyncio.CancelledError:
+                pass
+
+    async def _watch_changes(self):
+        last_cursor = None
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), config['events_poll_interval'])
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            if not self.subscribers:
+                continue
+            try:
+                current_cursor = await self.run_read(read_change_cursor)
+            except Exception as e:
+                logger.error("检查变更日志序号时出错: %s", e)
+                continue
+            if current_cursor != last_cursor:
+                last_cursor = current_cursor
+                changed, self.changed = self.changed, asyncio.Event()
+                changed.set()
+
+    async def run_read(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, function, *args)
+
+    @staticmethod
+    def parse_json_body(request):
+        body = request['body']
+        if request['headers'].get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body.decode('utf-8')) if body else {}
+
+    async def add_ips(self, request):
+        client_name, client_ip = request['client_name'], request['client_ip']
+        try:
+            data = self.parse_json_body(request)
+        except Exception as e:
+            logger.error("解压gzip数据失败: %s", e)
+            return {"error": "无效的压缩数据"}, 400
+
+        if not isinstance(data, dict):
+            logger.warning("客户端 %s (%s) 请求添加IP，但请求体不是JSON对象", client_name, client_ip)
+            return {"error": "请求体必须是JSON对象"}, 400
+        ips = data.get('ips', [])
+        description = data.get('description', '')
+        jail = data.get('jail', '')
+        reported_by = f"{client_name}@{client_ip}"
+        if not ips:
+            logger.warning("客户端 %s (%s) 请求添加IP但未提供IP列表", client_name, client_ip)
+            return {"error": "需要IP地址列表"}, 400
+
+        try:
+            added_ips = await self.writer.submit('add', {
+                'ips': ips, 'description': description, 'jail': jail, 'reported_by': reported_by,
+                'client_name': client_name, 'client_ip': client_ip
+            })
+        except sqlite3.IntegrityError as e:
+            logger.error("客户端 %s (%s) 添加IP地址时发生完整性错误: %s", client_name, client_ip, e)
+            return {"error": "添加IP地址时出错"}, 400
+        core.record_add_ips_metrics(ips, added_ips)
+        return {"message": "IP地址已添加", "added_ips": added_ips}, 201
+
+    async def allow_ip(self, request):
+        client_name, client_ip = request['client_name'], request['client_ip']
+        try:
+            data = self.parse_json_body(request)
+        except Exception as e:
+            logger.warning("客户端 %s (%s) 请求放行IP，请求体无法解析: %s", client_name, client_ip, e)
+            return {"error": "无效的JSON数据"}, 400
+        if not isinstance(data, dict):
+            logger.warning("客户端 %s (%s) 请求放行IP，但请求体不是JSON对象", client_name, client_ip)
+            return {"error": "请求体必须是JSON对象"}, 400
+        ip = data.get('ip')
+        if not ip:
+            logger.warning("客户端 %s (%s) 请求放行IP但未提供IP地址", client_name, client_ip)
+            return {"error": "需要IP地址"}, 400
+
+        current_status = await self.writer.submit('allow', ip)
+        if current_status is None:
+            logger.info("客户端 %s (%s) 请求放行IP %s，但该IP不存在", client_name, client_ip, ip, extra=core.LOG_SAMPLED)
+            return {"error": "IP地址不存在"}, 404
+        if current_status != 'blocked':
+            logger.info("客户端 %s (%s) 请求放行IP %s，但该IP当前状态为 %s", client_name, client_ip, ip, current_status,
+                        extra=core.LOG_SAMPLED)
+            return {"error": f"IP地址当前状态为 {current_status}，不需要放行"}, 400
+        logger.info("客户端 %s (%s) 已手动放行IP %s", client_name, client_ip, ip, extra=core.LOG_SAMPLED)
+        return {"message": f"IP地址 {ip} 已成功放行"}, 200
+
+    async def get_changes(self, request):
+        client_name, client_ip = request['client_name'], request['client_ip']
+        args = request['args']
+        try:
+            since = int(args['since']) if 'since' in args else None
+            limit = min(max(int(args.get('limit', 10000)), 1), 100000)
+        except ValueError:
+            return {"error": "无效的游标参数"}, 400
+        payload = await self.run_read(read_changes, since, limit)
+        core.log_changes_request(client_name, client_ip, since, payload)
+        return payload, 200
+
+    async def stream_events(self, request, receive, send):
+        client_name, client_ip = request['client_name'], request['client_ip']
+        since_param = request['headers'].get('last-event-id') or request['args'].get('since')
+        try:
+            since = int(since_param) if since_param else None
+        except ValueError:
+            await self.send_json(send, request['headers'], {"error": "无效的游标参数"}, 400)
+            return
+        if self.subscribers >= config['events_max_streams']:
+            logger.warning("客户端 %s (%s) 订阅变更推送被拒绝，订阅连接数已达上限 %s",
+                           client_name, client_ip, config['events_max_streams'])
+            retry_after = str(int(config['events_max_duration'])).encode('latin-1')
+            await self.send_json(send, request['headers'], {"error": "订阅连接数已达上限"}, 503,
+                                 [(b'retry-after', retry_after)])
+            return
+
+        # 客户端断开时结束推送
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        async def send_chunk(text):
+            await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+        heartbeat = config['events_heartbeat']
+        disconnect_task = asyncio.get_running_loop().create_task(watch_disconnect())
+        self.subscribers += 1
+        logger.info("客户端 %s (%s) 订阅变更推送，游标: %s", client_name, client_ip, since)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')],
+            })
+            loop = asyncio.get_running_loop()
+            started = last_sent = loop.time()
+            await send_chunk('retry: 5000\n\n')
+            # 先取得变更Event再读取变更，读取之后发生的变更一定会触发这个Event
+            changed = self.changed
+            payload = await self.run_read(core.poll_change_events, since)
+            if since is None:
+                since = payload['cursor']
+            await send_chunk(core.format_sse('ready', {"cursor": since}))
+            while not disconnected.is_set():
+                if payload['reset']:
+                    logger.info("客户端 %s (%s) 的推送游标 %s 无效，需要全量同步（当前游标: %s）",
+                                client_name, client_ip, since, payload['cursor'])
+                    await send_chunk(core.format_sse('reset', {"cursor": payload['cursor']}))
+                    break
+                if payload['changes']:
+                    del payload['reset']
+                    await send_chunk(core.format_sse('changes', payload, payload['cursor']))
+                    last_sent = loop.time()
+                    since = payload['cursor']
+                    if payload['has_more']:
+                        payload = await self.run_read(core.poll_change_events, since)
+                        continue
+                now = loop.time()
+                if now - started >= config['events_max_duration']:
+                    break
+                if now - last_sent >= heartbeat:
+                    await send_chunk(': keepalive\n\n')
+                    last_sent = now
+                waiters = [loop.create_task(changed.wait()), loop.create_task(disconnected.wait())]
+                timeout = min(heartbeat - (now - last_sent), config['events_max_duration'] - (now - started))
+                await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+                changed = self.changed
+                payload = await self.run_read(core.poll_change_events, since)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except Exception as e:
+            if not disconnected.is_set():
+                logger.error("客户端 %s (%s) 的变更推送连接出错: %s", client_name, client_ip, e)
+        finally:
+            self.subscribers -= 1
+            disconnect_task.cancel()
+            logger.info("客户端 %s (%s) 的变更推送连接已结束，游标: %s", client_name, client_ip, since)
+
+    async def get_metrics(self, request, receive, send):
+        if not core.metrics.enabled:
+            await self.send_json(send, request['headers'], {"error": "运行指标未启用"}, 404)
+            return
+        try:
+            text = await self.run_read(core.render_metrics)
+        except Exception as e:
+            logger.error("生成运行指标时出错: %s", e)
+            await self.send_json(send, request['headers'], {"error": "服务器内部错误"}, 500)
+            return
+        await self.send_response(send, 200, text.encode('utf-8'), core.METRICS_MIMETYPE)
+
+    async def get_ip_list(self, request, status):
+        client_name, client_ip = request['client_name'], request['client_ip']
+        args = request['args']
+        page_param = args.get('page')
+        after = args.get('after', '').strip()
+        use_pagination = page_param is not None or bool(after)
+        try:
+            page, per_page = core.parse_page_args(page_param, args.get('per_page', 50))
+        except ValueError:
+            logger.warning("客户端 %s (%s) 请求获取%s IP列表，分页参数无效", client_name, client_ip, status)
+            return {"error": "无效的分页参数"}, 400
+        search_ip = args.get('search_ip', '').strip()
+        jails = core.parse_jail_args(request['query'].get('jail', []))
+        aggregate = core.wants_aggregate(status, use_pagination, args.get('aggregate'))
+        stream = (args.get('stream') in ('1', 'true')
+                  or 'application/x-ndjson' in request['headers'].get('accept', ''))
+        binary = core.IP_LIST_MIMETYPE in request['headers'].get('accept', '')
+        if use_pagination:
+            fmt = 'json'
+        elif binary and core.ip_cache.enabled and not search_ip:
+            fmt = 'binary'
+        elif jails or aggregate:
+            fmt = 'jails'
+        else:
+            fmt = 'ndjson' if stream and core.ip_cache.enabled and not search_ip else 'json'
+        use_gzip = 'gzip' in request['headers'].get('accept-encoding', '')
+
+        # 条件请求：与Flask版本相同的ETag，列表未变化时返回304
+        now = datetime.now()
+        etag = await self.run_read(read_ip_list_etag, status, now,
+                                   (search_ip, jails, use_pagination, page, per_page, after, fmt, use_gzip,
+                                    core.aggregate_variant(aggregate)))
+        request['response_headers'].extend([
+            (b'etag', f'"{etag}"'.encode('latin-1')),
+            (b'cache-control', b'no-cache'),
+            (b'vary', b'Accept, Accept-Encoding'),
+        ])
+        if self.etag_matches(request['headers'].get('if-none-match', ''), etag):
+            logger.info("客户端 %s (%s) 请求获取%sIP列表，内容未变化", client_name, client_ip,
+                        core.IP_LIST_STATUS_NAMES.get(status, status), extra=core.LOG_SAMPLED)
+            return None, 304
+
+        if core.ip_cache.enabled and not use_pagination and not search_ip:
+            # 完整列表直接返回内存缓存中预先生成（并压缩）的响应
+            entry = await self.run_read(read_cached_list, status, now, jails, fmt, aggregate)
+            core.log_ip_list_request(client_name, client_ip, status, entry.summary)
+            return entry, 200
+
+        try:
+            response = await self.run_read(read_ip_list, status, now, search_ip, use_pagination, page, per_page, after,
+                                           jails, aggregate)
+        except ValueError as e:
+            logger.warning("客户端 %s (%s) 请求获取%s IP列表，搜索条件无效: %s", client_name, client_ip, status, search_ip)
+            return {"error": f"无效的搜索条件: {e}"}, 400
+        core.log_ip_list_request(client_name, client_ip, status, response)
+        return response, 200
+
+
+def read_change_cursor():
+    conn = core.get_db_connection()
+    try:
+        return core.get_change_cursor(conn.cursor())
+    finally:
+        core.db_pool.return_connection(conn)
+
+
+def read_changes(since, limit):
+    conn = core.get_db_connection()
+    try:
+        return core.query_changes(conn, since, limit)
+    finally:
+        core.db_pool.return_connection(conn)
+
+
+def read_ip_list_etag(status, now, variant):
+    conn = core.get_db_connection()
+    try:
+        return core.ip_list_etag(conn.cursor(), status, now, variant)
+    finally:
+        core.db_pool.return_connection(conn)
+
+
+def read_cached_list(status, now, jails, fmt, aggregate):
+    conn = core.get_db_connection()
+    try:
+        return core.ip_cache.body(conn, status, now, jails=jails or None, fmt=fmt, aggregate=aggregate)
+    finally:
+        core.db_pool.return_connection(conn)
+
+
+def read_ip_list(status, now, search_ip, use_pagination, page, per_page, after, jails, aggregate):
+    conn = core.get_db_connection()
+    try:
+        return core.query_ip_list(conn.cursor(), status, now, search_ip, use_pagination, page, per_page, after, jails,
+                                  aggregate)
+    finally:
+        core.db_pool.return_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fail2ban-sync 服务端 asyncio 模式（仅客户端API）')
+    parser.add_argument('--bind', default=config['async_bind'],
+                        help='监听地址，如 0.0.0.0:5001 或 unix:/run/fail2bansync/api.sock')
+    parser.add_argument('--readers', type=int, default=config['async_readers'], help='读取线程数')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("未安装uvicorn，无法以asyncio模式启动，请执行: pip install uvicorn")
+        return 1
+
+    if config['db_max_connections'] < args.readers + 2:
+        logger.warning("db_max_connections=%s 小于读取线程数+2（%s），请求可能需要等待数据库连接",
+                       config['db_max_connections'], args.readers + 2)
+
+    core.init_db()
+    api = AsyncAPI(args.readers, config['write_batch_size'], config['write_batch_delay'] / 1000.0)
+    server_options = {
+        'backlog': config['backlog'],
+        'timeout_keep_alive': config['keepalive'],
+        'timeout_graceful_shutdown': config['graceful_timeout'],
+        'lifespan': 'on',
+        'access_log': False,
+        'log_level': 'warning',
+    }
+    if args.bind.startswith('unix:'):
+        server_options['uds'] = args.bind[len('unix:'):]
+    else:
+        host, _, port = args.bind.rpartition(':')
+        server_options['host'] = host or '0.0.0.0'
+        server_options['port'] = int(port)
+
+    logger.info("服务器已启动（asyncio模式），监听地址: %s，读取线程数: %s", args.bind, args.readers)
+    uvicorn.run(api, **server_options)
+    logger.info("服务器已关闭")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
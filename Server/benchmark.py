@@ -0,0 +1,621 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fail2ban-sync 服务端性能测试
+
+在本地临时目录中生成指定规模的数据库，以子进程方式启动服务器，用K个并发模拟客户端按
+不同的请求组合（场景）访问 /add_ips、/get_ips（分页和不分页）、/get_allowed_ips、
+/allow_ip 和 /dashboard，统计每种请求的 p50/p95/p99 延迟、吞吐量、"database is locked"
+重试次数和服务器进程的峰值内存，结果保存为JSON，便于比较不同版本。
+
+场景：
+    idle      空闲轮询：客户端携带ETag轮询封禁/允许列表，偶尔翻页和打开管理界面
+    ban_wave  封禁潮：大量客户端同时上报封禁（部分IP被多个客户端重复上报），并有放行操作
+    mixed     混合负载
+
+用法示例：
+    python3 benchmark.py --rows 100000 --jails 5 --clients 32 --duration 30
+    python3 benchmark.py --rows 1000000 --scenario ban_wave --server gunicorn --workers 2 --threads 8
+    python3 benchmark.py --db /tmp/bench.db --rows 5000000 --output after.json --compare before.json
+    python3 benchmark.py --set ip_cache=false --set write_batching=false --output baseline.json
+
+除Flask外不需要其他服务；--server gunicorn 需要安装gunicorn，--server async 需要安装uvicorn。
+"""
+
+import argparse
+import http.client
+import ipaddress
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = 'benchmark-token'
+WEB_USER = 'admin'
+WEB_PASS = 'benchmark'
+
+# 各场景中每种请求的权重
+SCENARIOS = {
+    'idle': {'get_ips': 40, 'get_allowed_ips': 40, 'get_ips_paged': 10, 'dashboard': 10},
+    'ban_wave': {'add_ips': 60, 'get_ips': 15, 'get_allowed_ips': 15, 'allow_ip': 10},
+    'mixed': {'add_ips': 15, 'get_ips': 30, 'get_ips_paged': 10, 'get_allowed_ips': 30, 'allow_ip': 5,
+              'dashboard': 10},
+}
+
+# 生成数据时各状态的比例
+DEFAULT_STATUS_MIX = 'blocked:0.6,allowed:0.1,known:0.3'
+
+
+def log_message(message):
+    """打印带时间戳的日志消息"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+
+def parse_status_mix(value):
+    mix = {}
+    for item in value.split(','):
+        status, _, ratio = item.partition(':')
+        if status.strip() not in ('blocked', 'allowed', 'known'):
+            raise argparse.ArgumentTypeError(f"无效的状态: {status}")
+        mix[status.strip()] = float(ratio)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("状态比例之和必须大于0")
+    return {status: ratio / total for status, ratio in mix.items()}
+
+
+def generate_ip(index, ipv6_ratio):
+    """按序号生成互不相同的IP（乘以奇数后取模，IPv4地址分散在整个地址空间）"""
+    if ipv6_ratio and (index * 7919) % 1000 < ipv6_ratio * 1000:
+        return str(ipaddress.IPv6Address((0x2001_0db8 << 96) | (index * 2654435761) % (1 << 64)))
+    return str(ipaddress.IPv4Address((index * 2654435761 + 16777216) % (1 << 32)))
+
+
+def write_server_config(work_dir, db_path, overrides):
+    lines = [
+        '[DEFAULT]',
+        f'db_path = {db_path}',
+        f'web_user = {WEB_USER}',
+        f'web_pass = {WEB_PASS}',
+        # 测试期间禁用封禁时长递增，避免不同规模的数据产生不同的计算量
+        'bantime = 1h',
+        'bantime.increment = false',
+    ]
+    lines.extend(f'{key} = {value}' for key, value in overrides)
+    lines.extend(['', '[api_tokens]', f'benchmark = {TOKEN}', ''])
+    with open(os.path.join(work_dir, 'serverconfig.ini'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def seed_database(db_path, rows, jails, status_mix, ipv6_ratio, seed):
+    """批量写入测试数据（通过触发器同时生成计数表和变更日志），返回生成的封禁IP样本"""
+    # 使用server.py的init_db()创建表、索引和触发器
+    sys.path.insert(0, SCRIPT_DIR)
+    import server as core
+    core.init_db()
+    core.db_pool.close_all()
+
+    conn = sqlite3.connect(db_path)
+    existing = conn.execute('SELECT COUNT(*) FROM ip_addresses').fetchone()[0]
+    if existing:
+        log_message(f"数据库中已有 {existing} 条记录，跳过数据生成")
+    else:
+        rng = random.Random(seed)
+        now = datetime.now()
+        jail_names = [f'jail{i}' for i in range(jails)]
+        statuses = list(status_mix)
+        weights = [status_mix[status] for status in statuses]
+        allowed_duration = core.ALLOWED_DURATION.total_seconds()
+        known_duration = core.KNOWN_DURATION.total_seconds()
+
+        def rows_iter():
+            for index in range(rows):
+                status = rng.choices(statuses, weights)[0]
+                if status == 'blocked':
+                    blocked_until = now + timedelta(seconds=rng.uniform(600, 7 * 86400))
+                    allowed_since = None
+                elif status == 'allowed':
+                    blocked_until = now - timedelta(seconds=rng.uniform(0, allowed_duration))
+                    allowed_since = blocked_until
+                else:
+                    blocked_until = now - timedelta(seconds=rng.uniform(allowed_duration, known_duration))
+                    allowed_since = None
+                yield (generate_ip(index, ipv6_ratio), 'benchmark', status, f'client{index % 50}',
+                       blocked_until.isoformat(' '), allowed_since.isoformat(' ') if allowed_since else None,
+                       rng.randint(1, 5), jail_names[index % jails])
+
+        start = time.monotonic()
+        batch = []
+        for row in rows_iter():
+            batch.append(row)
+            if len(batch) >= 50000:
+                conn.executemany('''
+                    INSERT INTO ip_addresses (ip_address, description, status, reported_by, blocked_until,
+                                              allowed_since, block_count, jail)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+                conn.commit()
+                batch = []
+        if batch:
+            conn.executemany('''
+                INSERT INTO ip_addresses (ip_address, description, status, reported_by, blocked_until,
+                                          allowed_since, block_count, jail)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
+        log_message(f"已生成 {rows} 条记录（{jails} 个jail），耗时 {time.monotonic() - start:.1f} 秒")
+
+    # 放行请求使用的封禁IP样本
+    sample = [row[0] for row in conn.execute(
+        "SELECT ip_address FROM ip_addresses WHERE status = 'blocked' ORDER BY random() LIMIT 100000")]
+    total = conn.execute('SELECT COUNT(*) FROM ip_addresses').fetchone()[0]
+    conn.close()
+    return sample, total
+
+
+class ServerProcess:
+    """以子进程方式运行服务器，收集其日志中的数据库锁重试/错误次数和进程树的内存占用"""
+
+    def __init__(self, mode, work_dir, port, workers, threads):
+        self.port = port
+        if mode == 'werkzeug':
+            command = [sys.executable, os.path.abspath(__file__), '--serve-port', str(port)]
+        elif mode == 'gunicorn':
+            command = [sys.executable, os.path.join(SCRIPT_DIR, 'server.py'), 'serve',
+                       '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads)]
+        else:
+            command = [sys.executable, os.path.join(SCRIPT_DIR, 'async_server.py'), '--bind', f'127.0.0.1:{port}',
+                       '--readers', str(threads)]
+        self.process = subprocess.Popen(command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                        text=True, errors='replace')
+        self.counters = {'db_locked_retries': 0, 'db_locked_errors': 0, 'server_errors': 0}
+        self.peak_rss = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        threading.Thread(target=self._read_log, daemon=True).start()
+        threading.Thread(target=self._sample_memory, daemon=True).start()
+
+    def _read_log(self):
+        for line in self.process.stderr:
+            with self._lock:
+                if '数据库已锁定' in line:
+                    self.counters['db_locked_retries'] += 1
+                if 'database is locked' in line:
+                    self.counters['db_locked_errors'] += 1
+                if ' - ERROR - ' in line:
+                    self.counters['server_errors'] += 1
+
+    def _process_tree(self):
+        pids = [self.process.pid]
+        try:
+            for entry in os.listdir('/proc'):
+                if entry.isdigit():
+                    try:
+                        with open(f'/proc/{entry}/stat') as f:
+                            if int(f.read().rsplit(')', 1)[1].split()[1]) == self.process.pid:
+                                pids.append(int(entry))
+                    except (OSError, IndexError, ValueError):
+                        pass
+        except OSError:
+            pass
+        return pids
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _sample_memory(self):
+        # 每0.25秒采样一次进程树（gunicorn主进程及worker）的常驻内存之和
+        while not self._stopped.wait(0.25):
+            rss = sum(self._rss(pid) for pid in self._process_tree())
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+
+    def snapshot(self):
+        """返回当前计数并重新开始统计峰值内存"""
+        with self._lock:
+            result = dict(self.counters, peak_rss_bytes=self.peak_rss or None)
+            self.peak_rss = 0
+        return result
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"服务器进程已退出，退出码: {self.process.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("等待服务器启动超时")
+
+    def stop(self):
+        self._stopped.set()
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def serve_werkzeug(port):
+    """--server werkzeug 的子进程：在当前目录（工作目录）加载服务器并以多线程WSGI服务器运行"""
+    sys.path.insert(0, SCRIPT_DIR)
+    import server as core
+    from werkzeug.serving import make_server
+    core.init_db()
+    core.ip_cache.load()
+    core.start_status_sweeper()
+    http_server = make_server('127.0.0.1', port, core.app, threaded=True)
+    try:
+        http_server.serve_forever()
+    finally:
+        core.stop_status_sweeper()
+        core.db_pool.close_all()
+    return 0
+
+
+class OperationStats:
+    def __init__(self):
+        self.latencies = []
+        self.status_codes = {}
+        self.bytes = 0
+        self.exceptions = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        for code, count in other.status_codes.items():
+            self.status_codes[code] = self.status_codes.get(code, 0) + count
+        self.bytes += other.bytes
+        self.exceptions += other.exceptions
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def percentile(p):
+            return round(latencies[min(count - 1, int(p / 100 * count))] * 1000, 3) if count else None
+
+        errors = sum(n for code, n in self.status_codes.items() if code >= 500) + self.exceptions
+        return {
+            'count': count,
+            'throughput': round(count / duration, 2) if duration else 0,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+            'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+            'max_ms': round(latencies[-1] * 1000, 3) if count else None,
+            'status_codes': {str(code): n for code, n in sorted(self.status_codes.items())},
+            'errors': errors,
+            'bytes': self.bytes,
+        }
+
+
+class SimulatedClient(threading.Thread):
+    """一个模拟客户端：保持一个HTTP长连接，按场景权重随机发送请求"""
+
+    def __init__(self, index, port, weights, shared, think_time, deadline, rng_seed):
+        super().__init__(name=f'client-{index}', daemon=True)
+        self.index = index
+        self.port = port
+        self.operations = list(weights)
+        self.weights = [weights[name] for name in self.operations]
+        self.shared = shared
+        self.think_time = think_time
+        self.deadline = deadline
+        self.rng = random.Random(rng_seed)
+        self.stats = {}
+        self.etags = {}
+        self.cookie = None
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None, use_etag=False):
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+        if use_etag and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            self.conn.close()
+            self.conn = None
+        if use_etag and response.getheader('ETag'):
+            self.etags[path] = response.getheader('ETag')
+        return response, data
+
+    def api_headers(self):
+        return {'Authorization': f'Bearer {TOKEN}', 'Content-Type': 'application/json'}
+
+    def login(self):
+        body = urlencode({'username': WEB_USER, 'password': WEB_PASS})
+        response, _ = self.request('POST', '/login', body,
+                                   {'Content-Type': 'application/x-www-form-urlencoded'})
+        cookie = response.getheader('Set-Cookie')
+        self.cookie = cookie.split(';', 1)[0] if cookie else None
+
+    def run_operation(self, name):
+        if name == 'get_ips':
+            return self.request('GET', '/get_ips', headers=self.api_headers(), use_etag=True)
+        if name == 'get_allowed_ips':
+            return self.request('GET', '/get_allowed_ips', headers=self.api_headers(), use_etag=True)
+        if name == 'get_ips_paged':
+            page = self.rng.randint(1, self.shared['pages'])
+            return self.request('GET', f'/get_ips?page={page}&per_page=100', headers=self.api_headers())
+        if name == 'add_ips':
+            body = json.dumps({'ips': self.shared['next_wave'](self.rng), 'jail': self.rng.choice(self.shared['jails']),
+                               'description': 'benchmark'})
+            return self.request('POST', '/add_ips', body, self.api_headers())
+        if name == 'allow_ip':
+            pool = self.shared['allow_pool']
+            ip = pool.pop() if pool else generate_ip(self.rng.randrange(1 << 30), 0)
+            return self.request('POST', '/allow_ip', json.dumps({'ip': ip}), self.api_headers())
+        if name == 'dashboard':
+            if self.cookie is None:
+                self.login()
+            return self.request('GET', '/dashboard', headers={'Cookie': self.cookie or ''})
+        raise ValueError(name)
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            stats = self.stats.setdefault(name, OperationStats())
+            start = time.monotonic()
+            try:
+                response, data = self.run_operation(name)
+            except Exception:
+                stats.exceptions += 1
+                time.sleep(0.05)
+                continue
+            stats.latencies.append(time.monotonic() - start)
+            stats.status_codes[response.status] = stats.status_codes.get(response.status, 0) + 1
+            stats.bytes += len(data)
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+        if self.conn is not None:
+            self.conn.close()
+
+
+def make_wave_source(start_index, batch_size, overlap, ipv6_ratio):
+    """add_ips的IP来源：overlap比例的IP取自最近上报过的IP（模拟多个客户端同时上报同一攻击源），其余为新IP"""
+    state = {'next': start_index, 'recent': []}
+    lock = threading.Lock()
+
+    def next_wave(rng):
+        with lock:
+            reused = [rng.choice(state['recent']) for _ in range(int(batch_size * overlap))] if state['recent'] else []
+            fresh = [generate_ip(state['next'] + i, ipv6_ratio) for i in range(batch_size - len(reused))]
+            state['next'] += len(fresh)
+            state['recent'] = (state['recent'] + fresh)[-5000:]
+        return fresh + reused
+
+    return next_wave
+
+
+def run_phase(scenario, args, port, shared, server_process):
+    weights = dict(SCENARIOS[scenario])
+    if args.server == 'async':
+        # asyncio模式不提供管理界面
+        weights.pop('dashboard', None)
+    server_process.snapshot()
+    log_message(f"开始场景 {scenario}：{args.clients} 个客户端，持续 {args.duration} 秒")
+    start = time.monotonic()
+    deadline = start + args.duration
+    clients = [SimulatedClient(i, port, weights, shared, args.think_time, deadline, args.seed * 1000 + i)
+               for i in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.monotonic() - start
+
+    merged = {}
+    for client in clients:
+        for name, stats in client.stats.items():
+            merged.setdefault(name, OperationStats()).merge(stats)
+    total = OperationStats()
+    for stats in merged.values():
+        total.merge(stats)
+    result = {
+        'scenario': scenario,
+        'duration': round(duration, 3),
+        'clients': args.clients,
+        'total': total.summary(duration),
+        'operations': {name: stats.summary(duration) for name, stats in sorted(merged.items())},
+    }
+    result.update(server_process.snapshot())
+    log_message(f"场景 {scenario} 完成：{result['total']['count']} 个请求，{result['total']['throughput']} 请求/秒，"
+                f"p95 {result['total']['p95_ms']} ms，数据库锁重试 {result['db_locked_retries']} 次")
+    return result
+
+
+def print_report(results):
+    for phase in results['phases']:
+        print(f"\n场景 {phase['scenario']}（{phase['duration']} 秒，{phase['clients']} 个客户端）")
+        print(f"{'请求':<18}{'次数':>8}{'请求/秒':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'错误':>6}")
+        for name, stats in list(phase['operations'].items()) + [('合计', phase['total'])]:
+            print(f"{name:<18}{stats['count']:>8}{stats['throughput']:>10}{stats['p50_ms'] or '-':>10}"
+                  f"{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}{stats['errors']:>6}")
+        peak = phase['peak_rss_bytes']
+        print(f"数据库锁重试: {phase['db_locked_retries']}，数据库锁错误: {phase['db_locked_errors']}，"
+              f"服务器错误日志: {phase['server_errors']}，峰值内存: {f'{peak / 1048576:.1f} MB' if peak else '未知'}")
+
+
+def print_comparison(results, baseline):
+    """与之前保存的结果比较各请求的吞吐量和p95延迟"""
+    previous = {phase['scenario']: phase for phase in baseline.get('phases', [])}
+    print(f"\n与 {baseline.get('version') or '基准结果'} 比较（正数表示变化百分比）")
+    for phase in results['phases']:
+        old_phase = previous.get(phase['scenario'])
+        if old_phase is None:
+            continue
+        print(f"\n场景 {phase['scenario']}")
+        print(f"{'请求':<18}{'请求/秒':>12}{'变化':>9}{'p95 ms':>12}{'变化':>9}")
+        for name, stats in list(phase['operations'].items()) + [('合计', phase['total'])]:
+            old = old_phase['total'] if name == '合计' else old_phase['operations'].get(name)
+            if not old:
+                continue
+
+            def change(new_value, old_value):
+                if not new_value or not old_value:
+                    return '-'
+                return f"{(new_value - old_value) / old_value * 100:+.1f}%"
+
+            print(f"{name:<18}{stats['throughput']:>12}{change(stats['throughput'], old['throughput']):>9}"
+                  f"{stats['p95_ms'] or '-':>12}{change(stats['p95_ms'], old['p95_ms']):>9}")
+
+
+def get_version():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fail2ban-sync 服务端性能测试')
+    parser.add_argument('--rows', type=int, default=100000, help='生成的IP记录数')
+    parser.add_argument('--jails', type=int, default=5, help='生成数据使用的jail数')
+    parser.add_argument('--status-mix', type=parse_status_mix, default=DEFAULT_STATUS_MIX,
+                        help=f'各状态的比例（默认 {DEFAULT_STATUS_MIX}）')
+    parser.add_argument('--ipv6-ratio', type=float, default=0.05, help='IPv6地址的比例')
+    parser.add_argument('--db', help='数据库路径，已有数据时直接使用（默认在工作目录中新建）')
+    parser.add_argument('--work-dir', help='工作目录（保存配置文件、日志和默认数据库，默认使用临时目录并在结束后删除）')
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'async'), default='werkzeug',
+                        help='服务器运行方式：werkzeug多线程服务器、server.py serve（gunicorn）或async_server.py')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn的worker进程数')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn每个worker的线程数或asyncio模式的读取线程数')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='覆盖serverconfig.ini的[DEFAULT]配置项，如 ip_cache=false，可多次指定')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='依次执行的场景，可多次指定（默认 idle、ban_wave、mixed）')
+    parser.add_argument('--clients', type=int, default=16, help='并发模拟客户端数')
+    parser.add_argument('--duration', type=float, default=20, help='每个场景的持续时间（秒）')
+    parser.add_argument('--think-time', type=float, default=0, help='客户端两次请求之间的平均间隔（秒），0表示连续请求')
+    parser.add_argument('--batch-size', type=int, default=50, help='每个add_ips请求上报的IP数')
+    parser.add_argument('--overlap', type=float, default=0.5, help='add_ips中重复上报最近IP的比例')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子')
+    parser.add_argument('--output', default='benchmark_results.json', help='结果JSON文件路径')
+    parser.add_argument('--compare', help='与之前保存的结果JSON比较')
+    parser.add_argument('--serve-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_port:
+        return serve_werkzeug(args.serve_port)
+
+    overrides = []
+    for item in args.set:
+        key, sep, value = item.partition('=')
+        if not sep:
+            parser.error(f"无效的配置项: {item}")
+        overrides.append((key.strip(), value.strip()))
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='f2bsync-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(work_dir, 'benchmark.db')
+    write_server_config(work_dir, db_path, overrides)
+    os.chdir(work_dir)
+    log_message(f"工作目录: {work_dir}，数据库: {db_path}")
+
+    server_process = None
+    try:
+        seed_start = time.monotonic()
+        sample, total_rows = seed_database(db_path, args.rows, args.jails, args.status_mix, args.ipv6_ratio, args.seed)
+        seed_seconds = time.monotonic() - seed_start
+
+        port = free_port()
+        server_process = ServerProcess(args.server, work_dir, port, args.workers, args.threads)
+        server_process.wait_ready()
+        log_message(f"服务器已启动（{args.server}），端口: {port}")
+
+        random.Random(args.seed).shuffle(sample)
+        shared = {
+            'jails': [f'jail{i}' for i in range(args.jails)],
+            'pages': max(1, len(sample) // 100),
+            'allow_pool': sample,
+            # 新上报的IP从生成数据之后的序号开始，不与已有记录重复
+            'next_wave': make_wave_source(max(args.rows, total_rows) + 1, args.batch_size, args.overlap,
+                                          args.ipv6_ratio),
+        }
+        results = {
+            'version': get_version(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'server': args.server,
+            'workers': args.workers if args.server == 'gunicorn' else 1,
+            'threads': args.threads,
+            'config_overrides': dict(overrides),
+            'dataset': {
+                'rows': total_rows,
+                'jails': args.jails,
+                'status_mix': args.status_mix,
+                'ipv6_ratio': args.ipv6_ratio,
+                'seed_seconds': round(seed_seconds, 2),
+                'db_bytes': os.path.getsize(db_path),
+            },
+            'phases': [],
+        }
+        for scenario in args.scenario or ['idle', 'ban_wave', 'mixed']:
+            results['phases'].append(run_phase(scenario, args, port, shared, server_process))
+    finally:
+        if server_process is not None:
+            server_process.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_report(results)
+    if baseline is not None:
+        print_comparison(results, baseline)
+    log_message(f"结果已保存到 {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -6,6 +6,7 @@ INSTALL_DIR="/opt/fail2bansync"
 VENV_DIR="${INSTALL_DIR}/venv"  # 虚拟环境目录
 SERVER_USER="fail2bansync"
 SERVER_FILE="https://gitea.yxliu.cc/gift95/fail2ban-sync/raw/branch/main/Server/server.py"
+ASYNC_SERVER_FILE="https://gitea.yxliu.cc/gift95/fail2ban-sync/raw/branch/main/Server/async_server.py"
 DASHBOARD_TEMPLATE="https://gitea.yxliu.cc/gift95/fail2ban-sync/raw/branch/main/Server/templates/dashboard.html"
 LOGIN_TEMPLATE="https://gitea.yxliu.cc/gift95/fail2ban-sync/raw/branch/main/Server/templates/login.html"
 SERVICE_NAME="fail2bansync-server"
@@ -48,6 +49,13 @@ fi
 sudo chown "$SERVER_USER:$SERVER_USER" "$INSTALL_DIR/server.py"
 sudo chmod +x "$INSTALL_DIR/server.py"
 echo "server.py 下载完成并设置执行权限"
+# 可选的asyncio模式（需要额外安装uvicorn）
+if sudo curl -s -f -o "$INSTALL_DIR/async_server.py" "$ASYNC_SERVER_FILE"; then
+    sudo chown "$SERVER_USER:$SERVER_USER" "$INSTALL_DIR/async_server.py"
+    echo "async_server.py 下载完成"
+else
+    echo "警告: 下载async_server.py失败，asyncio模式不可用"
+fi
 
 echo -e "\n=== 5/8 下载模板文件 ==="
 # 下载dashboard.html
@@ -107,8 +115,8 @@ echo "虚拟环境已创建: $VENV_DIR"
 
 # 升级pip并安装依赖（使用虚拟环境的pip）
 sudo -u "$SERVER_USER" "$PIP_BIN" install --upgrade pip
-sudo -u "$SERVER_USER" "$PIP_BIN" install flask flask_httpauth flask_compress
-echo "依赖包安装完成: flask, flask_httpauth, flask_compress"
+sudo -u "$SERVER_USER" "$PIP_BIN" install flask flask_httpauth flask_compress gunicorn
+echo "依赖包安装完成: flask, flask_httpauth, flask_compress, gunicorn"
 
 # 7. 创建Systemd服务文件（使用虚拟环境Python）
 echo -e "\n=== 8/8 创建Systemd服务 ==="
@@ -124,7 +132,11 @@ Type=simple
 User=$SERVER_USER
 Group=$SERVER_USER
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$PYTHON_BIN $INSTALL_DIR/server.py
+ExecStart=$PYTHON_BIN $INSTALL_DIR/server.py serve
+# 平滑重启：HUP信号让主进程启动新worker并在旧worker处理完请求后退出
+ExecReload=/bin/kill -HUP \$MAINPID
+KillSignal=SIGTERM
+TimeoutStopSec=40
 Restart=on-failure
 RestartSec=3
 StandardOutput=append:/var/log/fail2bansync-server.log
@@ -149,6 +161,7 @@ sudo systemctl restart "$SERVICE_NAME"
 echo -e "\n==== 安装完成! ===="
 echo "✅ Fail2BanSync服务器已配置为Systemd服务: $SERVICE_NAME"
 echo "📋 状态检查命令: sudo systemctl status $SERVICE_NAME"
+echo "🔄 平滑重启命令: sudo systemctl reload $SERVICE_NAME"
 echo "📜 日志查看命令: tail -f /var/log/fail2bansync-server.log"
 echo "⚙️  配置文件: $INSTALL_DIR/serverconfig.ini"
 echo "🌐 虚拟环境: $VENV_DIR"
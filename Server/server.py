@@ -1,13 +1,39 @@
 import sqlite3
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, session, g, has_request_context
+from flask import before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
 from flask_compress import Compress
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import configparser
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
 import re
 import time
+import threading
+import queue
+import concurrent.futures
+import json
+import zlib
+import gzip
+import hashlib
+import bisect
+import sys
+import ipaddress
+import functools
+import socket
+import argparse
+import atexit
+import shutil
+import tempfile
+import io
+import marshal
+import cProfile
+import pstats
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台没有文件锁，只能单进程运行
+    fcntl = None
 from contextlib import closing
 from flask_httpauth import HTTPTokenAuth, HTTPBasicAuth
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -32,7 +58,6 @@ def get_client_ip():
 
 # 初始化Flask应用
 app = Flask(__name__)
-DATABASE = 'ip_management.db'
 
 # 配置gzip压缩
 compress = Compress()
@@ -54,8 +79,43 @@ def load_config():
             'bantime.maxtime': '5w',
             'known_duration': '48h',
             'allowed_duration': '2m',
+            'status_sweep_interval': '30s',
+            'change_log_retention': '24h',
             'web_user': 'admin',
-            'web_pass': 'admin123'
+            'web_pass': 'admin123',
+            'db_path': 'ip_management.db',
+            'db_max_connections': '5',
+            'db_timeout': '10',
+            'db_cache_size': '16384',
+            'db_mmap_size': '67108864',
+            'bind': '0.0.0.0:5000',
+            'workers': '2',
+            'threads': '4',
+            'backlog': '2048',
+            'keepalive': '5',
+            'graceful_timeout': '30',
+            'secret_key': '',
+            'secret_key_file': 'secret_key',
+            'async_bind': '0.0.0.0:5001',
+            'async_readers': '4',
+            'write_batching': 'true',
+            'write_batch_size': '256',
+            'write_batch_delay': '5',
+            'ip_cache': 'true',
+            'aggregate_ipv4': '24:16',
+            'aggregate_ipv6': '64:8',
+            'events_poll_interval': '1',
+            'events_max_streams': '1000',
+            'events_heartbeat': '15',
+            'events_max_duration': '300',
+            'metrics': 'true',
+            'log_file': 'server.log',
+            'log_level': 'INFO',
+            'log_queue': 'true',
+            'log_sample_rate': '0.1',
+            'log_storm_threshold': '200',
+            'profiling': 'false',
+            'slow_query_ms': '0'
         }
     })
 
@@ -74,15 +134,52 @@ def load_config():
         'bantime_maxtime': config.get('DEFAULT', 'bantime.maxtime', fallback='5w'),
         'known_duration': config.get('DEFAULT', 'known_duration', fallback='48h'),
         'allowed_duration': config.get('DEFAULT', 'allowed_duration', fallback='2m'),
+        'status_sweep_interval': config.get('DEFAULT', 'status_sweep_interval', fallback='30s'),
+        'change_log_retention': config.get('DEFAULT', 'change_log_retention', fallback='24h'),
         'api_tokens': tokens,
         'web_user': config.get('DEFAULT', 'web_user', fallback='admin'),
-        'web_pass': config.get('DEFAULT', 'web_pass', fallback='admin123')
+        'web_pass': config.get('DEFAULT', 'web_pass', fallback='admin123'),
+        'db_path': config.get('DEFAULT', 'db_path', fallback='ip_management.db'),
+        'db_max_connections': config.getint('DEFAULT', 'db_max_connections', fallback=5),
+        'db_timeout': config.getfloat('DEFAULT', 'db_timeout', fallback=10),
+        'db_cache_size': config.getint('DEFAULT', 'db_cache_size', fallback=16384),
+        'db_mmap_size': config.getint('DEFAULT', 'db_mmap_size', fallback=67108864),
+        'bind': [addr.strip() for addr in config.get('DEFAULT', 'bind', fallback='0.0.0.0:5000').split(',') if addr.strip()],
+        'workers': config.getint('DEFAULT', 'workers', fallback=2),
+        'threads': config.getint('DEFAULT', 'threads', fallback=4),
+        'backlog': config.getint('DEFAULT', 'backlog', fallback=2048),
+        'keepalive': config.getint('DEFAULT', 'keepalive', fallback=5),
+        'graceful_timeout': config.getint('DEFAULT', 'graceful_timeout', fallback=30),
+        'secret_key': config.get('DEFAULT', 'secret_key', fallback=''),
+        'secret_key_file': config.get('DEFAULT', 'secret_key_file', fallback='secret_key'),
+        'async_bind': config.get('DEFAULT', 'async_bind', fallback='0.0.0.0:5001'),
+        'async_readers': config.getint('DEFAULT', 'async_readers', fallback=4),
+        'write_batching': config.getboolean('DEFAULT', 'write_batching', fallback=True),
+        'write_batch_size': config.getint('DEFAULT', 'write_batch_size', fallback=256),
+        'write_batch_delay': config.getfloat('DEFAULT', 'write_batch_delay', fallback=5),
+        'ip_cache': config.getboolean('DEFAULT', 'ip_cache', fallback=True),
+        'aggregate_ipv4': config.get('DEFAULT', 'aggregate_ipv4', fallback='24:16'),
+        'aggregate_ipv6': config.get('DEFAULT', 'aggregate_ipv6', fallback='64:8'),
+        'events_poll_interval': config.getfloat('DEFAULT', 'events_poll_interval', fallback=1),
+        'events_max_streams': config.getint('DEFAULT', 'events_max_streams', fallback=1000),
+        'events_heartbeat': config.getfloat('DEFAULT', 'events_heartbeat', fallback=15),
+        'events_max_duration': config.getfloat('DEFAULT', 'events_max_duration', fallback=300),
+        'metrics': config.getboolean('DEFAULT', 'metrics', fallback=True),
+        'log_file': config.get('DEFAULT', 'log_file', fallback='server.log'),
+        'log_level': config.get('DEFAULT', 'log_level', fallback='INFO').upper(),
+        'log_queue': config.getboolean('DEFAULT', 'log_queue', fallback=True),
+        'log_sample_rate': config.getfloat('DEFAULT', 'log_sample_rate', fallback=0.1),
+        'log_storm_threshold': config.getint('DEFAULT', 'log_storm_threshold', fallback=200),
+        'profiling': config.getboolean('DEFAULT', 'profiling', fallback=False),
+        'slow_query_ms': config.getfloat('DEFAULT', 'slow_query_ms', fallback=0)
     }
 
 # 时间转换
 def parse_time(time_str):
     time_str = time_str.strip().lower()
-    if time_str.endswith('m'):
+    if time_str.endswith('s'):
+        return timedelta(seconds=int(time_str[:-1]))
+    elif time_str.endswith('m'):
         return timedelta(minutes=int(time_str[:-1]))
     elif time_str.endswith('h'):
         return timedelta(hours=int(time_str[:-1]))
@@ -93,6 +190,20 @@ def parse_time(time_str):
     else:
         return timedelta(minutes=3)  # 默认值3分钟
 
+# 网段聚合规则："前缀长度:最少IP数"，多个规则用逗号分隔，返回按前缀长度升序排列的[(前缀长度, 最少IP数), ...]
+def parse_aggregate_rules(value, max_prefixlen):
+    rules = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        prefixlen, _, threshold = item.partition(':')
+        prefixlen, threshold = int(prefixlen), int(threshold)
+        if not 0 < prefixlen < max_prefixlen or threshold < 2:
+            raise ValueError(f"无效的网段聚合规则: {item}")
+        rules.append((prefixlen, threshold))
+    return sorted(rules)
+
 # 初始化配置和日志器
 config = load_config()
 BLOCK_DURATION = parse_time(config['bantime'])
@@ -103,39 +214,183 @@ WEB_PASS = config['web_pass']
 MAX_BLOCK_DURATION = parse_time(config['bantime_maxtime'])
 KNOWN_DURATION = parse_time(config['known_duration'])
 ALLOWED_DURATION = parse_time(config['allowed_duration'])
+STATUS_SWEEP_INTERVAL = parse_time(config['status_sweep_interval'])
+CHANGE_LOG_RETENTION = parse_time(config['change_log_retention'])
+DATABASE = config['db_path']
+WRITE_BATCHING = config['write_batching']
+AGGREGATE_IPV4 = parse_aggregate_rules(config['aggregate_ipv4'], 32)
+AGGREGATE_IPV6 = parse_aggregate_rules(config['aggregate_ipv6'], 128)
+PROFILING = config['profiling']
+SLOW_QUERY_THRESHOLD = config['slow_query_ms'] / 1000.0
+
+# 高频日志（逐请求、逐IP）使用 extra=LOG_SAMPLED 标记，封禁风暴期间只按比例保留
+LOG_SAMPLED = {'sampled': True}
+
+class LogSampler(logging.Filter):
+    """每秒带采样标记的日志超过threshold条后，只保留其中rate比例的记录；
+    未标记的日志（错误、启动信息等）不受影响，被省略的条数附加在下一条保留的日志中"""
+
+    def __init__(self, rate, threshold):
+        super().__init__()
+        self.threshold = threshold
+        self.interval = round(1 / rate) if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._window = 0
+        self._count = 0
+        self._dropped = 0
+
+    def filter(self, record):
+        if self.interval == 1 or not getattr(record, 'sampled', False):
+            return True
+        window = int(time.monotonic())
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            self._count += 1
+            over = self._count - self.threshold
+            if over > 0 and not (self.interval and over % self.interval == 0):
+                self._dropped += 1
+                return False
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            record.msg = f"{record.getMessage()}（日志采样：此前省略了 {dropped} 条）"
+            record.args = None
+        return True
+
+# 队列日志：请求线程只把日志记录放入队列，由后台线程写入文件和控制台
+log_queue_handler = None
+log_handlers = []
+log_listener = None
+
+def start_log_listener():
+    """启动后台日志线程；fork出的子进程不会继承父进程的线程，需要在子进程中重新调用"""
+    global log_listener
+    if log_queue_handler is None:
+        return
+    # 子进程使用新的队列，父进程队列中尚未写出的记录由父进程自己的线程写出
+    log_queue_handler.queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue_handler.queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+
+def stop_log_listener():
+    """写出队列中剩余的日志并停止后台日志线程"""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+def use_log_handlers(handlers):
+    """替换实际写出日志的handler（队列模式下由后台日志线程调用）"""
+    global log_handlers
+    logger = logging.getLogger('ip_server')
+    if log_queue_handler is None:
+        for handler in log_handlers:
+            logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+    log_handlers = handlers
+    start_log_listener()
+
+# 生产模式下的日志：各worker把日志记录通过Unix数据报socket发送给主进程，只由主进程写入并轮转日志文件，
+# 避免多个进程各自轮转同一个文件（一个进程改名后其他进程仍写入改名后的文件）；
+# 每条记录是一个完整的数据报，不需要跨进程的锁，worker被强制结束也不会影响其他worker
+LOG_FORWARD_MAX_MESSAGE = 32768
+
+class LogForwardHandler(logging.Handler):
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+
+    def emit(self, record):
+        try:
+            message = self.format(record)
+            if len(message) > LOG_FORWARD_MAX_MESSAGE:
+                message = message[:LOG_FORWARD_MAX_MESSAGE] + '...（日志过长，已截断）'
+            self.sock.send(json.dumps({
+                'name': record.name, 'levelno': record.levelno, 'levelname': record.levelname,
+                'msg': message, 'created': record.created, 'msecs': record.msecs,
+                'process': record.process, 'threadName': record.threadName
+            }).encode('utf-8'))
+        except Exception:
+            self.handleError(record)
+
+def write_forwarded_record(data):
+    record = logging.makeLogRecord(json.loads(data))
+    for handler in log_handlers:
+        if record.levelno >= handler.level:
+            handler.handle(record)
+
+# 主进程的日志收集线程：接收各worker发送的日志记录并写入主进程的handler
+def collect_worker_logs(sock):
+    while True:
+        try:
+            data = sock.recv(LOG_FORWARD_MAX_MESSAGE * 4 + 4096)
+        except OSError:
+            return
+        try:
+            write_forwarded_record(data)
+        except Exception as e:
+            logger.error("写入worker日志时出错: %s", e)
+
+# 主进程退出前写出socket中尚未读取的日志
+def drain_worker_logs(sock):
+    sock.setblocking(False)
+    while True:
+        try:
+            data = sock.recv(LOG_FORWARD_MAX_MESSAGE * 4 + 4096)
+        except OSError:
+            return
+        try:
+            write_forwarded_record(data)
+        except Exception:
+            pass
 
 # 设置日志
 def setup_logging():
+    global log_queue_handler, log_handlers
     logger = logging.getLogger('ip_server')
-    logger.setLevel(logging.INFO)
+    logger.setLevel(getattr(logging, config['log_level'], logging.INFO))
     
-    # 清除已有的handler，避免重复添加
-    if logger.handlers:
-        for handler in logger.handlers:
-            logger.removeHandler(handler)
+    # 清除已有的handler和filter，避免重复添加
+    stop_log_listener()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for log_filter in list(logger.filters):
+        logger.removeFilter(log_filter)
     
     # 文件日志handler
     file_handler = RotatingFileHandler(
-        'server.log',
+        config['log_file'],
         maxBytes=1024*1024,
         backupCount=5
     )
-    file_handler.setLevel(logging.INFO)
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
     
     # 优化日志格式，使用简洁的时间戳和级别
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
+    log_handlers = [file_handler, console_handler]
     
     # 添加handler
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if config['log_queue']:
+        log_queue_handler = QueueHandler(queue.SimpleQueue())
+        logger.addHandler(log_queue_handler)
+        start_log_listener()
+    else:
+        log_queue_handler = None
+        for handler in log_handlers:
+            logger.addHandler(handler)
+    
+    if config['log_sample_rate'] < 1:
+        logger.addFilter(LogSampler(config['log_sample_rate'], config['log_storm_threshold']))
     
     return logger
 
 logger = setup_logging()
+# 进程退出时写出队列中剩余的日志
+atexit.register(stop_log_listener)
 
 def init_db():
     conn = None
@@ -167,45 +422,780 @@ def init_db():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_addresses_status ON ip_addresses(status)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_addresses_status_ip ON ip_addresses(status, ip_address)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_jail ON ip_addresses(jail)')
+        # 按状态和到期时间查找尚未被清理线程迁移的过期记录（计数修正和清理线程使用）
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_addresses_status_time ON ip_addresses(status, blocked_until)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_addresses_status_allowed ON ip_addresses(status, allowed_since)')
+        # 按jail过滤的列表查询（jail=参数）：包含判断实际状态所需的时间列，查询只读取索引
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_addresses_status_jail ON ip_addresses(status, jail, ip_address, blocked_until, allowed_since)')
         
+        # 变更日志表：每次状态迁移追加一条记录，seq作为客户端增量同步的游标
+        cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ip_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip_address TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    jail TEXT,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ip_changes_changed_at ON ip_changes(changed_at)')
+        cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER
+                )
+        ''')
+        
+        # 通过触发器记录所有写入路径（add_ips、放行、过期清理）上的状态变化
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_insert_change
+                AFTER INSERT ON ip_addresses
+                BEGIN
+                    INSERT INTO ip_changes (ip_address, status, jail) VALUES (NEW.ip_address, NEW.status, NEW.jail);
+                END
+        ''')
+        # 封禁到期但尚未被清理线程迁移的IP再次被封禁时status不变，也需要记录（内存缓存据此同步其他进程的写入）
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_ip_addresses_update_change'")
+        trigger = cursor.fetchone()
+        if trigger and 'blocked_until' not in trigger[0]:
+            # 升级旧版本创建的触发器
+            cursor.execute('DROP TRIGGER trg_ip_addresses_update_change')
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_update_change
+                AFTER UPDATE OF status, jail, blocked_until ON ip_addresses
+                WHEN OLD.status IS NOT NEW.status OR OLD.jail IS NOT NEW.jail OR OLD.blocked_until IS NOT NEW.blocked_until
+                BEGIN
+                    INSERT INTO ip_changes (ip_address, status, jail) VALUES (NEW.ip_address, NEW.status, NEW.jail);
+                END
+        ''')
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_delete_change
+                AFTER DELETE ON ip_addresses
+                BEGIN
+                    INSERT INTO ip_changes (ip_address, status, jail) VALUES (OLD.ip_address, 'deleted', OLD.jail);
+                END
+        ''')
+        
+        # 按状态和jail维护的计数表，由触发器在同一事务中更新，列表接口据此返回总数和各jail数量
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ip_stats'")
+        stats_exists = cursor.fetchone() is not None
+        cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ip_stats (
+                    status TEXT NOT NULL,
+                    jail TEXT NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (status, jail)
+                ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_insert_stats
+                AFTER INSERT ON ip_addresses
+                BEGIN
+                    INSERT INTO ip_stats (status, jail, count) VALUES (NEW.status, COALESCE(NEW.jail, ''), 1)
+                    ON CONFLICT(status, jail) DO UPDATE SET count = count + 1;
+                END
+        ''')
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_update_stats
+                AFTER UPDATE OF status, jail ON ip_addresses
+                WHEN OLD.status IS NOT NEW.status OR OLD.jail IS NOT NEW.jail
+                BEGIN
+                    UPDATE ip_stats SET count = count - 1 WHERE status = OLD.status AND jail = COALESCE(OLD.jail, '');
+                    INSERT INTO ip_stats (status, jail, count) VALUES (NEW.status, COALESCE(NEW.jail, ''), 1)
+                    ON CONFLICT(status, jail) DO UPDATE SET count = count + 1;
+                END
+        ''')
+        cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_ip_addresses_delete_stats
+                AFTER DELETE ON ip_addresses
+                BEGIN
+                    UPDATE ip_stats SET count = count - 1 WHERE status = OLD.status AND jail = COALESCE(OLD.jail, '');
+                END
+        ''')
+        if not stats_exists:
+            # 升级已有数据库时根据现有数据生成计数
+            rebuild_ip_stats(cursor)
+
+        # 新建的jail索引没有统计信息时收集一次，否则查询优化器按jail过滤时不会选用该索引
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        analyzed = cursor.fetchone() is not None
+        if analyzed:
+            cursor.execute("SELECT 1 FROM sqlite_stat1 WHERE idx = 'idx_ip_addresses_status_jail'")
+            analyzed = cursor.fetchone() is not None
+        if not analyzed:
+            cursor.execute('ANALYZE ip_addresses')
+
         conn.commit()
         logger.info("数据库初始化成功")
     except Exception as e:
-        logger.error(f"初始化数据库时出错: {e}")
+        logger.error("初始化数据库时出错: %s", e)
         raise
     finally:
         if conn:
             db_pool.return_connection(conn)
 
+# 运行指标（Prometheus文本格式，由 /metrics 输出）
+# 每个线程只写入自己的分片，记录时不需要加锁；输出时合并所有分片，已结束线程的分片并入retired。
+# gunicorn多worker时各worker定期把自己的数据写入共享目录（shared_dir），任一worker输出所有worker的合计
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.shared_dir = None
+        self._definitions = {}    # 名称 -> (类型, 说明, 直方图桶上界)
+        self._collectors = []     # 输出时调用，返回本进程当前值 [(名称, 标签, 值)]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []         # [(线程, 计数器, 直方图)]
+        self._retired = ({}, {})
+        self._retire_at = 64
+        self._file_name = None
+        self._flusher = None
+        self._stop_flush = threading.Event()
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._definitions[name] = (kind, help_text, tuple(buckets) if buckets else None)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = ({}, {})
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard[0], shard[1]))
+                # 每个请求一个线程时（开发服务器）定期合并已结束线程的分片
+                if len(self._shards) >= self._retire_at:
+                    self._retire_dead()
+                    self._retire_at = 2 * len(self._shards) + 64
+            self._local.shard = shard
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        if self.enabled:
+            counters = self._shard()[0]
+            key = (name, labels)
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        if self.enabled:
+            histograms = self._shard()[1]
+            buckets = self._definitions[name][2]
+            key = (name, labels)
+            histogram = histograms.get(key)
+            if histogram is None:
+                # 各桶的计数（最后一个为+Inf），最后一项为总和
+                histogram = histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def time(self, name, labels=()):
+        return MetricsTimer(self, name, labels)
+
+    @staticmethod
+    def _merge(target, counters, histograms):
+        target_counters, target_histograms = target
+        for key, value in counters:
+            target_counters[key] = target_counters.get(key, 0) + value
+        for key, values in histograms:
+            histogram = target_histograms.get(key)
+            if histogram is None:
+                target_histograms[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    # 调用方需持有_lock；线程已结束，其分片不会再被写入
+    def _retire_dead(self):
+        alive = []
+        for thread, counters, histograms in self._shards:
+            if thread.is_alive():
+                alive.append((thread, counters, histograms))
+            else:
+                self._merge(self._retired, counters.items(), histograms.items())
+        self._shards = alive
+
+    # 合并本进程的所有分片，返回 (计数器, 直方图, 当前值)
+    def collect(self):
+        with self._lock:
+            self._retire_dead()
+            counters = dict(self._retired[0])
+            histograms = {key: list(values) for key, values in self._retired[1].items()}
+            shards = list(self._shards)
+        for _, shard_counters, shard_histograms in shards:
+            # 其他线程可能正在写入，先复制出键值（list()在持有GIL时一次完成）
+            self._merge((counters, histograms), list(shard_counters.items()), list(shard_histograms.items()))
+        gauges = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, labels)] = value
+        return counters, histograms, gauges
+
+    # fork之后在worker中调用，丢弃从主进程继承的数据
+    def reset(self):
+        with self._lock:
+            self._shards = []
+            self._retired = ({}, {})
+            self._local = threading.local()
+
+    def start_flush(self, interval):
+        if not self.enabled or not self.shared_dir:
+            return
+        # 文件名包含启动时间，worker的PID被复用时不会覆盖已退出worker的数据
+        self._file_name = f"{os.getpid()}-{time.time_ns()}.json"
+        self._stop_flush.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(interval,), name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def stop_flush(self):
+        if self._flusher is None:
+            return
+        self._stop_flush.set()
+        self._flusher.join(timeout=5)
+        self._flusher = None
+        self.flush()
+
+    def _flush_loop(self, interval):
+        while not self._stop_flush.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("写入运行指标文件时出错: %s", e)
+
+    # 把本进程的数据写入共享目录（先写临时文件再改名，读取方不会读到写了一半的文件）
+    def flush(self):
+        if not self._file_name:
+            return
+        counters, histograms, gauges = self.collect()
+        data = {
+            'pid': os.getpid(),
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in gauges.items()]
+        }
+        path = os.path.join(self.shared_dir, self._file_name)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _process_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    # 合并其他worker写入共享目录的数据：计数器和直方图包括已退出的worker，当前值只计算仍在运行的worker
+    def _merge_shared(self, counters, histograms, gauges):
+        try:
+            names = os.listdir(self.shared_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json') or name == self._file_name:
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, name), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            key = lambda item: (item[0], tuple(tuple(pair) for pair in item[1]))
+            self._merge((counters, histograms), [(key(item), item[2]) for item in data['counters']],
+                        [(key(item), item[2]) for item in data['histograms']])
+            if self._process_alive(data['pid']):
+                for item in data['gauges']:
+                    gauges[key(item)] = gauges.get(key(item), 0) + item[2]
+
+    @staticmethod
+    def _format_labels(labels):
+        parts = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                 for name, value in labels]
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    @staticmethod
+    def _format_value(value):
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    # 生成Prometheus文本格式的输出，samples为输出时额外计算的当前值 [(名称, 标签, 值)]
+    def render(self, samples=()):
+        counters, histograms, gauges = self.collect()
+        if self.shared_dir:
+            self._merge_shared(counters, histograms, gauges)
+        for name, labels, value in samples:
+            gauges[(name, labels)] = value
+        values = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            values.setdefault(name, []).append((labels, value))
+        for (name, labels), value in histograms.items():
+            values.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(values.get(name, [])):
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._format_labels(labels)} {self._format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else self._format_value(bound)
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {self._format_value(value[-1])}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsTimer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.labels)
+
+metrics = Metrics(config['metrics'])
+# gunicorn各worker写入共享目录的间隔（秒）
+METRICS_FLUSH_INTERVAL = 5
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+BATCH_SIZE_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+metrics.describe('f2bsync_http_requests_total', 'counter', '按路由、方法和状态码统计的请求数')
+metrics.describe('f2bsync_http_request_duration_seconds', 'histogram', '请求处理时间（不含流式响应）', LATENCY_BUCKETS)
+metrics.describe('f2bsync_http_response_bytes_total', 'counter',
+                 '响应体字节数，stage=uncompressed为压缩前，stage=sent为实际发送（不含流式响应）')
+metrics.describe('f2bsync_db_query_duration_seconds', 'histogram',
+                 'SQLite语句执行时间，kind为sweep/lookup/upsert/count/group_by/commit', DB_QUERY_BUCKETS)
+metrics.describe('f2bsync_db_lock_retries_total', 'counter', '数据库已锁定后等待重试的次数')
+metrics.describe('f2bsync_db_pool_connections', 'gauge', '数据库连接池中的连接数')
+metrics.describe('f2bsync_db_pool_max_connections', 'gauge', '数据库连接池的连接数上限')
+metrics.describe('f2bsync_db_pool_checkouts_total', 'counter', '从连接池取得连接的次数')
+metrics.describe('f2bsync_db_pool_waits_total', 'counter', '连接数已达上限、等待其他请求归还连接的次数')
+metrics.describe('f2bsync_db_pool_wait_seconds_total', 'counter', '等待连接的总时间')
+metrics.describe('f2bsync_db_pool_exhausted_total', 'counter', '等待连接超时的次数')
+metrics.describe('f2bsync_ips', 'gauge', '按实际状态和jail统计的IP数')
+metrics.describe('f2bsync_add_ips_batch_size', 'histogram', '每个/add_ips请求上报的IP数', BATCH_SIZE_BUCKETS)
+metrics.describe('f2bsync_ips_banned_total', 'counter', '/add_ips新封禁的IP数')
+metrics.describe('f2bsync_write_batch_operations', 'histogram', '合并提交时每个事务包含的写操作数', BATCH_SIZE_BUCKETS)
+
+# 按查询类型统计SQLite语句的执行时间
+def db_timer(kind):
+    return metrics.time('f2bsync_db_query_duration_seconds', (('kind', kind),))
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
+
+# after_request按注册的逆序执行：本函数在flask_compress之后注册，在压缩之前执行
+@app.after_request
+def record_uncompressed_bytes(response):
+    if metrics.enabled and not response.is_streamed:
+        length = g.get('uncompressed_bytes', response.content_length)
+        if length is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.inc('f2bsync_http_response_bytes_total', (('route', route), ('stage', 'uncompressed')), length)
+    return response
+
+# 插到after_request列表最前面，在flask_compress压缩之后最后执行
+def record_request_metrics(response):
+    if metrics.enabled:
+        # 使用路由规则而不是实际路径，避免标签取值无限增长
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.inc('f2bsync_http_requests_total',
+                    (('route', route), ('method', request.method), ('status', str(response.status_code))))
+        start = g.get('request_start')
+        if not response.is_streamed:
+            if start is not None:
+                metrics.observe('f2bsync_http_request_duration_seconds', time.perf_counter() - start, (('route', route),))
+            if response.content_length is not None:
+                metrics.inc('f2bsync_http_response_bytes_total', (('route', route), ('stage', 'sent')),
+                            response.content_length)
+    return response
+
+app.after_request_funcs.setdefault(None, []).insert(0, record_request_metrics)
+
+# 请求分阶段计时：profiling = true 时记录每个请求在db、serialize、compress、render各阶段的耗时，
+# 通过Server-Timing响应头返回（浏览器开发者工具可直接显示）
+REQUEST_PHASES = ('db', 'serialize', 'compress', 'render')
+_request_phases = threading.local()
+
+def add_phase_time(phase, elapsed):
+    times = getattr(_request_phases, 'times', None)
+    if times is not None:
+        times[phase] += elapsed
+
+class PhaseTimer:
+    __slots__ = ('phase', 'start')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_phase_time(self.phase, time.perf_counter() - self.start)
+
+def request_phase(phase):
+    return PhaseTimer(phase)
+
+@app.before_request
+def start_request_phases():
+    if PROFILING:
+        _request_phases.start = time.perf_counter()
+        _request_phases.times = dict.fromkeys(REQUEST_PHASES, 0.0)
+
+# 插到after_request列表最前面，在flask_compress压缩之后执行
+def add_server_timing(response):
+    times = getattr(_request_phases, 'times', None)
+    if times is not None:
+        _request_phases.times = None
+        parts = [f"{phase};dur={times[phase] * 1000:.2f}" for phase in REQUEST_PHASES]
+        parts.append(f"total;dur={(time.perf_counter() - _request_phases.start) * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+def timed_compress(response):
+    with request_phase('compress'):
+        return compress.after_request(response)
+
+# jsonify()的序列化时间计入serialize阶段
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with request_phase('serialize'):
+            return super().dumps(obj, **kwargs)
+
+def start_render_timer(sender, template, context, **extra):
+    _request_phases.render_start = time.perf_counter()
+
+def stop_render_timer(sender, template, context, **extra):
+    add_phase_time('render', time.perf_counter() - _request_phases.render_start)
+
+if PROFILING:
+    app.after_request_funcs[None].insert(0, add_server_timing)
+    after_request_funcs = app.after_request_funcs[None]
+    if compress.after_request in after_request_funcs:
+        after_request_funcs[after_request_funcs.index(compress.after_request)] = timed_compress
+    app.json = TimedJSONProvider(app)
+    before_render_template.connect(start_render_timer, app)
+    template_rendered.connect(stop_render_timer, app)
+
+# 慢查询日志：语句执行（execute及之后读取结果）累计超过slow_query_ms时，连同执行计划记录一条警告
+SLOW_QUERY_MAX_LENGTH = 1000
+SLOW_QUERY_EXPLAIN_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+def log_slow_query(conn, sql, parameters, elapsed):
+    statement = ' '.join(sql.split())
+    plan = '无'
+    # executemany的参数已被消耗（parameters为None），BEGIN等语句没有执行计划
+    if parameters is not None and statement.upper().startswith(SLOW_QUERY_EXPLAIN_PREFIXES):
+        try:
+            rows = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+            plan = '; '.join(row[3] for row in rows)
+        except sqlite3.Error as e:
+            plan = f'无法获取（{e}）'
+    source = request.path if has_request_context() else threading.current_thread().name
+    params = repr(parameters) if parameters is not None else '(executemany)'
+    logger.warning("慢查询 %.1f ms [%s]: %s 参数: %s 执行计划: %s", elapsed * 1000, source,
+                   statement[:SLOW_QUERY_MAX_LENGTH], params[:200], plan)
+
+class ProfiledCursor(sqlite3.Cursor):
+    """统计每条语句的耗时：计入当前请求的db阶段，超过阈值时记录慢查询日志。
+    耗时包括execute和随后的fetchone/fetchmany/fetchall以及直接迭代游标读取的时间"""
+
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        self._statement = [sql, parameters, 0.0, False]
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._statement = [sql, None, 0.0, False]
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _record(self, elapsed):
+        add_phase_time('db', elapsed)
+        statement = self._statement
+        if statement is None:
+            return
+        statement[2] += elapsed
+        if SLOW_QUERY_THRESHOLD and not statement[3] and statement[2] >= SLOW_QUERY_THRESHOLD:
+            statement[3] = True
+            log_slow_query(self.connection, statement[0], statement[1], statement[2])
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class RequestProfiler:
+    """采集期间按比例对请求运行cProfile，结束时合并各请求的结果（只包含本进程处理的请求）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = 0.0
+        self._interval = 1
+        self._counter = 0
+        self._stats = None
+        self._requests = 0
+
+    @property
+    def active(self):
+        return time.monotonic() < self._until
+
+    # 开始采集，已有正在进行的采集时返回False
+    def start(self, seconds, sample_rate):
+        with self._lock:
+            if self.active:
+                return False
+            self._interval = max(1, round(1 / sample_rate))
+            self._counter = 0
+            self._stats = None
+            self._requests = 0
+            self._until = time.monotonic() + seconds
+        return True
+
+    def begin_request(self):
+        if not self.active:
+            return None
+        with self._lock:
+            self._counter += 1
+            if self._counter % self._interval:
+                return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12起同一时刻只能启用一个cProfile，跳过与其他请求重叠的采样
+            return None
+        return profile
+
+    def end_request(self, profile):
+        profile.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._requests += 1
+
+    # 结束采集，返回(合并后的pstats.Stats或None, 分析的请求数)
+    def finish(self):
+        with self._lock:
+            self._until = 0.0
+            stats, self._stats = self._stats, None
+            return stats, self._requests
+
+request_profiler = RequestProfiler()
+
+@app.before_request
+def start_request_profile():
+    if PROFILING and request.endpoint != 'admin_profile':
+        profile = request_profiler.begin_request()
+        if profile is not None:
+            g.profile = profile
+
+@app.teardown_request
+def stop_request_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.end_request(profile)
+
 # 创建数据库连接池
 class DatabaseConnectionPool:
-    def __init__(self, database_path, max_connections=5, timeout=10):
+    def __init__(self, database_path, max_connections=5, timeout=10, cache_size=16384, mmap_size=67108864):
         self.database_path = database_path
-        self.max_connections = max_connections
+        self.max_connections = max(1, max_connections)
         self.timeout = timeout
-        self.connections = []
-    
+        self.cache_size = cache_size  # 单位KiB
+        self.mmap_size = mmap_size    # 单位字节
+        # 空闲连接队列（后进先出，优先复用最近使用过、缓存较热的连接）
+        self.connections = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        # 连接池统计信息
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._exhausted = 0
+
+    def _create_connection(self):
+        # 设置check_same_thread=False以支持多线程环境，连接创建后只做一次PRAGMA初始化
+        # 开启性能分析或慢查询日志时使用ProfiledConnection统计每条语句的耗时
+        factory = ProfiledConnection if PROFILING or SLOW_QUERY_THRESHOLD else sqlite3.Connection
+        conn = sqlite3.connect(self.database_path, timeout=self.timeout, check_same_thread=False, factory=factory)
+        conn.execute('PRAGMA journal_mode=WAL')  # 读写互不阻塞
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL模式下兼顾安全与写入性能
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.create_function('ip_in_network', 2, sql_ip_in_network, deterministic=True)
+        return conn
+
     def get_connection(self):
-        # 为每个请求创建新连接，设置check_same_thread=False以支持多线程环境
-        return sqlite3.connect(self.database_path, timeout=self.timeout, check_same_thread=False)
-    
+        start = time.monotonic()
+        conn = None
+        try:
+            conn = self.connections.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.max_connections
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # 连接数已达上限，等待其他请求归还连接
+                try:
+                    conn = self.connections.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._exhausted += 1
+                    raise sqlite3.OperationalError(f"数据库连接池已耗尽（等待超过 {self.timeout} 秒）")
+                waited = time.monotonic() - start
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time_total += waited
+                    self._wait_time_max = max(self._wait_time_max, waited)
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+
     def return_connection(self, conn):
-        # 在Flask多线程环境中，我们简单关闭连接而不是重用
+        with self._lock:
+            self._in_use -= 1
         try:
-            conn.close()
-        except:
-            pass
-    
+            # 处理提前返回时未提交/未回滚的事务，避免把脏事务带给下一个请求
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # 连接已损坏，直接丢弃，后续按需重新创建
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        self.connections.put(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self.connections.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time_total, 6),
+                'wait_time_max': round(self._wait_time_max, 6),
+                'exhausted': self._exhausted
+            }
+
     def close_all(self):
         # 清理连接池
-        self.connections = []
+        while True:
+            try:
+                conn = self.connections.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+            with self._lock:
+                self._created -= 1
 
 # 初始化数据库连接池
-db_pool = DatabaseConnectionPool(DATABASE, max_connections=5)
+db_pool = DatabaseConnectionPool(
+    DATABASE,
+    max_connections=config['db_max_connections'],
+    timeout=config['db_timeout'],
+    cache_size=config['db_cache_size'],
+    mmap_size=config['db_mmap_size']
+)
 
 def get_db_connection():
     return db_pool.get_connection()
 
+def collect_pool_metrics():
+    stats = db_pool.stats()
+    return [
+        ('f2bsync_db_pool_connections', (('state', 'in_use'),), stats['in_use']),
+        ('f2bsync_db_pool_connections', (('state', 'idle'),), stats['idle']),
+        ('f2bsync_db_pool_max_connections', (), stats['max_connections']),
+        ('f2bsync_db_pool_checkouts_total', (), stats['checkouts']),
+        ('f2bsync_db_pool_waits_total', (), stats['waits']),
+        ('f2bsync_db_pool_wait_seconds_total', (), stats['wait_time_total']),
+        ('f2bsync_db_pool_exhausted_total', (), stats['exhausted'])
+    ]
+
+metrics.add_collector(collect_pool_metrics)
+
 def update_ip_status():
     max_retries = 5
     retry_delay = 1  # 秒
@@ -217,53 +1207,865 @@ def update_ip_status():
             cursor = conn.cursor()
 
             # 开始事务
-            conn.execute('BEGIN TRANSACTION')
+            conn.execute('BEGIN IMMEDIATE')
+            cache_since = ip_cache.begin_write(cursor)
 
-            # 将封禁时间已过的IP设置为'allowed'
-            cursor.execute('''
-                UPDATE ip_addresses
-                SET status = 'allowed', allowed_since = ?
-                WHERE status = 'blocked' AND blocked_until < ?
-            ''', (datetime.now(), datetime.now()))
+            with db_timer('sweep'):
+                # 将封禁时间已过的IP设置为'allowed'（放行时间从封禁到期时刻算起，与查询时计算的实际状态一致）
+                cursor.execute('''
+                    UPDATE ip_addresses
+                    SET status = 'allowed', allowed_since = blocked_until
+                    WHERE status = 'blocked' AND blocked_until < ?
+                ''', (datetime.now(),))
 
-            # 将允许时间已过的IP设置为'known'
-            cursor.execute('''
-                UPDATE ip_addresses
-                SET status = 'known', allowed_since = NULL
-                WHERE status = 'allowed' AND allowed_since < ?
-            ''', (datetime.now() - ALLOWED_DURATION,))
+                # 将允许时间已过的IP设置为'known'
+                cursor.execute('''
+                    UPDATE ip_addresses
+                    SET status = 'known', allowed_since = NULL
+                    WHERE status = 'allowed' AND allowed_since < ?
+                ''', (datetime.now() - ALLOWED_DURATION,))
 
-            # 删除已知时间已过的IP
-            cursor.execute('''
-                DELETE FROM ip_addresses
-                WHERE status = 'known'
-                AND (JULIANDAY('now') - JULIANDAY(blocked_until)) > ?
-            ''', (KNOWN_DURATION.days,))
+                # 删除已知时间已过的IP
+                known_expired_sql, known_expired_params = known_expired_filter_sql()
+                cursor.execute(f'''
+                    DELETE FROM ip_addresses
+                    WHERE status = 'known' AND {known_expired_sql}
+                ''', known_expired_params)
+
+                # 清除计数为0的统计行
+                cursor.execute('DELETE FROM ip_stats WHERE count = 0')
+
+                # 清理超过保留期的变更日志，并记录已清理的最大序号，早于该序号的游标需要全量同步
+                prune_change_log(cursor)
+            cache_changes = ip_cache.collect_write(cursor, cache_since)
 
             # 提交事务
-            conn.commit()
-            logger.debug(f"IP状态更新成功，影响的行: 封禁过期 -> allowed: {cursor.rowcount}")
+            with db_timer('commit'):
+                conn.commit()
+            publish_write(cache_changes)
+            logger.debug("IP状态更新成功，影响的行: 封禁过期 -> allowed: %s", cursor.rowcount)
             break
 
         except sqlite3.OperationalError as e:
             if conn:
                 conn.rollback()
             if "database is locked" in str(e) and attempt < max_retries - 1:
-                logger.warning(f"数据库已锁定，等待 {retry_delay} 秒（尝试 {attempt + 1}/{max_retries}）")
+                metrics.inc('f2bsync_db_lock_retries_total', (('operation', 'status_sweep'),))
+                logger.warning("数据库已锁定，等待 %s 秒（尝试 %s/%s）", retry_delay, attempt + 1, max_retries)
                 time.sleep(retry_delay)
                 retry_delay *= 2  # 指数退避
             else:
-                logger.error(f"更新IP状态时出错: {e}")
+                logger.error("更新IP状态时出错: %s", e)
                 raise
         except Exception as e:
             if conn:
                 conn.rollback()
-            logger.error(f"更新IP状态时出错: {e}")
+            logger.error("更新IP状态时出错: %s", e)
             raise
         finally:
             if conn:
                 db_pool.return_connection(conn)
 
+def prune_change_log(cursor):
+    cursor.execute('''
+        SELECT MAX(seq) FROM ip_changes WHERE changed_at < DATETIME('now', ?)
+    ''', (f'-{int(CHANGE_LOG_RETENTION.total_seconds())} seconds',))
+    floor = cursor.fetchone()[0]
+    if floor is not None:
+        cursor.execute('DELETE FROM ip_changes WHERE seq <= ?', (floor,))
+        cursor.execute('''
+            INSERT INTO sync_meta (key, value) VALUES ('change_log_floor', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (floor,))
+
+# 获取变更日志的当前游标（最后分配的序号，日志被清理后依然有效）
+def get_change_cursor(cursor):
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ip_changes'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def get_change_log_floor(cursor):
+    cursor.execute("SELECT value FROM sync_meta WHERE key = 'change_log_floor'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+# 读取游标之后每个IP的最新状态（/changes 和 /events 共用），返回 (变更列表, 新游标, 是否还有更多)
+def read_changes(cursor, since, current_cursor, limit):
+    # 同一IP只返回游标之后的最后一次变更（SQLite中MAX()聚合的其余列取自同一行）
+    with db_timer('group_by'):
+        cursor.execute('''
+            SELECT MAX(seq), ip_address, status, jail
+            FROM ip_changes
+            WHERE seq > ?
+            GROUP BY ip_address
+            ORDER BY 1
+            LIMIT ?
+        ''', (since, limit + 1))
+        rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{"ip_address": row[1], "status": row[2], "jail": row[3]} for row in rows]
+    return changes, rows[-1][0] if has_more else current_cursor, has_more
+
+# 生成 /changes 的响应数据
+def query_changes(conn, since, limit):
+    cursor = conn.cursor()
+    # 在同一读事务（快照）中读取游标和变更，保证两者一致
+    conn.execute('BEGIN')
+    try:
+        current_cursor = get_change_cursor(cursor)
+        # 未提供游标、游标早于已清理的日志或超出当前序号（数据库被重建）时，要求客户端全量同步
+        if since is None or since < get_change_log_floor(cursor) or since > current_cursor:
+            return {"reset": True, "cursor": current_cursor, "changes": [], "has_more": False}
+        changes, next_cursor, has_more = read_changes(cursor, since, current_cursor, limit)
+        return {"reset": False, "cursor": next_cursor, "changes": changes, "has_more": has_more}
+    finally:
+        conn.rollback()
+
+# 每个 /events 事件最多携带的IP变更数，更多的变更连续分多个事件发送
+EVENTS_BATCH_LIMIT = 10000
+
+# 读取 /events 订阅连接需要推送的变更，返回数据与 /changes 相同；since为None表示从当前游标开始订阅
+def poll_change_events(since):
+    conn = get_db_connection()
+    try:
+        if since is None:
+            return {"reset": False, "cursor": get_change_cursor(conn.cursor()), "changes": [], "has_more": False}
+        return query_changes(conn, since, EVENTS_BATCH_LIMIT)
+    finally:
+        db_pool.return_connection(conn)
+
+# 变更通知：本进程的写事务提交后唤醒asyncio模式服务器中等待的 /events 订阅连接；其他进程
+# （server.py的worker）的写入由订阅连接每隔 events_poll_interval 检查一次变更日志序号发现
+class ChangeNotifier:
+    def __init__(self):
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def notify(self):
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    # 注册通知回调（asyncio模式用于唤醒事件循环），回调在提交写事务的线程中执行
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.remove(callback)
+
+change_notifier = ChangeNotifier()
+
+# 后台状态清理线程：按固定间隔执行 blocked→allowed→known→删除 的状态迁移，
+# 请求处理路径上不再触发任何写操作
+class StatusSweeper(threading.Thread):
+    def __init__(self, interval, lock_path):
+        super().__init__(name='status-sweeper', daemon=True)
+        self.interval = max(1.0, interval.total_seconds())
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._stop_event = threading.Event()
+
+    def _acquire_leadership(self):
+        # 多worker部署时只有持有文件锁的进程执行清理；持锁进程退出后锁自动释放，由其他worker接替
+        if self._lock_file is not None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info("进程 %s 负责执行IP状态清理", os.getpid())
+        return True
+
+    def run(self):
+        logger.info("IP状态清理线程已启动，执行间隔: %s 秒", self.interval)
+        while not self._stop_event.is_set():
+            try:
+                if self._acquire_leadership():
+                    update_ip_status()
+                    logger.debug("数据库连接池状态: %s", db_pool.stats())
+                if ip_cache.enabled and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("内存缓存状态: %s", ip_cache.format_stats())
+            except Exception as e:
+                # 单次失败不影响后续执行，下一个周期会重新尝试
+                logger.error("IP状态清理线程执行失败: %s", e)
+            self._stop_event.wait(self.interval)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stop(self):
+        self._stop_event.set()
+
+status_sweeper = None
+
+def start_status_sweeper():
+    global status_sweeper
+    if status_sweeper is None or not status_sweeper.is_alive():
+        status_sweeper = StatusSweeper(STATUS_SWEEP_INTERVAL, f'{DATABASE}.sweeper.lock')
+        status_sweeper.start()
+    return status_sweeper
+
+def stop_status_sweeper(timeout=None):
+    if status_sweeper is not None:
+        status_sweeper.stop()
+        if timeout is not None and status_sweeper.is_alive():
+            status_sweeper.join(timeout)
+
+# 查询时计算IP的实际状态，保证两次清理之间的读取结果仍然正确
+def effective_status_sql(now):
+    allowed_cutoff = now - ALLOWED_DURATION
+    sql = '''
+        CASE
+            WHEN status = 'blocked' AND blocked_until < ? THEN 'known'
+            WHEN status = 'blocked' AND blocked_until < ? THEN 'allowed'
+            WHEN status = 'allowed' AND allowed_since < ? THEN 'known'
+            ELSE status
+        END
+    '''
+    return sql, (allowed_cutoff, now, allowed_cutoff)
+
+# 按实际状态过滤的WHERE条件，保持对status相关索引可用
+def status_filter_sql(status, now):
+    allowed_cutoff = now - ALLOWED_DURATION
+    if status == 'blocked':
+        return "(status = 'blocked' AND blocked_until >= ?)", (now,)
+    if status == 'allowed':
+        return ('''((status = 'allowed' AND allowed_since >= ?)
+                 OR (status = 'blocked' AND blocked_until < ? AND blocked_until >= ?))''',
+                (allowed_cutoff, now, allowed_cutoff))
+    if status == 'known':
+        # 已超过known保留时间、等待清理线程删除的记录不再返回
+        known_expired_sql, known_expired_params = known_expired_filter_sql()
+        return (f'''((status = 'known' AND NOT {known_expired_sql})
+                 OR (status = 'allowed' AND allowed_since < ?)
+                 OR (status = 'blocked' AND blocked_until < ?))''',
+                known_expired_params + (allowed_cutoff, allowed_cutoff))
+    return "status = ?", (status,)
+
+# known记录超过保留时间的条件（写成blocked_until上的区间，以便使用(status, blocked_until)索引）
+def known_expired_filter_sql():
+    return "blocked_until < DATETIME('now', ?)", (f'-{KNOWN_DURATION.days} days',)
+
+# 尚未被清理线程迁移的过期记录对各状态计数的修正：(增减, 条件, 参数)
+def stats_adjustments(status, now):
+    allowed_cutoff = now - ALLOWED_DURATION
+    if status == 'blocked':
+        return [(-1, "status = 'blocked' AND blocked_until < ?", (now,))]
+    if status == 'allowed':
+        return [(-1, "status = 'allowed' AND allowed_since < ?", (allowed_cutoff,)),
+                (1, "status = 'blocked' AND blocked_until < ? AND blocked_until >= ?", (now, allowed_cutoff))]
+    if status == 'known':
+        known_expired_sql, known_expired_params = known_expired_filter_sql()
+        return [(-1, f"status = 'known' AND {known_expired_sql}", known_expired_params),
+                (1, "status = 'allowed' AND allowed_since < ?", (allowed_cutoff,)),
+                (1, "status = 'blocked' AND blocked_until < ?", (allowed_cutoff,))]
+    return []
+
+# 从ip_stats读取某状态的总数和各jail数量，并修正自上次清理以来已过期的记录，
+# 结果与status_filter_sql()的过滤条件一致；修正查询只涉及少量过期记录，开销与表大小无关
+def get_status_counts(cursor, status, now):
+    with db_timer('count'):
+        cursor.execute('SELECT jail, count FROM ip_stats WHERE status = ?', (status,))
+        counts = dict(cursor.fetchall())
+        for sign, where, params in stats_adjustments(status, now):
+            cursor.execute(f"SELECT COALESCE(jail, ''), COUNT(*) FROM ip_addresses WHERE {where} GROUP BY 1", params)
+            for jail, count in cursor.fetchall():
+                counts[jail] = counts.get(jail, 0) + sign * count
+    jail_counts = {}
+    for jail, count in counts.items():
+        if count > 0:
+            jail_name = jail or 'unknown'
+            jail_counts[jail_name] = jail_counts.get(jail_name, 0) + count
+    return sum(jail_counts.values()), jail_counts
+
+# 根据ip_addresses重新生成计数表
+def rebuild_ip_stats(cursor):
+    cursor.execute('DELETE FROM ip_stats')
+    cursor.execute('''
+        INSERT INTO ip_stats (status, jail, count)
+        SELECT status, COALESCE(jail, ''), COUNT(*) FROM ip_addresses GROUP BY 1, 2
+    ''')
+
+# 检查计数表与实际数据是否一致，返回不一致的 {(status, jail): (计数表中的值, 实际值)}
+def check_ip_stats(cursor):
+    cursor.execute('SELECT status, jail, count FROM ip_stats WHERE count != 0')
+    stored = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    cursor.execute("SELECT status, COALESCE(jail, ''), COUNT(*) FROM ip_addresses GROUP BY 1, 2")
+    actual = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    return {key: (stored.get(key, 0), actual.get(key, 0))
+            for key in stored.keys() | actual.keys()
+            if stored.get(key, 0) != actual.get(key, 0)}
+
+# 命令行：检查（并可选重建）计数表，一致时返回0
+def run_stats_check(rebuild=False):
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        conn.execute('BEGIN IMMEDIATE')
+        mismatches = check_ip_stats(cursor)
+        if not mismatches:
+            logger.info("ip_stats 计数表与ip_addresses一致")
+            conn.rollback()
+            return 0
+        for (status, jail), (stored, actual) in sorted(mismatches.items()):
+            logger.warning("ip_stats 计数不一致: status=%s, jail=%s, 计数表=%s, 实际=%s",
+                           status, jail or 'unknown', stored, actual)
+        if not rebuild:
+            conn.rollback()
+            logger.warning("共 %s 处不一致，可使用 --rebuild 重建计数表", len(mismatches))
+            return 1
+        rebuild_ip_stats(cursor)
+        conn.commit()
+        logger.info("已重建 ip_stats 计数表，修正 %s 处不一致", len(mismatches))
+        return 0
+    finally:
+        if conn:
+            db_pool.return_connection(conn)
+
+# 前缀搜索转换为ip_address上的区间条件，可以使用(status, ip_address)索引
+def ip_prefix_range_sql(prefix):
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return "(ip_address >= ? AND ip_address < ?)", (prefix, upper)
+
+# SQL函数ip_in_network(ip_address, 网段)：IPv6 CIDR搜索中无法用前缀区间精确表达的部分逐行判断
+@functools.lru_cache(maxsize=64)
+def _parse_search_network(network):
+    return ipaddress.ip_network(network)
+
+def sql_ip_in_network(ip, network):
+    try:
+        return ipaddress.ip_address(ip) in _parse_search_network(network)
+    except (TypeError, ValueError):
+        return False
+
+# IPv6 CIDR：规范写法中网段完整覆盖的各组（16位）原样出现在开头，据此得到可走索引的前缀区间；
+# 固定部分中值为0的组可能被"::"压缩，前缀只取到第一个0组之前，网段不按组对齐或前缀不完整时再用ip_in_network()精确判断
+def ipv6_search_sql(network):
+    if network.prefixlen == 128:
+        return "ip_address = ?", (str(network.network_address),)
+    prefix = ''
+    exact = network.prefixlen % 16 == 0
+    for group in network.network_address.exploded.split(':')[:network.prefixlen // 16]:
+        if int(group, 16) == 0:
+            exact = False
+            break
+        prefix += f'{int(group, 16):x}:'
+    if exact:
+        return ip_prefix_range_sql(prefix)
+    if not prefix:
+        return "ip_in_network(ip_address, ?)", (str(network),)
+    clause, params = ip_prefix_range_sql(prefix)
+    return f"({clause} AND ip_in_network(ip_address, ?))", params + (str(network),)
+
+# 将搜索词转换为可走索引的WHERE条件：普通搜索词按前缀匹配，IPv4 CIDR展开为若干前缀区间，
+# IPv6 CIDR见ipv6_search_sql()；搜索词无效时抛出ValueError
+def ip_search_sql(search_ip):
+    if not search_ip:
+        return None, ()
+    if '/' not in search_ip:
+        return ip_prefix_range_sql(search_ip)
+
+    network = ipaddress.ip_network(search_ip, strict=False)
+    if network.prefixlen == 0:
+        return None, ()
+    if network.version == 6:
+        return ipv6_search_sql(network)
+    if network.prefixlen == 32:
+        return "ip_address = ?", (str(network.network_address),)
+
+    octets = str(network.network_address).split('.')
+    full_octets, remainder = divmod(network.prefixlen, 8)
+    if remainder == 0:
+        return ip_prefix_range_sql('.'.join(octets[:full_octets]) + '.')
+    if full_octets == 3:
+        # 网段只覆盖最后一个字节的一部分（最多128个地址），直接按地址列表匹配
+        addresses = tuple(str(address) for address in network)
+        return f"ip_address IN ({', '.join('?' * len(addresses))})", addresses
+
+    # 网段覆盖某个字节的一部分：按该字节的每个取值展开为带"."结尾的前缀区间
+    base = ''.join(octet + '.' for octet in octets[:full_octets])
+    first = int(octets[full_octets])
+    clauses = []
+    params = ()
+    for value in range(first, first + (1 << (8 - remainder))):
+        clause, clause_params = ip_prefix_range_sql(f'{base}{value}.')
+        clauses.append(clause)
+        params += clause_params
+    return f"({' OR '.join(clauses)})", params
+
+# 组合状态、搜索和jail条件（jails为空表示不限jail）
+def ip_list_filter_sql(status, now, search_ip, jails=()):
+    where, params = status_filter_sql(status, now)
+    search_where, search_params = ip_search_sql(search_ip)
+    if search_where:
+        where = f"{where} AND {search_where}"
+        params += search_params
+    if jails:
+        where = f"{where} AND jail IN ({', '.join('?' * len(jails))})"
+        params += tuple(jails)
+    return where, params
+
+# 解析page=和per_page=参数（Flask接口和asyncio接口共用），返回(页码, 每页数量)；参数不是整数时抛出ValueError
+def parse_page_args(page_param, per_page_param):
+    page = int(page_param) if page_param else 1
+    per_page = min(max(int(per_page_param), 1), 1000)
+    return page, per_page
+
+# 解析jail=参数：可以重复出现，也可以用逗号分隔多个jail，返回排序去重后的元组
+def parse_jail_args(values):
+    return tuple(sorted({jail.strip() for value in values for jail in value.split(',') if jail.strip()}))
+
+# 将每个jail中密集的地址合并为网段：按前缀从短到长依次检查，同一网段内的IP数达到阈值时
+# 以该网段（如 203.0.113.0/24）代替其中的全部IP；无法解析为IP地址的记录原样保留
+def aggregate_ip_groups(groups):
+    result = {}
+    for jail, ips in groups.items():
+        entries, v4, v6 = [], [], []
+        for ip in ips:
+            try:
+                addr = ipaddress.ip_address(ip)
+            except ValueError:
+                entries.append(ip)
+                continue
+            (v4 if addr.version == 4 else v6).append((int(addr), ip))
+        for members, rules, network_class, bits in ((v4, AGGREGATE_IPV4, ipaddress.IPv4Network, 32),
+                                                    (v6, AGGREGATE_IPV6, ipaddress.IPv6Network, 128)):
+            for prefixlen, threshold in rules:
+                shift = bits - prefixlen
+                buckets = {}
+                for member in members:
+                    buckets.setdefault(member[0] >> shift, []).append(member)
+                members = []
+                for key, bucket in buckets.items():
+                    if len(bucket) >= threshold:
+                        entries.append(str(network_class((key << shift, prefixlen))))
+                    else:
+                        members.extend(bucket)
+            entries.extend(ip for _, ip in members)
+        result[jail] = entries
+    return result
+
+# 按jail分组的精简列表，只包含IP地址：{"jails": {jail: [ip, ...]}, "total_items": 总数, "search_ip": 搜索条件}，
+# aggregate为True时密集的地址合并为网段
+def jail_group_payload(pairs, search_ip='', aggregate=False):
+    jails = {}
+    for jail, ip in pairs:
+        jails.setdefault(jail or 'unknown', []).append(ip)
+    if aggregate:
+        jails = aggregate_ip_groups(jails)
+    return {"jails": jails, "total_items": sum(len(ips) for ips in jails.values()), "search_ip": search_ip}
+
+# 二进制IP列表格式（Accept: application/x-ip-list），按jail分组：
+#   b'F2BL' 版本(1字节) varint(jail数)
+#   每个jail：varint(名称长度) 名称(UTF-8)
+#             varint(IPv4数量) 升序排列的IPv4整数，每个记录与前一个的差值(varint)
+#             varint(IPv6数量) 同上，IPv6整数
+#             varint(其他数量) 不是规范IP写法的记录，每个为varint(长度)+UTF-8原文
+# 排序后的差值通常只需2~3字节，比JSON字符串列表（包括gzip压缩后）更小
+IP_LIST_MIMETYPE = 'application/x-ip-list'
+IP_LIST_MAGIC = b'F2BL\x01'
+
+def _put_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+# 将{jail: [ip, ...]}编码为二进制IP列表
+def pack_ip_list(groups):
+    out = bytearray(IP_LIST_MAGIC)
+    _put_varint(out, len(groups))
+    for jail, ips in groups.items():
+        v4, v6, other = [], [], []
+        for ip in ips:
+            family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+            try:
+                packed = socket.inet_pton(family, ip)
+            except (OSError, ValueError):
+                packed = None
+            # 只编码规范写法的地址，保证解码后得到的文本与原文相同
+            if packed is not None and socket.inet_ntop(family, packed) == ip:
+                (v6 if family == socket.AF_INET6 else v4).append(int.from_bytes(packed, 'big'))
+            else:
+                other.append(ip)
+        name = jail.encode('utf-8')
+        _put_varint(out, len(name))
+        out += name
+        for values in (v4, v6):
+            values.sort()
+            _put_varint(out, len(values))
+            prev = 0
+            for value in values:
+                _put_varint(out, value - prev)
+                prev = value
+        _put_varint(out, len(other))
+        for ip in other:
+            raw = ip.encode('utf-8')
+            _put_varint(out, len(raw))
+            out += raw
+    return bytes(out)
+
+# 按ip_address排序的键集分页查询：after为上一页最后一个IP，返回(本页记录, 下一页的after或None)
+def fetch_ip_page(cursor, where, params, per_page, after=None, offset=0):
+    if after:
+        where = f"{where} AND ip_address > ?"
+        params += (after,)
+    with db_timer('lookup'):
+        cursor.execute(f'SELECT * FROM ip_addresses WHERE {where} ORDER BY ip_address LIMIT ? OFFSET ?',
+                       params + (per_page + 1, 0 if after else offset))
+        rows = cursor.fetchall()
+    if len(rows) > per_page:
+        return rows[:per_page], rows[per_page - 1][1]
+    return rows, None
+
+# 按jail统计匹配的IP数量，总数由各jail数量相加得到，只需一次聚合查询
+def count_ips_by_jail(cursor, where, params):
+    with db_timer('group_by'):
+        cursor.execute(f'SELECT jail, COUNT(*) FROM ip_addresses WHERE {where} GROUP BY jail', params)
+        rows = cursor.fetchall()
+    jail_counts = {}
+    for jail, count in rows:
+        jail_name = jail or 'unknown'
+        jail_counts[jail_name] = jail_counts.get(jail_name, 0) + count
+    return sum(jail_counts.values()), jail_counts
+
+# 内存缓存中比较时间使用的键：(当前时间, allowed到期界限, known到期界限)，
+# 与SQL中的比较方式一致，直接和数据库中保存的时间字符串比较
+def cache_time_keys(now):
+    allowed_cutoff = now - ALLOWED_DURATION
+    # known_expired_filter_sql()使用SQLite的DATETIME('now')，即UTC时间
+    known_cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=KNOWN_DURATION.days)
+    return now.isoformat(' '), allowed_cutoff.isoformat(' '), known_cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+# 按查询时刻计算记录所在的列表（与status_filter_sql()一致）及其离开该列表的时间，
+# 不出现在任何列表中的记录返回(None, None)
+def cache_row_status(row, time_keys):
+    now_key, allowed_key, known_key = time_keys
+    status, blocked_until, allowed_since = row[3], row[5], row[6]
+    if status == 'blocked' and blocked_until is not None:
+        if blocked_until >= now_key:
+            return 'blocked', blocked_until
+        if blocked_until >= allowed_key:
+            return 'allowed', blocked_until
+        return 'known', None
+    if status == 'allowed' and allowed_since is not None:
+        if allowed_since >= allowed_key:
+            return 'allowed', allowed_since
+        return 'known', None
+    if status == 'known' and blocked_until is not None and blocked_until >= known_key:
+        return 'known', blocked_until
+    return None, None
+
+# 到期后记录进入的下一个列表
+NEXT_LIST_STATUS = {'blocked': 'allowed', 'allowed': 'known', 'known': None}
+
+# 某个状态的IP列表快照（按ip_address排序），在数据变化或有记录到期之前一直有效
+class IPListSnapshot:
+    def __init__(self, status, rows, version, limits):
+        self.status = status
+        self.rows = rows
+        self.ips = [row[1] for row in rows]
+        self.version = version
+        # 与cache_time_keys()对应的三个时间上限，任一时间键超过上限时有记录到期，快照失效
+        self.limits = limits
+        self.jail_counts = {}
+        for row in rows:
+            jail_name = row[8] or 'unknown'
+            self.jail_counts[jail_name] = self.jail_counts.get(jail_name, 0) + 1
+
+    @property
+    def total(self):
+        return len(self.rows)
+
+    def is_current(self, version, time_keys):
+        return version == self.version and all(
+            limit is None or key <= limit for key, limit in zip(time_keys, self.limits))
+
+    # 与fetch_ip_page()相同的分页方式
+    def page(self, per_page, after=None, offset=0):
+        start = bisect.bisect_right(self.ips, after) if after else max(0, offset)
+        rows = self.rows[start:start + per_page + 1]
+        if len(rows) > per_page:
+            return rows[:per_page], rows[per_page - 1][1]
+        return rows, None
+
+# 预先序列化并gzip压缩的完整列表响应（/get_ips等接口不分页、不搜索时直接返回），
+# jails为None表示全部jail；fmt为'json'、'ndjson'、'jails'（按jail分组的精简列表）或'binary'（二进制IP列表），
+# 后两种格式可以合并网段（aggregate）
+class CachedListBody:
+    def __init__(self, snapshot, jails, fmt, aggregate=False):
+        self.snapshot = snapshot
+        if jails is None:
+            rows, jail_counts = snapshot.rows, dict(snapshot.jail_counts)
+        else:
+            wanted = set(jails)
+            rows = [row for row in snapshot.rows if row[8] in wanted]
+            jail_counts = {}
+            for row in rows:
+                jail_counts[row[8]] = jail_counts.get(row[8], 0) + 1
+        # 供log_ip_list_request()记录日志
+        self.summary = {"total_items": len(rows), "search_ip": '', "jail_counts": jail_counts}
+        with request_phase('serialize'):
+            if fmt == 'ndjson':
+                self.mimetype = 'application/x-ndjson'
+                lines = [json.dumps(row_to_ip_info(row, snapshot.status), ensure_ascii=False) for row in rows]
+                lines.append(json.dumps({"end": True, "total_items": len(rows), "search_ip": ''}))
+                self.body = ('\n'.join(lines) + '\n').encode('utf-8')
+            elif fmt == 'jails':
+                self.mimetype = 'application/json'
+                payload = jail_group_payload(((row[8], row[1]) for row in rows), aggregate=aggregate)
+                self.body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            elif fmt == 'binary':
+                self.mimetype = IP_LIST_MIMETYPE
+                self.body = pack_ip_list(jail_group_payload(((row[8], row[1]) for row in rows), aggregate=aggregate)['jails'])
+            else:
+                self.mimetype = 'application/json'
+                payload = dict(self.summary, items=[row_to_ip_info(row, snapshot.status) for row in rows])
+                self.body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = None
+        if len(self.body) >= app.config['COMPRESS_MIN_SIZE']:
+            with request_phase('compress'):
+                self.gzip_body = gzip.compress(self.body, compresslevel=app.config['COMPRESS_LEVEL'])
+
+# 内存中的IP状态缓存：启动时从数据库加载全部IP记录，本进程的写操作提交后直接更新（write-through），
+# 其他进程（gunicorn的其他worker、asyncio服务器）的写入在读取前通过ip_changes变更日志增量同步；
+# 列表状态与effective_status_sql()一样在读取时按时间计算，记录到期不需要写操作即可反映在列表中
+class IPStateCache:
+    # 变更的IP超过该数量时直接重新加载全部记录
+    MAX_INCREMENTAL_CHANGES = 50000
+    # 每个进程最多保留的预生成响应数（按状态、jail组合、格式区分），超过时丢弃最久未使用的
+    MAX_CACHED_BODIES = 16
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.rows = {}            # IP -> 完整记录（列顺序与SELECT * FROM ip_addresses相同）
+        self.change_seq = None    # 已同步到的变更日志序号，None表示尚未加载
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._body_lock = threading.Lock()
+        self._versions = {'blocked': 0, 'allowed': 0, 'known': 0}
+        self._snapshots = {}
+        self._bodies = {}         # (状态, jail元组, 格式, 是否合并网段) -> CachedListBody
+        # 统计信息
+        self.loads = 0
+        self.refreshes = 0
+        self.snapshot_builds = 0
+        self.body_hits = 0
+        self.body_misses = 0
+
+    def _bump(self, status):
+        # 列表内容变化时，下一个列表的快照依赖该列表中记录的到期时间，也需要重建
+        if status:
+            self._versions[status] += 1
+            next_status = NEXT_LIST_STATUS[status]
+            if next_status:
+                self._versions[next_status] += 1
+
+    def _apply_rows(self, changed, now):
+        time_keys = cache_time_keys(now)
+        for ip, row in changed.items():
+            old_row = self.rows.get(ip)
+            if old_row is not None:
+                self._bump(cache_row_status(old_row, time_keys)[0])
+            if row is None:
+                self.rows.pop(ip, None)
+            else:
+                self.rows[ip] = row
+                self._bump(cache_row_status(row, time_keys)[0])
+
+    # 读取变更日志中(since, until]区间内变化过的IP的当前记录，已删除的IP对应None
+    def _read_changed_rows(self, cursor, since, until):
+        with db_timer('lookup'):
+            cursor.execute('SELECT DISTINCT ip_address FROM ip_changes WHERE seq > ? AND seq <= ?', (since, until))
+            ips = [row[0] for row in cursor.fetchall()]
+            changed = dict.fromkeys(ips)
+            for start in range(0, len(ips), 500):
+                chunk = ips[start:start + 500]
+                cursor.execute(f"SELECT * FROM ip_addresses WHERE ip_address IN ({', '.join('?' * len(chunk))})", chunk)
+                for row in cursor.fetchall():
+                    changed[row[1]] = row
+        return changed
+
+    def _load_rows(self, cursor, seq):
+        with db_timer('lookup'):
+            cursor.execute('SELECT * FROM ip_addresses')
+            rows = {row[1]: row for row in cursor}
+        with self._lock:
+            self.rows = rows
+            self.change_seq = seq
+            for status in self._versions:
+                self._versions[status] += 1
+        self.loads += 1
+
+    # 从数据库加载全部记录（启动时调用）
+    def load(self):
+        if not self.enabled:
+            return
+        conn = None
+        try:
+            conn = get_db_connection()
+            with self._refresh_lock:
+                conn.execute('BEGIN')
+                self._load_rows(conn.cursor(), get_change_cursor(conn.cursor()))
+                conn.rollback()
+            logger.info("已加载 %s 个IP到内存缓存", len(self.rows))
+        finally:
+            if conn:
+                db_pool.return_connection(conn)
+
+    # 读取前与数据库同步：变更日志序号未变化时只需一次查询
+    def refresh(self, conn):
+        with self._refresh_lock:
+            since = self.change_seq
+            cursor = conn.cursor()
+            conn.execute('BEGIN')
+            try:
+                seq = get_change_cursor(cursor)
+                if seq == since:
+                    return
+                if since is None or seq < since or since < get_change_log_floor(cursor) \
+                        or seq - since > self.MAX_INCREMENTAL_CHANGES:
+                    # 首次加载、数据库被重建或变更日志已被清理：重新加载全部记录
+                    self._load_rows(cursor, seq)
+                    logger.info("内存缓存已重新加载，共 %s 个IP", len(self.rows))
+                    return
+                changed = self._read_changed_rows(cursor, since, seq)
+            finally:
+                conn.rollback()
+            with self._lock:
+                # 期间本进程的写操作已推进了序号时放弃本次结果，下次读取时再同步
+                if self.change_seq == since:
+                    self._apply_rows(changed, datetime.now())
+                    self.change_seq = seq
+            self.refreshes += 1
+
+    # 写事务开始后调用，返回当前的变更日志序号
+    def begin_write(self, cursor):
+        return get_change_cursor(cursor) if self.enabled else None
+
+    # 提交前调用，读取本事务修改过的记录
+    def collect_write(self, cursor, since):
+        if since is None:
+            return None
+        until = get_change_cursor(cursor)
+        if until == since:
+            return None
+        return since, until, self._read_changed_rows(cursor, since, until)
+
+    # 提交后调用，把本事务修改过的记录写入缓存
+    def apply_write(self, changes):
+        if not changes:
+            return
+        since, until, changed = changes
+        with self._lock:
+            # 缓存尚未加载，或已通过变更日志同步到本事务之后
+            if self.change_seq is None or self.change_seq > since:
+                return
+            self._apply_rows(changed, datetime.now())
+            # 缓存与本事务开始时一致才推进序号，否则其他进程的写入留待下次读取时同步
+            if self.change_seq == since:
+                self.change_seq = until
+
+    def _rebuild_snapshots(self, time_keys):
+        lists = {status: [] for status in self._versions}
+        expires = dict.fromkeys(self._versions)
+        for row in self.rows.values():
+            status, expire = cache_row_status(row, time_keys)
+            if status is None:
+                continue
+            lists[status].append(row)
+            if expire is not None and (expires[status] is None or expire < expires[status]):
+                expires[status] = expire
+        # blocked记录到期后进入allowed，allowed记录到期后进入known
+        limits = {
+            'blocked': (expires['blocked'], None, None),
+            'allowed': (expires['blocked'], expires['allowed'], None),
+            'known': (None, expires['allowed'], expires['known'])
+        }
+        for status, rows in lists.items():
+            snapshot = self._snapshots.get(status)
+            if snapshot is not None and snapshot.is_current(self._versions[status], time_keys):
+                continue
+            rows.sort(key=lambda row: row[1])
+            self._snapshots[status] = IPListSnapshot(status, rows, self._versions[status], limits[status])
+        self.snapshot_builds += 1
+
+    # 返回某状态的当前列表快照
+    def snapshot(self, conn, status, now):
+        self.refresh(conn)
+        time_keys = cache_time_keys(now)
+        with self._lock:
+            snapshot = self._snapshots.get(status)
+            if snapshot is None or not snapshot.is_current(self._versions[status], time_keys):
+                self._rebuild_snapshots(time_keys)
+                snapshot = self._snapshots[status]
+            return snapshot
+
+    # 返回某状态（及jail元组，None表示全部）的完整列表响应，fmt见CachedListBody
+    def body(self, conn, status, now, jails=None, fmt='json', aggregate=False):
+        snapshot = self.snapshot(conn, status, now)
+        key = (status, jails, fmt, aggregate)
+        with self._body_lock:
+            entry = self._bodies.get(key)
+            if entry is not None and entry.snapshot is snapshot:
+                self.body_hits += 1
+                self._bodies[key] = self._bodies.pop(key)
+                return entry
+            self.body_misses += 1
+            # 客户端请求的jail组合各不相同，丢弃基于旧快照生成的响应，避免过期内容累积
+            self._bodies = {k: e for k, e in self._bodies.items() if e.snapshot is self._snapshots.get(k[0])}
+            entry = CachedListBody(snapshot, jails, fmt, aggregate)
+            self._bodies[key] = entry
+            while len(self._bodies) > self.MAX_CACHED_BODIES:
+                del self._bodies[next(iter(self._bodies))]
+            return entry
+
+    def stats(self):
+        with self._lock:
+            rows = list(self.rows.values())
+            snapshots = list(self._snapshots.values())
+            row_bytes = sys.getsizeof(self.rows)
+        row_bytes += sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+        snapshot_bytes = sum(sys.getsizeof(snapshot.rows) + sys.getsizeof(snapshot.ips) for snapshot in snapshots)
+        with self._body_lock:
+            bodies = list(self._bodies.values())
+        return {
+            'enabled': self.enabled,
+            'ips': len(rows),
+            'change_seq': self.change_seq,
+            'row_bytes': row_bytes,
+            'snapshot_bytes': snapshot_bytes,
+            'bodies': len(bodies),
+            'body_bytes': sum(len(entry.body) + len(entry.gzip_body or b'') for entry in bodies),
+            'loads': self.loads,
+            'refreshes': self.refreshes,
+            'snapshot_builds': self.snapshot_builds,
+            'body_hits': self.body_hits,
+            'body_misses': self.body_misses
+        }
+
+    def format_stats(self):
+        stats = self.stats()
+        return (f"{stats['ips']} 个IP 约 {stats['row_bytes'] / 1048576:.1f} MB，"
+                f"列表快照 {stats['snapshot_bytes'] / 1048576:.1f} MB，"
+                f"{stats['bodies']} 个预生成响应 {stats['body_bytes'] / 1048576:.1f} MB，"
+                f"响应命中/生成: {stats['body_hits']}/{stats['body_misses']}")
+
+ip_cache = IPStateCache(config['ip_cache'])
+
+# 写事务提交后调用：把本事务的修改写入内存缓存，并通知 /events 订阅连接
+def publish_write(cache_changes):
+    ip_cache.apply_write(cache_changes)
+    change_notifier.notify()
+
 def calculate_block_duration(block_count):
     if not INCREMENT_BLOCK:
         return BLOCK_DURATION
@@ -276,6 +2078,21 @@ def calculate_block_duration(block_count):
         return MAX_BLOCK_DURATION
     return duration
 
+# 预先计算各封禁计数对应的封禁截止时间，供批量写入的SQL直接查表使用
+def build_block_until_table(now):
+    rows = []
+    block_count = 1
+    duration = calculate_block_duration(block_count)
+    while block_count < 64:
+        rows.append((block_count, now + duration))
+        next_duration = calculate_block_duration(block_count + 1)
+        if next_duration == duration:
+            # 已达到上限（或未启用递增），更大的计数沿用同一时长
+            break
+        block_count += 1
+        duration = next_duration
+    return rows, now + duration
+
 
 # Token-Authentifizierung
 auth = HTTPTokenAuth(scheme='Bearer')
@@ -307,11 +2124,137 @@ def verify_token(token):
         return TOKENS[token]
     return None
 
+# 在调用方已开启的写事务中封禁一批IP，返回实际新封禁的IP列表
+def apply_add_ips(cursor, ips, description, jail, reported_by, client_name, client_ip, now):
+    request = {'ips': ips, 'description': description, 'jail': jail, 'reported_by': reported_by,
+               'client_name': client_name, 'client_ip': client_ip}
+    return apply_add_ip_requests(cursor, [request], now)[0]
+
+# 合并执行多个封禁请求（来自同一批次的多个客户端）：所有IP写入同一个临时表后用一条UPSERT完成，
+# 同一IP被多个请求同时上报时只产生一次状态变化（封禁计数只递增一次），归属于最先到达的请求；
+# 返回与requests一一对应的新封禁IP列表
+def apply_add_ip_requests(cursor, requests, now):
+    added_ips = [[] for _ in requests]
+    status_sql, status_params = effective_status_sql(now)
+    block_until_rows, max_block_until = build_block_until_table(now)
+
+    # 将本批IP写入临时表（重复IP只保留第一次出现的位置）
+    with db_timer('lookup'):
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS add_ips_batch (
+                ip_address TEXT PRIMARY KEY, seq INTEGER, request INTEGER,
+                description TEXT, reported_by TEXT, jail TEXT
+            )
+        ''')
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS block_until_table (block_count INTEGER PRIMARY KEY, blocked_until TIMESTAMP)')
+        cursor.execute('DELETE FROM add_ips_batch')
+        cursor.execute('DELETE FROM block_until_table')
+        cursor.executemany('''
+            INSERT OR IGNORE INTO add_ips_batch (ip_address, seq, request, description, reported_by, jail)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', ((ip, seq, index, request['description'], request['reported_by'], request['jail'])
+              for seq, (index, request, ip) in enumerate(
+                  (index, request, ip) for index, request in enumerate(requests) for ip in request['ips'])))
+        cursor.executemany('INSERT INTO block_until_table (block_count, blocked_until) VALUES (?, ?)', block_until_rows)
+
+        # 一次查询取得整批IP的实际状态、封禁计数和当前jail
+        cursor.execute(f'''
+            SELECT b.ip_address, {status_sql}, a.block_count, a.jail, b.request
+            FROM add_ips_batch b LEFT JOIN ip_addresses a ON a.ip_address = b.ip_address
+            ORDER BY b.seq
+        ''', status_params)
+        batch_rows = cursor.fetchall()
+
+    # 新IP插入，known状态的IP递增封禁计数后重新封禁，blocked/allowed状态保持不变
+    with db_timer('upsert'):
+        cursor.execute(f'''
+            INSERT INTO ip_addresses
+            (ip_address, description, status, reported_by, blocked_until, block_count, jail)
+            SELECT ip_address, description, 'blocked', reported_by,
+                   COALESCE((SELECT blocked_until FROM block_until_table WHERE block_count = 1), ?), 1, jail
+            FROM add_ips_batch WHERE true
+            ON CONFLICT(ip_address) DO UPDATE SET
+                status = 'blocked',
+                blocked_until = COALESCE(
+                    (SELECT t.blocked_until FROM block_until_table t
+                     WHERE t.block_count = ip_addresses.block_count + 1), ?),
+                reported_by = excluded.reported_by,
+                block_count = ip_addresses.block_count + 1,
+                allowed_since = NULL,
+                jail = excluded.jail
+            WHERE {status_sql} = 'known'
+        ''', (max_block_until, max_block_until) + status_params)
+
+    # IP处理后的状态及其归属的请求；每个请求按结果计数后输出一条汇总，逐IP明细只在DEBUG级别输出
+    final_status = {}
+    counts = [{'new': 0, 'reblocked': 0, 'allowed': 0, 'blocked': 0} for _ in requests]
+    detail = logger.isEnabledFor(logging.DEBUG)
+    for ip, current_status, block_count, current_jail, index in batch_rows:
+        request = requests[index]
+        if current_status == 'allowed':
+            final_status[ip] = (index, 'allowed', current_jail)
+            counts[index]['allowed'] += 1
+            if detail:
+                logger.debug("客户端 %s (%s) 请求封禁IP %s，但当前为allowed状态 - 被忽略",
+                             request['client_name'], request['client_ip'], ip, extra=LOG_SAMPLED)
+        elif current_status == 'known':
+            added_ips[index].append(ip)
+            final_status[ip] = (index, 'blocked', request['jail'])
+            counts[index]['reblocked'] += 1
+            if detail:
+                logger.debug("客户端 %s (%s) 已封禁IP %s (jail: %s, 封禁计数: %d, 封禁时间: %s, 报告来源: %s)",
+                             request['client_name'], request['client_ip'], ip, request['jail'], block_count + 1,
+                             calculate_block_duration(block_count + 1), request['reported_by'], extra=LOG_SAMPLED)
+        elif current_status != 'blocked':
+            added_ips[index].append(ip)
+            final_status[ip] = (index, 'blocked', request['jail'])
+            counts[index]['new'] += 1
+            if detail:
+                logger.debug("客户端 %s (%s) 已封禁IP %s (jail: %s, 封禁时间: %s, 报告来源: %s)",
+                             request['client_name'], request['client_ip'], ip, request['jail'],
+                             calculate_block_duration(0), request['reported_by'], extra=LOG_SAMPLED)
+        else:
+            final_status[ip] = (index, 'blocked', current_jail)
+            counts[index]['blocked'] += 1
+            if detail:
+                logger.debug("客户端 %s (%s) (jail: %s) 请求封禁IP %s，但当前状态为jail: %s -- blocked - 被忽略",
+                             request['client_name'], request['client_ip'], request['jail'], ip, current_jail,
+                             extra=LOG_SAMPLED)
+
+    # 同批次中已由更早的请求处理的IP，按处理后的状态记录为被忽略
+    if len(requests) > 1:
+        for index, request in enumerate(requests):
+            for ip in dict.fromkeys(request['ips']):
+                owner, status_after, jail_after = final_status[ip]
+                if owner == index:
+                    continue
+                counts[index][status_after] += 1
+                if not detail:
+                    continue
+                if status_after == 'allowed':
+                    logger.debug("客户端 %s (%s) 请求封禁IP %s，但当前为allowed状态 - 被忽略",
+                                 request['client_name'], request['client_ip'], ip, extra=LOG_SAMPLED)
+                else:
+                    logger.debug("客户端 %s (%s) (jail: %s) 请求封禁IP %s，但当前状态为jail: %s -- blocked - 被忽略",
+                                 request['client_name'], request['client_ip'], request['jail'], ip, jail_after,
+                                 extra=LOG_SAMPLED)
+
+    for request, count in zip(requests, counts):
+        logger.info("客户端 %s (%s) 上报 %d 个IP (jail: %s, 报告来源: %s)：新封禁 %d 个，重新封禁 %d 个，"
+                    "allowed状态被忽略 %d 个，已处于封禁状态 %d 个",
+                    request['client_name'], request['client_ip'], len(request['ips']), request['jail'],
+                    request['reported_by'], count['new'], count['reblocked'], count['allowed'], count['blocked'],
+                    extra=LOG_SAMPLED)
+    return added_ips
+
+# /add_ips的批量大小和新封禁IP数（Flask接口和asyncio接口共用）
+def record_add_ips_metrics(ips, added_ips):
+    metrics.observe('f2bsync_add_ips_batch_size', len(ips))
+    metrics.inc('f2bsync_ips_banned_total', value=len(added_ips))
+
 @app.route('/add_ips', methods=['POST'])
 @auth.login_required
 def add_ips():
-    update_ip_status()
-    
     # 获取真实客户端IP和认证后的客户端名称
     client_ip = get_client_ip()
     client_name = auth.current_user()
@@ -331,11 +2274,14 @@ def add_ips():
             import json
             data = json.loads(decompressed_data.decode('utf-8'))
         except Exception as e:
-            logger.error(f"解压gzip数据失败: {e}")
+            logger.error("解压gzip数据失败: %s", e)
             return jsonify({"error": "无效的压缩数据"}), 400
     else:
         # 标准JSON请求
         data = request.json
+    if not isinstance(data, dict):
+        logger.warning("客户端 %s (%s) 请求添加IP，但请求体不是JSON对象", client_name, client_ip)
+        return jsonify({"error": "请求体必须是JSON对象"}), 400
     ips = data.get('ips', [])
     description = data.get('description', '')
     status = data.get('status', 'blocked')
@@ -343,302 +2289,607 @@ def add_ips():
     reported_by = f"{client_name}@{client_ip}"
 
     if not ips:
-        logger.warning(f"客户端 {client_name} ({client_ip}) 请求添加IP但未提供IP列表")
+        logger.warning("客户端 %s (%s) 请求添加IP但未提供IP列表", client_name, client_ip)
         return jsonify({"error": "需要IP地址列表"}), 400
 
     conn = None
-    added_ips = []
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        conn.execute('BEGIN TRANSACTION')
-
-        # 批量处理IP，减少数据库操作次数
-        for ip in ips:
-            # 一次性查询状态、封禁计数和当前jail
-            cursor.execute('''
-                SELECT status, block_count, jail FROM ip_addresses WHERE ip_address = ?
-            ''', (ip,))
-            result = cursor.fetchone()
-            current_status = result[0] if result else None
-            block_count = result[1] if result else 0
-            current_jail = result[2] if result else None
-
-            if current_status == 'allowed':
-                logger.info(f"客户端 {client_name} ({client_ip}) 请求封禁IP {ip}，但当前为allowed状态 - 被忽略")
-                continue
-
-            if current_status == 'known':
-                block_count += 1
-                block_duration = calculate_block_duration(block_count)
-
-                # 更新时保留原有的jail信息（如果有），否则使用新的jail信息
-                update_jail =  jail
-                
-                cursor.execute('''
-                    UPDATE ip_addresses
-                    SET status = 'blocked',
-                        blocked_until = ?,
-                        reported_by = ?,
-                        block_count = ?,
-                        allowed_since = NULL,
-                        jail = ?
-                    WHERE ip_address = ?
-                ''', (datetime.now() + block_duration, reported_by, block_count, update_jail, ip))
-
-                added_ips.append(ip)
-                logger.info(f"客户端 {client_name} ({client_ip}) 已封禁IP {ip} (jail: {update_jail}, 封禁计数: {block_count}, 封禁时间: {block_duration}, 报告来源: {reported_by})")
-
-            elif current_status != 'blocked':
-                block_duration = calculate_block_duration(block_count)
-
-                if not current_status:
-                    cursor.execute('''
-                        INSERT INTO ip_addresses
-                        (ip_address, description, status, reported_by, blocked_until, block_count, jail)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (ip, description, 'blocked', reported_by, datetime.now() + block_duration, 1, jail))
-                else:                    
-                    update_jail =  jail
-                    
-                    cursor.execute('''
-                        UPDATE ip_addresses
-                        SET status = 'blocked',
-                            blocked_until = ?,
-                            reported_by = ?,
-                            block_count = ?,
-                            jail = ?
-                        WHERE ip_address = ?
-                    ''', (datetime.now() + block_duration, reported_by, block_count, update_jail, ip))
-
-                added_ips.append(ip)
-                logger.info(f"客户端 {client_name} ({client_ip}) 已封禁IP {ip} (jail: {jail}, 封禁时间: {block_duration}, 报告来源: {reported_by})")
-            else:
-                logger.info(f"客户端 {client_name} ({client_ip}) (jail: {jail}) 请求封禁IP {ip}，但当前状态为jail: {current_jail} -- blocked - 被忽略")
-        conn.commit()
-        logger.info(f"客户端 {client_name} ({client_ip}) 成功添加 {len(added_ips)} 个IP地址到封禁列表")
+        if WRITE_BATCHING:
+            # 与同时到达的其他写请求合并到同一个事务中提交
+            # 等待合并提交的时间计入db阶段
+            with request_phase('db'):
+                added_ips = get_write_batcher().submit('add', {
+                    'ips': ips, 'description': description, 'jail': jail, 'reported_by': reported_by,
+                    'client_name': client_name, 'client_ip': client_ip
+                })
+        else:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            # 立即获取写锁，整批IP用少量集合操作完成，缩短写锁持有时间
+            conn.execute('BEGIN IMMEDIATE')
+            cache_since = ip_cache.begin_write(cursor)
+            added_ips = apply_add_ips(cursor, ips, description, jail, reported_by, client_name, client_ip, datetime.now())
+            cache_changes = ip_cache.collect_write(cursor, cache_since)
+            with db_timer('commit'):
+                conn.commit()
+            publish_write(cache_changes)
+        record_add_ips_metrics(ips, added_ips)
         return jsonify({"message": "IP地址已添加", "added_ips": added_ips}), 201
     except sqlite3.IntegrityError as e:
         if conn:
             conn.rollback()
-        logger.error(f"客户端 {client_name} ({client_ip}) 添加IP地址时发生完整性错误: {e}")
+        logger.error("客户端 %s (%s) 添加IP地址时发生完整性错误: %s", client_name, client_ip, e)
         return jsonify({"error": "添加IP地址时出错"}), 400
     except Exception as e:
         if conn:
             conn.rollback()
-        logger.error(f"客户端 {client_name} ({client_ip}) 添加IP地址时出错: {e}")
+        logger.error("客户端 %s (%s) 添加IP地址时出错: %s", client_name, client_ip, e)
         return jsonify({"error": "服务器内部错误"}), 500
     finally:
         if conn:
             db_pool.return_connection(conn)
 
+# 流式输出时每次从游标读取的行数
+STREAM_FETCH_SIZE = 1000
+
+def wants_ndjson_stream():
+    return (request.args.get('stream') in ('1', 'true')
+            or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+# 客户端是否接受二进制IP列表格式
+def wants_binary_list():
+    return IP_LIST_MIMETYPE in request.headers.get('Accept', '')
+
+# 是否按aggregate=参数合并网段：只用于不分页的封禁列表，且至少配置了一条聚合规则
+def wants_aggregate(status, use_pagination, value):
+    return (status == 'blocked' and not use_pagination and value in ('1', 'true')
+            and bool(AGGREGATE_IPV4 or AGGREGATE_IPV6))
+
+# 聚合规则也计入ETag，修改规则并重启后客户端不会继续使用旧的列表
+def aggregate_variant(aggregate):
+    return (AGGREGATE_IPV4, AGGREGATE_IPV6) if aggregate else None
+
+def row_to_ip_info(row, status):
+    return {
+        "id": row[0],
+        "ip_address": row[1],
+        "description": row[2],
+        "status": status,
+        "reported_by": row[4],
+        "blocked_until": row[5],
+        "allowed_since": row[6],
+        "block_count": row[7],
+        "jail": row[8]
+    }
+
+# 以NDJSON格式流式输出IP列表：每行一个IP记录，最后一行为结束标记，
+# 使用fetchmany逐批读取并按需增量gzip压缩，整个列表不会同时驻留在内存中
+def stream_ip_list(conn, status, where, params, search_ip, client_name, client_ip):
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    returned = threading.Event()
+
+    # 连接在生成器结束或响应关闭时归还（只归还一次）：HEAD请求或客户端在收到第一块数据前断开时生成器不会执行
+    def return_connection():
+        if not returned.is_set():
+            returned.set()
+            db_pool.return_connection(conn)
+
+    def generate():
+        compressor = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, zlib.MAX_WBITS | 16) if use_gzip else None
+        total_count = 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT * FROM ip_addresses WHERE {where}', params)
+            while True:
+                rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+                if not rows:
+                    break
+                total_count += len(rows)
+                chunk = ''.join(json.dumps(row_to_ip_info(row, status), ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+            # 结束标记：客户端据此判断列表是否完整接收
+            tail = (json.dumps({"end": True, "total_items": total_count, "search_ip": search_ip}) + '\n').encode('utf-8')
+            yield compressor.compress(tail) + compressor.flush() if compressor else tail
+            logger.info("客户端 %s (%s) 流式获取%s IP列表，共 %d 个", client_name, client_ip, status, total_count,
+                        extra=LOG_SAMPLED)
+        except Exception as e:
+            logger.error("客户端 %s (%s) 流式获取%s IP列表时出错: %s", client_name, client_ip, status, e)
+        finally:
+            return_connection()
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.call_on_close(return_connection)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+IP_LIST_STATUS_NAMES = {
+    'blocked': '被封禁',
+    'allowed': '允许的',
+    'known': '已知的'
+}
+
+# 列表内容只会因写操作（变更日志序号增加）或记录到期而变化；以下查询返回影响该列表的、
+# 最近一次已经发生的到期时间，均可直接使用(status, blocked_until)/(status, allowed_since)索引
+def list_expiry_keys_sql(status, now):
+    allowed_cutoff = now - ALLOWED_DURATION
+    known_expired_sql, known_expired_params = known_expired_filter_sql()
+    blocked_to_allowed = ("SELECT MAX(blocked_until) FROM ip_addresses WHERE status = 'blocked' AND blocked_until < ?", (now,))
+    blocked_to_known = ("SELECT MAX(blocked_until) FROM ip_addresses WHERE status = 'blocked' AND blocked_until < ?", (allowed_cutoff,))
+    allowed_to_known = ("SELECT MAX(allowed_since) FROM ip_addresses WHERE status = 'allowed' AND allowed_since < ?", (allowed_cutoff,))
+    known_expired = (f"SELECT MAX(blocked_until) FROM ip_addresses WHERE status = 'known' AND {known_expired_sql}", known_expired_params)
+    return {
+        'blocked': [blocked_to_allowed],
+        'allowed': [blocked_to_allowed, blocked_to_known, allowed_to_known],
+        'known': [blocked_to_known, allowed_to_known, known_expired]
+    }[status]
+
+# 列表响应的强ETag：由变更日志序号、最近一次到期时间、状态以及查询条件和响应格式（variant）计算，
+# 不需要读取列表本身；所有worker进程对同一数据得到相同的ETag
+def ip_list_etag(cursor, status, now, variant):
+    with db_timer('lookup'):
+        keys = [get_change_cursor(cursor)]
+        for sql, params in list_expiry_keys_sql(status, now):
+            cursor.execute(sql, params)
+            keys.append(cursor.fetchone()[0])
+    return hashlib.blake2b(repr((status, keys, variant)).encode('utf-8'), digest_size=16).hexdigest()
+
+# 查询按jail分组的精简IP列表，指定jail时只需读取(status, jail, ip_address, ...)索引
+def query_jail_groups(cursor, status, now, search_ip='', jails=(), aggregate=False):
+    where, params = ip_list_filter_sql(status, now, search_ip, jails)
+    with db_timer('lookup'):
+        cursor.execute(f'SELECT jail, ip_address FROM ip_addresses WHERE {where}', params)
+        return jail_group_payload(cursor, search_ip, aggregate)
+
+# 查询IP列表并构建响应内容（Flask接口和asyncio接口共用），搜索条件无效时抛出ValueError
+def query_ip_list(cursor, status, now, search_ip='', use_pagination=False, page=1, per_page=50, after='', jails=(),
+                  aggregate=False):
+    if (jails or aggregate) and not use_pagination:
+        # 指定jail或合并网段且不分页时返回按jail分组的精简列表
+        return query_jail_groups(cursor, status, now, search_ip, jails, aggregate)
+
+    next_after = None
+    if ip_cache.enabled and not search_ip and not jails:
+        # 无搜索条件时从内存缓存的列表快照读取，总数和各jail数量由快照给出
+        snapshot = ip_cache.snapshot(cursor.connection, status, now)
+        if use_pagination:
+            rows, next_after = snapshot.page(per_page, after, (page - 1) * per_page)
+        else:
+            rows = snapshot.rows
+        total_count, jail_counts = snapshot.total, dict(snapshot.jail_counts)
+    else:
+        # 按查询时刻的实际状态过滤，不依赖后台清理线程是否已执行；搜索按前缀/CIDR走索引
+        where, params = ip_list_filter_sql(status, now, search_ip, jails)
+        if use_pagination:
+            # 键集分页：有after时从该IP之后继续读取，否则按页码定位
+            rows, next_after = fetch_ip_page(cursor, where, params, per_page, after, (page - 1) * per_page)
+        else:
+            # 不使用分页，返回所有匹配结果
+            with db_timer('lookup'):
+                cursor.execute(f'SELECT * FROM ip_addresses WHERE {where}', params)
+                rows = cursor.fetchall()
+
+        # 为不同jail添加计数功能：无搜索条件时读取计数表，搜索时单独聚合，返回全部结果时直接由结果行统计
+        if use_pagination and not search_ip and not jails:
+            total_count, jail_counts = get_status_counts(cursor, status, now)
+        elif use_pagination:
+            total_count, jail_counts = count_ips_by_jail(cursor, where, params)
+        else:
+            total_count = len(rows)
+            jail_counts = {}
+            for row in rows:
+                jail_name = row[8] or 'unknown'
+                jail_counts[jail_name] = jail_counts.get(jail_name, 0) + 1
+
+    # 构建IP信息字典，确保包含jail字段
+    ip_addresses = [row_to_ip_info(row, status) for row in rows]
+    
+    # 根据是否使用分页构建不同的响应
+    if use_pagination:
+        # 构建包含分页信息的响应
+        return {
+            "items": ip_addresses,
+            "pagination": {
+                "total_items": total_count,
+                "total_pages": (total_count + per_page - 1) // per_page,
+                "current_page": page,
+                "items_per_page": per_page,
+                "search_ip": search_ip,
+                "next_after": next_after
+            },
+            "jail_counts": jail_counts
+        }
+    # 不包含分页信息的响应
+    return {
+        "items": ip_addresses,
+        "total_items": total_count,
+        "search_ip": search_ip,
+        "jail_counts": jail_counts
+    }
+
+def log_ip_list_request(client_name, client_ip, status, response):
+    status_name = IP_LIST_STATUS_NAMES.get(status, status)
+    if 'pagination' in response:
+        pagination = response['pagination']
+        search_ip = pagination['search_ip']
+        query_info = f"(搜索: {search_ip}) " if search_ip else ""
+        logger.info("客户端 %s (%s) 请求获取%sIP列表 %s第 %d/%d 页，共 %d 个", client_name, client_ip, status_name, query_info,
+                    pagination['current_page'], pagination['total_pages'], pagination['total_items'], extra=LOG_SAMPLED)
+    else:
+        search_ip = response['search_ip']
+        # 按jail分组的响应没有jail_counts，由各组长度得出
+        jail_counts = response.get('jail_counts') or {j: len(ips) for j, ips in response.get('jails', {}).items()}
+        query_info = f"(搜索: {search_ip}) " if search_ip else ""
+        # 拼接各 jail 及对应数量
+        jail_detail = ', '.join([f"{j}:{c}" for j, c in jail_counts.items()])
+        logger.info("客户端 %s (%s) 请求获取%sIP列表 %s共 %d 个 jail 数量: %d  jail 列表: %s", client_name, client_ip, status_name,
+                    query_info, response['total_items'], len(jail_counts), jail_detail, extra=LOG_SAMPLED)
+
+# 返回内存缓存中预先生成的完整列表响应，客户端支持gzip时直接返回压缩后的内容
+def cached_list_response(entry):
+    use_gzip = entry.gzip_body is not None and 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = Response(entry.gzip_body if use_gzip else entry.body, mimetype=entry.mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+        # 响应已预先压缩，压缩前的大小供运行指标使用
+        g.uncompressed_bytes = len(entry.body)
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+# 为列表响应设置ETag，要求客户端和中间缓存每次都带If-None-Match重新验证
+def set_list_etag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
 # 通用的获取IP列表函数（支持分页和查询）
 @auth.login_required
 def get_ip_list(status):
-    update_ip_status()
     client_ip = get_client_ip()
     client_name = auth.current_user()
     conn = None
 
+    # 检查是否需要分页（提供了page或after参数时才使用分页）
+    page_param = request.args.get('page')
+    after = request.args.get('after', '').strip()
+    use_pagination = page_param is not None or bool(after)
+    try:
+        page, per_page = parse_page_args(page_param, request.args.get('per_page', 50))
+    except ValueError:
+        logger.warning("客户端 %s (%s) 请求获取%s IP列表，分页参数无效", client_name, client_ip, status)
+        return jsonify({"error": "无效的分页参数"}), 400
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 检查是否需要分页（只有明确提供了page参数时才使用分页）
-        page_param = request.args.get('page')
-        use_pagination = page_param is not None
-        
-        # 初始化分页参数
-        page = int(page_param) if page_param else 1
-        per_page = int(request.args.get('per_page', 50))
         search_ip = request.args.get('search_ip', '').strip()
-        
-        # 执行原始查询逻辑
-        if search_ip:
-            # 搜索过滤
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ? AND ip_address LIKE ?', 
-                          (status, f'%{search_ip}%'))
-            total_count = cursor.fetchone()[0]
-            
-            if use_pagination:
-                # 使用分页
-                offset = (page - 1) * per_page
-                cursor.execute('SELECT * FROM ip_addresses WHERE status = ? AND ip_address LIKE ? LIMIT ? OFFSET ?', 
-                              (status, f'%{search_ip}%', per_page, offset))
-            else:
-                # 不使用分页，返回所有匹配结果
-                cursor.execute('SELECT * FROM ip_addresses WHERE status = ? AND ip_address LIKE ?', 
-                              (status, f'%{search_ip}%'))
+        jails = parse_jail_args(request.args.getlist('jail'))
+        aggregate = wants_aggregate(status, use_pagination, request.args.get('aggregate'))
+        now = datetime.now()
+        # 不分页时：优先返回客户端接受的二进制格式，指定jail返回按jail分组的精简列表，否则按请求选择JSON或NDJSON流式格式
+        if use_pagination:
+            fmt = 'json'
+        elif wants_binary_list():
+            fmt = 'binary'
+        elif jails or aggregate:
+            fmt = 'jails'
         else:
-            # 无搜索过滤
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ?', (status,))
-            total_count = cursor.fetchone()[0]
-            
-            if use_pagination:
-                # 使用分页
-                offset = (page - 1) * per_page
-                cursor.execute('SELECT * FROM ip_addresses WHERE status = ? LIMIT ? OFFSET ?', 
-                              (status, per_page, offset))
-            else:
-                # 不使用分页，返回所有结果
-                cursor.execute('SELECT * FROM ip_addresses WHERE status = ?', (status,))
+            fmt = 'ndjson' if wants_ndjson_stream() else 'json'
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
         
-        rows = cursor.fetchall()
-
-        ip_addresses = []
-        for row in rows:
-            # 构建IP信息字典，确保包含jail字段
-            ip_info = {
-                "id": row[0],
-                "ip_address": row[1],
-                "description": row[2],
-                "status": row[3],
-                "reported_by": row[4],
-                "blocked_until": row[5],
-                "allowed_since": row[6],
-                "block_count": row[7],
-                "jail": row[8]
-            }
-            ip_addresses.append(ip_info)
+        # 条件请求：列表未变化时直接返回304，不查询也不序列化列表
+        etag = ip_list_etag(cursor, status, now, (search_ip, jails, use_pagination, page, per_page, after, fmt, use_gzip,
+                                                  aggregate_variant(aggregate)))
+        if request.if_none_match.contains_weak(etag):
+            logger.info("客户端 %s (%s) 请求获取%sIP列表，内容未变化", client_name, client_ip,
+                        IP_LIST_STATUS_NAMES.get(status, status), extra=LOG_SAMPLED)
+            return set_list_etag(Response(status=304), etag)
         
-        # 为不同jail添加计数功能
-        jail_counts = {}
-        # 构建jail计数的SQL查询，根据status和搜索条件
-        if search_ip:
-            cursor.execute('''
-                SELECT jail, COUNT(*) as count 
-                FROM ip_addresses 
-                WHERE status = ? AND ip_address LIKE ? 
-                GROUP BY jail
-            ''', (status, f'%{search_ip}%'))
-        else:
-            cursor.execute('''
-                SELECT jail, COUNT(*) as count 
-                FROM ip_addresses 
-                WHERE status = ? 
-                GROUP BY jail
-            ''', (status,))
-        
-        # 处理查询结果
-        jail_rows = cursor.fetchall()
-        for jail_row in jail_rows:
-            jail_name = jail_row[0] or 'unknown'
-            jail_counts[jail_name] = jail_row[1]
-        
-        # 根据是否使用分页构建不同的响应
-        if use_pagination:
-            # 计算总页数
-            total_pages = (total_count + per_page - 1) // per_page
-            
-            # 构建包含分页信息的响应
-            response = {
-                "items": ip_addresses,
-                "pagination": {
-                    "total_items": total_count,
-                    "total_pages": total_pages,
-                    "current_page": page,
-                    "items_per_page": per_page,
-                    "search_ip": search_ip
-                },
-                "jail_counts": jail_counts
-            }
-            
-            status_names = {
-                'blocked': '被封禁',
-                'allowed': '允许的',
-                'known': '已知的'
-            }
-            
-            query_info = f"(搜索: {search_ip}) " if search_ip else ""
-            logger.info(f"客户端 {client_name} ({client_ip}) 请求获取{status_names.get(status, status)}IP列表 {query_info}第 {page}/{total_pages} 页，共 {total_count} 个")
-        else:
-            # 不包含分页信息的响应
-            response = {
-                "items": ip_addresses,
-                "total_items": total_count,
-                "search_ip": search_ip,
-                "jail_counts": jail_counts
-            }
-            
-            status_names = {
-                'blocked': '被封禁',
-                'allowed': '允许的',
-                'known': '已知的'
-            }
-            
-            query_info = f"(搜索: {search_ip}) " if search_ip else ""
-            # 拼接各 jail 及对应数量
-            jail_detail = ', '.join([f"{j}:{c}" for j, c in jail_counts.items()])
-            logger.info(f"客户端 {client_name} ({client_ip}) 请求获取{status_names.get(status, status)}IP列表 {query_info}共 {total_count} 个 jail 数量: {len(jail_counts)}  jail 列表: {jail_detail}")
+        try:
+            # 完整列表直接返回内存缓存中预先生成（并压缩）的响应；NDJSON流式请求始终逐批读取数据库，
+            # 不在每个worker中为其保留整份列表
+            if ip_cache.enabled and not use_pagination and not search_ip and fmt != 'ndjson':
+                entry = ip_cache.body(conn, status, now, jails=jails or None, fmt=fmt, aggregate=aggregate)
+                log_ip_list_request(client_name, client_ip, status, entry.summary)
+                return set_list_etag(cached_list_response(entry), etag)
+            if fmt == 'binary':
+                payload = query_jail_groups(cursor, status, now, search_ip, jails, aggregate)
+                log_ip_list_request(client_name, client_ip, status, payload)
+                return set_list_etag(Response(pack_ip_list(payload['jails']), mimetype=IP_LIST_MIMETYPE), etag)
+            # 流式模式（不分页时）：连接交给生成器，在响应发送完毕后归还
+            if fmt == 'ndjson':
+                where, params = ip_list_filter_sql(status, now, search_ip)
+                response = stream_ip_list(conn, status, where, params, search_ip, client_name, client_ip)
+                conn = None
+                return set_list_etag(response, etag)
+            response = query_ip_list(cursor, status, now, search_ip, use_pagination, page, per_page, after, jails, aggregate)
+        except ValueError as e:
+            logger.warning("客户端 %s (%s) 请求获取%s IP列表，搜索条件无效: %s", client_name, client_ip, status, search_ip)
+            return jsonify({"error": f"无效的搜索条件: {e}"}), 400
         
-        return jsonify(response), 200
+        log_ip_list_request(client_name, client_ip, status, response)
+        return set_list_etag(jsonify(response), etag)
     except Exception as e:
-        logger.error(f"客户端 {client_name} ({client_ip}) 获取{status} IP列表时出错: {e}")
+        logger.error("客户端 %s (%s) 获取%s IP列表时出错: %s", client_name, client_ip, status, e)
         return jsonify({"error": "服务器内部错误"}), 500
     finally:
         if conn:
             db_pool.return_connection(conn)
 
+# 在调用方已开启的写事务中放行一个被封禁的IP，返回放行前的实际状态，IP不存在时返回None
+def apply_allow_ip(cursor, ip, now):
+    # 检查IP是否存在且被封禁（按实际状态判断）
+    status_sql, status_params = effective_status_sql(now)
+    with db_timer('lookup'):
+        cursor.execute(f'''
+            SELECT {status_sql} FROM ip_addresses WHERE ip_address = ?
+        ''', status_params + (ip,))
+        result = cursor.fetchone()
+    if not result:
+        return None
+    
+    if result[0] == 'blocked':
+        # 将IP设置为allowed状态
+        with db_timer('upsert'):
+            cursor.execute('''
+                UPDATE ip_addresses
+                SET status = 'allowed', allowed_since = ?
+                WHERE ip_address = ? AND status = 'blocked'
+            ''', (now, ip))
+    return result[0]
+
+# 执行一组写操作，相邻的封禁请求合并为一次执行；合并执行失败时逐个重试，只让出错的操作失败
+def apply_write_operations(cursor, operations, now):
+    cursor.execute('SAVEPOINT write_group')
+    try:
+        if operations[0][0] == 'add':
+            values = apply_add_ip_requests(cursor, [payload for _, payload in operations], now)
+        else:
+            values = [apply_allow_ip(cursor, payload, now) for _, payload in operations]
+        cursor.execute('RELEASE write_group')
+        return [(True, value) for value in values]
+    except Exception as e:
+        cursor.execute('ROLLBACK TO write_group')
+        cursor.execute('RELEASE write_group')
+        if len(operations) == 1:
+            return [(False, e)]
+        results = []
+        for operation in operations:
+            results.extend(apply_write_operations(cursor, [operation], now))
+        return results
+
+# 在一个事务中提交一组写操作 [(类型, 参数)]：类型为'add'时参数为封禁请求字典，为'allow'时参数为IP；
+# 按到达顺序执行，返回与operations一一对应的 [(是否成功, 结果或异常)]
+def commit_write_group(operations):
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        conn.execute('BEGIN IMMEDIATE')
+        cache_since = ip_cache.begin_write(cursor)
+        now = datetime.now()
+        results = []
+        position = 0
+        while position < len(operations):
+            # 取出同类型的连续操作（放行操作逐个执行，封禁请求合并执行）
+            end = position + 1
+            if operations[position][0] == 'add':
+                while end < len(operations) and operations[end][0] == 'add':
+                    end += 1
+            results.extend(apply_write_operations(cursor, operations[position:end], now))
+            position = end
+        cache_changes = ip_cache.collect_write(cursor, cache_since)
+        with db_timer('commit'):
+            conn.commit()
+        publish_write(cache_changes)
+        return results
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error("批量提交 %s 个写操作时出错: %s", len(operations), e)
+        return [(False, e)] * len(operations)
+    finally:
+        if conn:
+            db_pool.return_connection(conn)
+
+# 写请求合并提交（group commit）：请求线程把写操作放入队列后等待结果，
+# 后台线程在write_batch_delay毫秒内收集最多write_batch_size个操作，在一个事务中提交后逐个返回结果
+class WriteBatcher(threading.Thread):
+    def __init__(self, batch_size, batch_delay):
+        super().__init__(name='write-batcher', daemon=True)
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = max(0.0, batch_delay)
+        self.queue = queue.Queue()
+        # 统计信息
+        self.batches = 0
+        self.operations = 0
+
+    def submit(self, kind, payload):
+        future = concurrent.futures.Future()
+        self.queue.put((kind, payload, future))
+        return future.result()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            results = commit_write_group([(kind, payload) for kind, payload, _ in batch])
+            self.batches += 1
+            self.operations += len(batch)
+            metrics.observe('f2bsync_write_batch_operations', len(batch))
+            if len(batch) > 1:
+                logger.debug("合并提交 %s 个写操作", len(batch))
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+write_batcher = None
+write_batcher_lock = threading.Lock()
+
+# 按需启动写入线程（在gunicorn的每个worker中各自启动）
+def get_write_batcher():
+    global write_batcher
+    with write_batcher_lock:
+        if write_batcher is None or not write_batcher.is_alive():
+            write_batcher = WriteBatcher(config['write_batch_size'], config['write_batch_delay'] / 1000.0)
+            write_batcher.start()
+        return write_batcher
+
 @app.route('/allow_ip', methods=['POST'])
 @auth.login_required
 def allow_ip():
-    update_ip_status()
-    
     # 获取真实客户端IP和认证后的客户端名称
     client_ip = get_client_ip()
     client_name = auth.current_user()
     
     data = request.json
+    if not isinstance(data, dict):
+        logger.warning("客户端 %s (%s) 请求放行IP，但请求体不是JSON对象", client_name, client_ip)
+        return jsonify({"error": "请求体必须是JSON对象"}), 400
     ip = data.get('ip')
     
     if not ip:
-        logger.warning(f"客户端 {client_name} ({client_ip}) 请求放行IP但未提供IP地址")
+        logger.warning("客户端 %s (%s) 请求放行IP但未提供IP地址", client_name, client_ip)
         return jsonify({"error": "需要IP地址"}), 400
 
     conn = None
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        conn.execute('BEGIN TRANSACTION')
-
-        # 检查IP是否存在且被封禁
-        cursor.execute('''
-            SELECT status FROM ip_addresses WHERE ip_address = ?
-        ''', (ip,))
-        result = cursor.fetchone()
+        if WRITE_BATCHING:
+            with request_phase('db'):
+                current_status = get_write_batcher().submit('allow', ip)
+        else:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            conn.execute('BEGIN IMMEDIATE')
+            cache_since = ip_cache.begin_write(cursor)
+            current_status = apply_allow_ip(cursor, ip, datetime.now())
         
-        if not result:
-            logger.info(f"客户端 {client_name} ({client_ip}) 请求放行IP {ip}，但该IP不存在")
+        if current_status is None:
+            logger.info("客户端 %s (%s) 请求放行IP %s，但该IP不存在", client_name, client_ip, ip, extra=LOG_SAMPLED)
             return jsonify({"error": "IP地址不存在"}), 404
         
-        current_status = result[0]
-        
         if current_status != 'blocked':
-            logger.info(f"客户端 {client_name} ({client_ip}) 请求放行IP {ip}，但该IP当前状态为 {current_status}")
+            logger.info("客户端 %s (%s) 请求放行IP %s，但该IP当前状态为 %s", client_name, client_ip, ip, current_status,
+                        extra=LOG_SAMPLED)
             return jsonify({"error": f"IP地址当前状态为 {current_status}，不需要放行"}), 400
         
-        # 将IP设置为allowed状态
-        cursor.execute('''
-            UPDATE ip_addresses
-            SET status = 'allowed', allowed_since = ?
-            WHERE ip_address = ? AND status = 'blocked'
-        ''', (datetime.now(), ip))
-        
-        conn.commit()
-        logger.info(f"客户端 {client_name} ({client_ip}) 已手动放行IP {ip}")
+        if conn:
+            cache_changes = ip_cache.collect_write(cursor, cache_since)
+            with db_timer('commit'):
+                conn.commit()
+            publish_write(cache_changes)
+        logger.info("客户端 %s (%s) 已手动放行IP %s", client_name, client_ip, ip, extra=LOG_SAMPLED)
         return jsonify({"message": f"IP地址 {ip} 已成功放行"}), 200
         
     except Exception as e:
         if conn:
             conn.rollback()
-        logger.error(f"客户端 {client_name} ({client_ip}) 放行IP {ip} 时出错: {e}")
+        logger.error("客户端 %s (%s) 放行IP %s 时出错: %s", client_name, client_ip, ip, e)
         return jsonify({"error": "服务器内部错误"}), 500
     finally:
         if conn:
             db_pool.return_connection(conn)
 
+# 增量同步接口：返回游标之后每个IP的最新状态（blocked/allowed/known/deleted）
+@app.route('/changes', methods=['GET'])
+@auth.login_required
+def get_changes():
+    client_ip = get_client_ip()
+    client_name = auth.current_user()
+    conn = None
+
+    try:
+        since_param = request.args.get('since')
+        since = int(since_param) if since_param is not None else None
+        limit = min(max(int(request.args.get('limit', 10000)), 1), 100000)
+
+        conn = get_db_connection()
+        payload = query_changes(conn, since, limit)
+        log_changes_request(client_name, client_ip, since, payload)
+        return jsonify(payload), 200
+    except ValueError:
+        return jsonify({"error": "无效的游标参数"}), 400
+    except Exception as e:
+        logger.error("客户端 %s (%s) 获取增量变更时出错: %s", client_name, client_ip, e)
+        return jsonify({"error": "服务器内部错误"}), 500
+    finally:
+        if conn:
+            db_pool.return_connection(conn)
+
+# 记录 /changes 请求日志（Flask和asyncio模式共用）
+def log_changes_request(client_name, client_ip, since, payload):
+    if payload['reset']:
+        logger.info("客户端 %s (%s) 请求增量变更，游标 %s 无效，需要全量同步（当前游标: %s）", client_name, client_ip, since,
+                    payload['cursor'], extra=LOG_SAMPLED)
+    else:
+        logger.info("客户端 %s (%s) 请求增量变更，游标 %s -> %s，共 %d 个IP变更", client_name, client_ip, since,
+                    payload['cursor'], len(payload['changes']), extra=LOG_SAMPLED)
+
+# 格式化一条Server-Sent Events消息
+def format_sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+# 推送接口只由asyncio模式服务器（async_server.py）提供：每个订阅连接要保持 events_max_duration 秒，
+# 在gunicorn的gthread worker中会一直占用一个请求线程。返回404时客户端继续使用定时同步
+@app.route('/events', methods=['GET'])
+@auth.login_required
+def get_events():
+    logger.info("客户端 %s (%s) 请求变更推送，server.py 不提供 /events，请使用 async_server.py",
+                auth.current_user(), get_client_ip(), extra=LOG_SAMPLED)
+    return jsonify({"error": "变更推送只由asyncio模式服务器（async_server.py）提供"}), 404
+
+# 输出时从计数表读取各状态、各jail的IP数
+def ip_count_metrics(cursor, now):
+    samples = []
+    for status in ('blocked', 'allowed', 'known'):
+        _, jail_counts = get_status_counts(cursor, status, now)
+        samples.extend(('f2bsync_ips', (('status', status), ('jail', jail)), count)
+                       for jail, count in sorted(jail_counts.items()))
+    return samples
+
+# 生成 /metrics 的响应内容（Flask接口和asyncio接口共用）
+def render_metrics():
+    conn = None
+    try:
+        conn = get_db_connection()
+        return metrics.render(ip_count_metrics(conn.cursor(), datetime.now()))
+    finally:
+        if conn:
+            db_pool.return_connection(conn)
+
+METRICS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def get_metrics():
+    if not metrics.enabled:
+        return jsonify({"error": "运行指标未启用"}), 404
+    try:
+        return Response(render_metrics(), content_type=METRICS_MIMETYPE)
+    except Exception as e:
+        logger.error("生成运行指标时出错: %s", e)
+        return jsonify({"error": "服务器内部错误"}), 500
+
 # API端点路由
 @app.route('/get_ips', methods=['GET'])
 def get_ips():
@@ -682,7 +2933,6 @@ def dashboard():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    update_ip_status()
     conn = None
     try:
         conn = get_db_connection()
@@ -691,75 +2941,62 @@ def dashboard():
         # 获取搜索和分页参数
         search_ip = request.args.get('search_ip', '').strip()
         
-        # 封禁IP的分页
+        # 封禁IP的分页（blocked_after为上一页最后一个IP，用于键集分页）
         blocked_page = int(request.args.get('blocked_page', 1))
+        blocked_after = request.args.get('blocked_after', '').strip()
         blocked_per_page = 50
-        blocked_offset = (blocked_page - 1) * blocked_per_page
         
         # 已放行IP的分页
         allowed_page = int(request.args.get('allowed_page', 1))
+        allowed_after = request.args.get('allowed_after', '').strip()
         allowed_per_page = 50
-        allowed_offset = (allowed_page - 1) * allowed_per_page
-        
-        # 查询被封禁的IP，支持搜索过滤和分页
-        if search_ip:
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ? AND ip_address LIKE ?', ('blocked', f'%{search_ip}%'))
-            blocked_total = cursor.fetchone()[0]
-            cursor.execute('SELECT * FROM ip_addresses WHERE status = ? AND ip_address LIKE ? LIMIT ? OFFSET ?', 
-                          ('blocked', f'%{search_ip}%', blocked_per_page, blocked_offset))
+        
+        # 按查询时刻的实际状态过滤，搜索按前缀/CIDR走索引
+        now = datetime.now()
+        try:
+            blocked_where, blocked_params = ip_list_filter_sql('blocked', now, search_ip)
+            allowed_where, allowed_params = ip_list_filter_sql('allowed', now, search_ip)
+        except ValueError as e:
+            flash(f'无效的搜索条件: {e}', 'error')
+            search_ip = ''
+            blocked_where, blocked_params = ip_list_filter_sql('blocked', now, '')
+            allowed_where, allowed_params = ip_list_filter_sql('allowed', now, '')
+        
+        # 查询被封禁的IP，支持搜索过滤和分页（无搜索条件时读取内存缓存）
+        if ip_cache.enabled and not search_ip:
+            blocked_snapshot = ip_cache.snapshot(conn, 'blocked', now)
+            blocked_total = blocked_snapshot.total
+            blocked_ips, blocked_next_after = blocked_snapshot.page(blocked_per_page, blocked_after,
+                                                                    (blocked_page - 1) * blocked_per_page)
         else:
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ?', ('blocked',))
-            blocked_total = cursor.fetchone()[0]
-            cursor.execute('SELECT * FROM ip_addresses WHERE status = ? LIMIT ? OFFSET ?', 
-                          ('blocked', blocked_per_page, blocked_offset))
-        blocked_ips = cursor.fetchall()
+            if search_ip:
+                blocked_total, _ = count_ips_by_jail(cursor, blocked_where, blocked_params)
+            else:
+                blocked_total, _ = get_status_counts(cursor, 'blocked', now)
+            blocked_ips, blocked_next_after = fetch_ip_page(cursor, blocked_where, blocked_params, blocked_per_page,
+                                                            blocked_after, (blocked_page - 1) * blocked_per_page)
         blocked_total_pages = (blocked_total + blocked_per_page - 1) // blocked_per_page
         
-        # 查询已放行的IP，支持搜索过滤和分页
-        if search_ip:
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ? AND ip_address LIKE ?', ('allowed', f'%{search_ip}%'))
-            allowed_total = cursor.fetchone()[0]
-            cursor.execute('SELECT * FROM ip_addresses WHERE status = ? AND ip_address LIKE ? LIMIT ? OFFSET ?', 
-                          ('allowed', f'%{search_ip}%', allowed_per_page, allowed_offset))
+        # 查询已放行的IP，支持搜索过滤和分页（无搜索条件时读取内存缓存）
+        if ip_cache.enabled and not search_ip:
+            allowed_snapshot = ip_cache.snapshot(conn, 'allowed', now)
+            allowed_total = allowed_snapshot.total
+            allowed_ips, allowed_next_after = allowed_snapshot.page(allowed_per_page, allowed_after,
+                                                                    (allowed_page - 1) * allowed_per_page)
         else:
-            cursor.execute('SELECT COUNT(*) FROM ip_addresses WHERE status = ?', ('allowed',))
-            allowed_total = cursor.fetchone()[0]
-            cursor.execute('SELECT * FROM ip_addresses WHERE status = ? LIMIT ? OFFSET ?', 
-                          ('allowed', allowed_per_page, allowed_offset))
-        allowed_ips = cursor.fetchall()
+            if search_ip:
+                allowed_total, _ = count_ips_by_jail(cursor, allowed_where, allowed_params)
+            else:
+                allowed_total, _ = get_status_counts(cursor, 'allowed', now)
+            allowed_ips, allowed_next_after = fetch_ip_page(cursor, allowed_where, allowed_params, allowed_per_page,
+                                                            allowed_after, (allowed_page - 1) * allowed_per_page)
         allowed_total_pages = (allowed_total + allowed_per_page - 1) // allowed_per_page
         
         # 处理封禁IP列表，确保包含jail字段
-        processed_blocked_ips = []
-        for row in blocked_ips:
-            ip_dict = {
-                'id': row[0],
-                'ip_address': row[1],
-                'description': row[2],
-                'status': row[3],
-                'reported_by': row[4],
-                'blocked_until': row[5],
-                'allowed_since': row[6],
-                'block_count': row[7],
-                'jail': row[8]
-            }
-            processed_blocked_ips.append(ip_dict)
+        processed_blocked_ips = [row_to_ip_info(row, 'blocked') for row in blocked_ips]
         
         # 处理已放行IP列表，确保包含jail字段
-        processed_allowed_ips = []
-        for row in allowed_ips:
-            ip_dict = {
-                'id': row[0],
-                'ip_address': row[1],
-                'description': row[2],
-                'status': row[3],
-                'reported_by': row[4],
-                'blocked_until': row[5],
-                'allowed_since': row[6],
-                'block_count': row[7],
-                'jail': row[8]
-            }
-            processed_allowed_ips.append(ip_dict)
+        processed_allowed_ips = [row_to_ip_info(row, 'allowed') for row in allowed_ips]
         
         return render_template('dashboard.html', 
                              blocked_ips=processed_blocked_ips, 
@@ -771,13 +3008,15 @@ def dashboard():
                              blocked_per_page=blocked_per_page,
                              blocked_total=blocked_total,
                              blocked_total_pages=blocked_total_pages,
+                             blocked_next_after=blocked_next_after,
                              # 已放行IP的分页信息
                              allowed_page=allowed_page,
                              allowed_per_page=allowed_per_page,
                              allowed_total=allowed_total,
-                             allowed_total_pages=allowed_total_pages)
+                             allowed_total_pages=allowed_total_pages,
+                             allowed_next_after=allowed_next_after)
     except Exception as e:
-        logger.error(f"获取IP列表时出错: {e}")
+        logger.error("获取IP列表时出错: %s", e)
         flash('获取IP列表时出错', 'error')
         return render_template('dashboard.html', blocked_ips=[], allowed_ips=[], username=session['username'])
     finally:
@@ -789,46 +3028,37 @@ def web_allow_ip(ip):
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    update_ip_status()
     conn = None
     
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        conn.execute('BEGIN TRANSACTION')
+        conn.execute('BEGIN IMMEDIATE')
+        cache_since = ip_cache.begin_write(cursor)
 
-        # 检查IP是否存在且被封禁
-        cursor.execute('''
-            SELECT status FROM ip_addresses WHERE ip_address = ?
-        ''', (ip,))
-        result = cursor.fetchone()
+        # 检查IP是否存在且被封禁（按实际状态判断），是则设置为allowed状态
+        current_status = apply_allow_ip(cursor, ip, datetime.now())
         
-        if not result:
+        if current_status is None:
             flash(f'IP地址 {ip} 不存在', 'error')
             return redirect(url_for('dashboard'))
         
-        current_status = result[0]
-        
         if current_status != 'blocked':
             flash(f'IP地址 {ip} 当前状态为 {current_status}，不需要放行', 'warning')
             return redirect(url_for('dashboard'))
         
-        # 将IP设置为allowed状态
-        cursor.execute('''
-            UPDATE ip_addresses
-            SET status = 'allowed', allowed_since = ?
-            WHERE ip_address = ? AND status = 'blocked'
-        ''', (datetime.now(), ip))
-        
-        conn.commit()
-        logger.info(f"用户 {session['username']} 已手动放行IP {ip}")
+        cache_changes = ip_cache.collect_write(cursor, cache_since)
+        with db_timer('commit'):
+            conn.commit()
+        publish_write(cache_changes)
+        logger.info("用户 %s 已手动放行IP %s", session['username'], ip)
         flash(f'IP地址 {ip} 已成功放行', 'success')
         return redirect(url_for('dashboard'))
         
     except Exception as e:
         if conn:
             conn.rollback()
-        logger.error(f"用户 {session['username']} 放行IP {ip} 时出错: {e}")
+        logger.error("用户 %s 放行IP %s 时出错: %s", session['username'], ip, e)
         flash('放行IP时发生错误', 'error')
         return redirect(url_for('dashboard'))
     finally:
@@ -841,7 +3071,6 @@ def web_allow_ips_batch():
     if 'username' not in session:
         return jsonify({'success': False, 'message': '未登录'}), 401
     
-    update_ip_status()
     conn = None
     
     try:
@@ -853,40 +3082,35 @@ def web_allow_ips_batch():
         
         conn = get_db_connection()
         cursor = conn.cursor()
-        conn.execute('BEGIN TRANSACTION')
+        conn.execute('BEGIN IMMEDIATE')
+        cache_since = ip_cache.begin_write(cursor)
         
         # 统计成功/失败的IP
         success_ips = []
         fail_ips = []
         
+        now = datetime.now()
         for ip in selected_ips:
-            # 检查IP状态
-            cursor.execute('''
-                SELECT status FROM ip_addresses WHERE ip_address = ?
-            ''', (ip,))
-            result = cursor.fetchone()
+            # 检查IP实际状态，被封禁的IP设置为allowed状态
+            current_status = apply_allow_ip(cursor, ip, now)
             
-            if not result:
+            if current_status is None:
                 fail_ips.append(f"{ip}（不存在）")
                 continue
             
-            current_status = result[0]
             if current_status != 'blocked':
                 fail_ips.append(f"{ip}（当前状态：{current_status}）")
                 continue
             
-            # 更新IP状态
-            cursor.execute('''
-                UPDATE ip_addresses
-                SET status = 'allowed', allowed_since = ?
-                WHERE ip_address = ? AND status = 'blocked'
-            ''', (datetime.now(), ip))
             success_ips.append(ip)
         
-        conn.commit()
+        cache_changes = ip_cache.collect_write(cursor, cache_since)
+        with db_timer('commit'):
+            conn.commit()
+        publish_write(cache_changes)
         
         # 记录日志和提示信息
-        logger.info(f"用户 {session['username']} 批量放行IP：成功{len(success_ips)}个，失败{len(fail_ips)}个")
+        logger.info("用户 %s 批量放行IP：成功%s个，失败%s个", session['username'], len(success_ips), len(fail_ips))
         if success_ips:
             flash(f'成功放行IP：{", ".join(success_ips)}', 'success')
         if fail_ips:
@@ -897,35 +3121,237 @@ def web_allow_ips_batch():
     except Exception as e:
         if conn:
             conn.rollback()
-        logger.error(f"用户 {session['username']} 批量放行IP时出错: {e}")
+        logger.error("用户 %s 批量放行IP时出错: %s", session['username'], e)
         flash('批量放行IP时发生错误', 'error')
         return redirect(url_for('dashboard'))
     finally:
         if conn:
             db_pool.return_connection(conn)
 
+# 一次性能分析的最长采集时间（秒）
+PROFILE_MAX_SECONDS = 30
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+# 性能分析的跨进程锁：gunicorn多worker时整个服务同一时刻只进行一次采集，最多占用一个请求线程；
+# 返回已加锁的文件（关闭即释放），锁已被其他进程持有时返回None
+def acquire_profile_lock():
+    lock_file = open(f'{DATABASE}.profile.lock', 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+# 性能分析接口：对本进程接下来seconds秒内的请求按sample比例运行cProfile，结束后返回合并的结果
+# （format=pstats时返回可用pstats/snakeviz打开的原始数据）；gunicorn模式下只包含处理本请求的worker
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': '未登录'}), 401
+    if not PROFILING:
+        return jsonify({"error": "性能分析未启用"}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        sample_rate = float(request.args.get('sample', 1))
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "无效的参数"}), 400
+    sort = request.args.get('sort', 'cumulative')
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0 < sample_rate <= 1 or sort not in PROFILE_SORT_KEYS:
+        return jsonify({"error": f"无效的参数（seconds: 0-{PROFILE_MAX_SECONDS}，sample: 0-1，sort: {'/'.join(PROFILE_SORT_KEYS)}）"}), 400
+
+    lock_file = acquire_profile_lock()
+    if lock_file is None or not request_profiler.start(seconds, sample_rate):
+        if lock_file is not None:
+            lock_file.close()
+        return jsonify({"error": "已有正在进行的性能分析"}), 409
+    try:
+        logger.info("用户 %s 开始性能分析：采集 %.1f 秒，采样比例 %s", session['username'], seconds, sample_rate)
+        time.sleep(seconds)
+        stats, profiled = request_profiler.finish()
+    finally:
+        lock_file.close()
+    logger.info("性能分析结束：共分析 %d 个请求", profiled)
+
+    if request.args.get('format') == 'pstats':
+        if stats is None:
+            return jsonify({"error": "采集期间没有请求"}), 404
+        return Response(marshal.dumps(stats.stats), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=fail2bansync-{os.getpid()}.prof'})
+    output = io.StringIO()
+    output.write(f"进程 {os.getpid()}，采集 {seconds:g} 秒，采样比例 {sample_rate:g}，共分析 {profiled} 个请求\n")
+    if stats is not None:
+        stats.stream = output
+        stats.sort_stats(sort).print_stats(limit)
+    return Response(output.getvalue(), mimetype='text/plain')
+
+
+# 读取session密钥：优先使用配置中的secret_key，否则使用密钥文件（首次启动时生成），
+# 保证所有worker进程以及服务重启前后使用同一个密钥，已登录的session不会失效
+def load_secret_key():
+    if config['secret_key']:
+        return config['secret_key']
+    key_file = config['secret_key_file']
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_file, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        key = os.urandom(32).hex()
+        f.write(key)
+    logger.info("已生成新的session密钥文件: %s", key_file)
+    return key
 
 # 设置密钥用于session加密
-app.secret_key = os.urandom(24)
+app.secret_key = load_secret_key()
 # 设置session过期时间
 app.permanent_session_lifetime = timedelta(minutes=30)
 
-if __name__ == '__main__':
+# 开发模式：Flask自带的单进程服务器，仅用于调试
+def run_dev_server():
     try:
         init_db()
-        logger.info("服务器已启动，监听地址: 0.0.0.0:5000")
-        logger.info(f"配置信息: 封禁时间={BLOCK_DURATION}, 增量封禁={INCREMENT_BLOCK}, 封禁因子={BLOCK_FACTOR}, 最大封禁时间={MAX_BLOCK_DURATION}")
+        ip_cache.load()
+        start_status_sweeper()
+        logger.info("服务器已启动（开发模式），监听地址: 0.0.0.0:5000")
+        logger.info("配置信息: 封禁时间=%s, 增量封禁=%s, 封禁因子=%s, 最大封禁时间=%s",
+                    BLOCK_DURATION, INCREMENT_BLOCK, BLOCK_FACTOR, MAX_BLOCK_DURATION)
         app.run(host='0.0.0.0', port=5000, debug=False)
     except KeyboardInterrupt:
         logger.info("服务器被用户中断")
     except Exception as e:
-        logger.error(f"服务器启动失败: {e}")
+        logger.error("服务器启动失败: %s", e)
     finally:
-        # 关闭所有数据库连接
+        # 停止后台状态清理线程并关闭所有数据库连接
+        stop_status_sweeper()
+        if ip_cache.enabled:
+            logger.info("内存缓存统计: %s", ip_cache.format_stats())
+        logger.info("数据库连接池统计: %s", db_pool.stats())
         db_pool.close_all()
         logger.info("服务器已关闭，所有资源已释放")
+    return 0
 
+# 生产模式：基于gunicorn的pre-fork多进程服务器
+# 主进程只负责初始化数据库和管理worker，每个worker使用gthread处理并发请求并拥有独立的连接池；
+# SQLite在WAL模式下允许多进程同时读取，写入由数据库锁串行化（一个写入者、多个读取者）
+def run_production_server(bind, workers, threads):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.error("未安装gunicorn，无法以生产模式启动，请执行: pip install gunicorn")
+        return 1
+
+    if config['db_max_connections'] < threads + 1:
+        logger.warning("db_max_connections=%s 小于每个worker的线程数+1（%s），请求可能需要等待数据库连接",
+                       config['db_max_connections'], threads + 1)
+
+    # worker的日志发送给主进程统一写入
+    log_receiver, log_sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def post_fork(server, worker):
+        # 日志改为发送给主进程；后台日志线程不会随fork进入worker，由use_log_handlers重新启动
+        log_receiver.close()
+        use_log_handlers([LogForwardHandler(log_sender)])
+        # 每个worker各自加载内存缓存并运行清理线程，通过文件锁保证同一时刻只有一个执行清理
+        metrics.reset()
+        ip_cache.load()
+        start_status_sweeper()
+        metrics.start_flush(METRICS_FLUSH_INTERVAL)
+
+    def worker_exit(server, worker):
+        stop_status_sweeper(timeout=5)
+        metrics.stop_flush()
+        if write_batcher is not None:
+            logger.info("worker %s 写入合并统计: 提交 %s 批，共 %s 个写操作",
+                        worker.pid, write_batcher.batches, write_batcher.operations)
+        if ip_cache.enabled:
+            logger.info("worker %s 内存缓存统计: %s", worker.pid, ip_cache.format_stats())
+        logger.info("worker %s 退出，数据库连接池统计: %s", worker.pid, db_pool.stats())
+        db_pool.close_all()
+
+    class FlaskApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'backlog': config['backlog'],
+        'keepalive': config['keepalive'],
+        'graceful_timeout': config['graceful_timeout'],
+        'timeout': 60,
+        'proc_name': 'fail2bansync-server',
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+
+    init_db()
+    # fork之前关闭主进程中的连接，避免worker继承同一个SQLite连接
+    db_pool.close_all()
+    if metrics.enabled and workers > 1:
+        # 各worker定期把运行指标写入共享目录，/metrics 由任一worker输出所有worker的合计
+        metrics.shared_dir = tempfile.mkdtemp(prefix='fail2bansync-metrics-')
+    logger.info("服务器已启动（生产模式），监听地址: %s，worker数: %s，每个worker线程数: %s", ', '.join(bind), workers, threads)
+    logger.info("配置信息: 封禁时间=%s, 增量封禁=%s, 封禁因子=%s, 最大封禁时间=%s",
+                BLOCK_DURATION, INCREMENT_BLOCK, BLOCK_FACTOR, MAX_BLOCK_DURATION)
+    master_pid = os.getpid()
+    threading.Thread(target=collect_worker_logs, args=(log_receiver,), name='log-collector', daemon=True).start()
+    try:
+        FlaskApplication(app, options).run()
+    finally:
+        # worker退出时同样从这里返回（SystemExit），共享目录和日志socket只由主进程清理
+        if os.getpid() == master_pid:
+            if metrics.shared_dir:
+                shutil.rmtree(metrics.shared_dir, ignore_errors=True)
+            drain_worker_logs(log_receiver)
+            log_receiver.close()
+    return 0
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fail2ban-sync 服务端')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='以生产模式（多进程）运行服务器（默认）')
+    serve_parser.add_argument('--bind', action='append',
+                              help='监听地址，如 0.0.0.0:5000 或 unix:/run/fail2bansync/server.sock，可多次指定（默认读取配置文件中的bind）')
+    serve_parser.add_argument('--workers', type=int, default=config['workers'], help='worker进程数')
+    serve_parser.add_argument('--threads', type=int, default=config['threads'], help='每个worker的线程数')
+    subparsers.add_parser('dev', help='使用Flask开发服务器运行（仅用于调试）')
+    stats_parser = subparsers.add_parser('check-stats', help='检查ip_stats计数表与ip_addresses是否一致')
+    stats_parser.add_argument('--rebuild', action='store_true', help='发现不一致时重建计数表')
+    args = parser.parse_args()
+
+    if args.command == 'check-stats':
+        try:
+            init_db()
+            exit_code = run_stats_check(args.rebuild)
+        finally:
+            db_pool.close_all()
+        exit(exit_code)
 
+    if args.command == 'dev':
+        exit(run_dev_server())
 
+    if args.command == 'serve':
+        exit(run_production_server(args.bind or config['bind'], max(1, args.workers), max(1, args.threads)))
 
+    # 未指定子命令：优先使用生产模式，未安装gunicorn时回退到开发服务器
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        logger.warning("未安装gunicorn，使用Flask开发服务器运行；生产环境请执行 pip install gunicorn")
+        exit(run_dev_server())
+    exit(run_production_server(config['bind'], max(1, config['workers']), max(1, config['threads'])))
@@ -0,0 +1,55 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(os.path.dirname(SERVER_DIR), 'Client')
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """在临时目录中以测试配置导入server.py（配置文件在导入时从当前目录读取）"""
+    work = tmp_path_factory.mktemp('server')
+    (work / 'serverconfig.ini').write_text(
+        '[DEFAULT]\n'
+        f'db_path = {work / "ip_management.db"}\n'
+        f'log_file = {work / "server.log"}\n'
+        f'secret_key_file = {work / "secret_key"}\n'
+        'bantime = 10m\n'
+        'allowed_duration = 2m\n'
+        'write_batching = false\n'
+        'log_queue = false\n'
+        '[api_tokens]\n'
+        f'tests = {TOKEN}\n',
+        encoding='utf-8')
+    cwd = os.getcwd()
+    os.chdir(work)
+    sys.path.insert(0, SERVER_DIR)
+    try:
+        module = importlib.import_module('server')
+    finally:
+        os.chdir(cwd)
+    module.init_db()
+    yield module
+    module.db_pool.close_all()
+
+
+@pytest.fixture(scope='session')
+def client_module():
+    """客户端client.py（用于检查服务端编码能被客户端正确解码）"""
+    sys.path.insert(0, CLIENT_DIR)
+    return importlib.import_module('client')
+
+
+@pytest.fixture
+def api(server):
+    return server.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def auth_headers():
+    return {'Authorization': f'Bearer {TOKEN}'}
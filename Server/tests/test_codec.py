@@ -0,0 +1,55 @@
+"""二进制IP列表格式（application/x-ip-list）：服务端pack_ip_list()与客户端unpack_ip_list()"""
+import pytest
+
+# 样例包括边界地址、网段、非规范写法、无效记录和空jail
+SAMPLE = {
+    'sshd': ['0.0.0.0', '10.0.0.1', '10.0.0.2', '192.0.2.255', '::', '2001:db8::1', '2001:db8::1:0',
+             '10.1.0.0/16', '010.0.0.1', '2001:DB8::2', 'not-an-ip'],
+    'nginx': ['255.255.255.255', 'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'],
+    '中文': []
+}
+SAMPLE_PACKED = bytes.fromhex(
+    '4632424c0103047373686404008180805001fd8580b00b03008180808080808080808080808080ee868140ffff03040b'
+    '31302e312e302e302f3136093031302e302e302e310b323030313a4442383a3a32096e6f742d616e2d6970056e67696e'
+    '7801ffffffff0f01ffffffffffffffffffffffffffffffffffff030006e4b8ade69687000000'
+)
+
+
+def test_pack_matches_golden_sample(server):
+    assert server.pack_ip_list(SAMPLE) == SAMPLE_PACKED
+
+
+def test_pack_ignores_address_order(server):
+    # 地址按数值排序后编码，其他记录保持原有顺序
+    shuffled = dict(SAMPLE, sshd=['2001:db8::1:0', '10.1.0.0/16', '192.0.2.255', '::', '010.0.0.1', '10.0.0.2',
+                                  '2001:DB8::2', '2001:db8::1', '0.0.0.0', 'not-an-ip', '10.0.0.1'])
+    assert server.pack_ip_list(shuffled) == SAMPLE_PACKED
+
+
+def test_unpack_golden_sample(client_module):
+    assert client_module.unpack_ip_list(SAMPLE_PACKED) == SAMPLE
+
+
+def test_round_trip(server, client_module):
+    groups = {
+        'sshd': [f'198.51.{i // 256}.{i % 256}' for i in range(0, 3000, 7)],
+        'nginx': [f'2001:db8::{i:x}' for i in range(500)] + ['203.0.113.0/24', ' 1.2.3.4'],
+    }
+    decoded = client_module.unpack_ip_list(server.pack_ip_list(groups))
+    assert {jail: sorted(ips) for jail, ips in decoded.items()} == {jail: sorted(ips) for jail, ips in groups.items()}
+
+
+def test_unpack_rejects_truncated_data(client_module):
+    for size in range(len(SAMPLE_PACKED)):
+        with pytest.raises(ValueError):
+            client_module.unpack_ip_list(SAMPLE_PACKED[:size])
+
+
+def test_unpack_rejects_trailing_data(client_module):
+    with pytest.raises(ValueError):
+        client_module.unpack_ip_list(SAMPLE_PACKED + b'\x00')
+
+
+def test_unpack_rejects_unknown_version(client_module):
+    with pytest.raises(ValueError):
+        client_module.unpack_ip_list(b'F2BL\x02' + SAMPLE_PACKED[5:])
@@ -0,0 +1,69 @@
+"""/events 变更推送：只由asyncio接口提供，心跳间隔、最长持续时间和连接数上限取自配置"""
+import asyncio
+import time
+
+
+def stream_events(server, headers):
+    """不经过ASGI服务器订阅一次 /events，返回(状态码, 响应头, 响应体文本, 持续时间)"""
+    import async_server
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': b'',
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0),
+    }
+    messages = []
+
+    async def run():
+        api = async_server.AsyncAPI(1, 16, 0.001)
+        api.start_change_watcher()
+        disconnected = asyncio.Event()
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(api.dispatch(scope, receive, send), 10)
+        finally:
+            disconnected.set()
+            await api.stop_change_watcher()
+            api.readers.shutdown(wait=True)
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return start['status'], dict(start['headers']), body.decode('utf-8'), elapsed
+
+
+def test_flask_does_not_serve_events(api, auth_headers):
+    response = api.get('/events', headers=auth_headers)
+    assert response.status_code == 404
+
+
+def test_heartbeat_and_max_duration(server, auth_headers, monkeypatch):
+    monkeypatch.setitem(server.config, 'events_heartbeat', 0.05)
+    monkeypatch.setitem(server.config, 'events_max_duration', 0.3)
+    status, _, body, elapsed = stream_events(server, auth_headers)
+    assert status == 200
+    assert 'event: ready' in body
+    assert body.count(': keepalive') >= 2
+    assert 0.3 <= elapsed < 2
+
+
+def test_max_streams(server, auth_headers, monkeypatch):
+    monkeypatch.setitem(server.config, 'events_max_streams', 0)
+    monkeypatch.setitem(server.config, 'events_max_duration', 120)
+    status, headers, _, _ = stream_events(server, auth_headers)
+    assert status == 503
+    assert headers[b'retry-after'] == b'120'
@@ -0,0 +1,32 @@
+"""完整列表接口：启用ip_cache时流式请求仍逐批读取数据库，预生成的响应数量有上限"""
+import json
+from datetime import datetime
+
+
+def test_ndjson_stream_bypasses_cached_bodies(server, api, auth_headers):
+    assert server.ip_cache.enabled
+    ips = [f'192.0.2.{i}' for i in range(10, 30)]
+    assert api.post('/add_ips', json={'ips': ips, 'jail': 'lists'}, headers=auth_headers).status_code == 201
+    expected = api.get('/get_ips', headers=auth_headers).get_json()
+
+    response = api.get('/get_ips?stream=1', headers=auth_headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {"end": True, "total_items": expected['total_items'], "search_ip": ''}
+    assert sorted(item['ip_address'] for item in lines[:-1]) == sorted(item['ip_address'] for item in expected['items'])
+    assert not any(key[2] == 'ndjson' for key in server.ip_cache._bodies)
+
+
+def test_cached_bodies_are_bounded(server):
+    conn = server.get_db_connection()
+    try:
+        now = datetime.now()
+        for i in range(server.IPStateCache.MAX_CACHED_BODIES + 10):
+            server.ip_cache.body(conn, 'blocked', now, jails=(f'jail-{i}',), fmt='jails')
+        assert len(server.ip_cache._bodies) == server.IPStateCache.MAX_CACHED_BODIES
+        # 最近使用的响应保留，最早生成的被丢弃
+        assert ('blocked', (f'jail-{server.IPStateCache.MAX_CACHED_BODIES + 9}',), 'jails', False) in server.ip_cache._bodies
+        assert ('blocked', ('jail-0',), 'jails', False) not in server.ip_cache._bodies
+    finally:
+        server.db_pool.return_connection(conn)
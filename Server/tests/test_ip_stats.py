@@ -0,0 +1,71 @@
+"""ip_stats计数表由触发器维护：经过上报、放行和状态清理后仍与ip_addresses一致"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def stats_mismatches(server):
+    conn = server.get_db_connection()
+    try:
+        return server.check_ip_stats(conn.cursor())
+    finally:
+        server.db_pool.return_connection(conn)
+
+
+def backdate(server, ips, **columns):
+    """把指定IP的时间字段改到过去，模拟封禁/放行/已知期限已过"""
+    conn = server.get_db_connection()
+    try:
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        conn.executemany(f'UPDATE ip_addresses SET {assignments} WHERE ip_address = ?',
+                         [tuple(columns.values()) + (ip,) for ip in ips])
+        conn.commit()
+    finally:
+        server.db_pool.return_connection(conn)
+
+
+def statuses(server, ips):
+    conn = server.get_db_connection()
+    try:
+        placeholders = ','.join('?' * len(ips))
+        rows = conn.execute(f'SELECT ip_address, status FROM ip_addresses WHERE ip_address IN ({placeholders})',
+                            ips).fetchall()
+        return dict(rows)
+    finally:
+        server.db_pool.return_connection(conn)
+
+
+@pytest.mark.parametrize('write_batching', [False, True], ids=['direct', 'batched'])
+def test_ip_stats_stay_consistent(server, api, auth_headers, monkeypatch, write_batching):
+    monkeypatch.setattr(server, 'WRITE_BATCHING', write_batching)
+    prefix = '198.51.100' if write_batching else '203.0.113'
+    ips = [f'{prefix}.{i}' for i in range(1, 41)]
+
+    # 上报：两个jail，其中一部分IP在另一个jail中再次上报（jail变化）、一部分重复上报（封禁时间递增）
+    assert api.post('/add_ips', json={'ips': ips[:30], 'jail': 'sshd'}, headers=auth_headers).status_code == 201
+    assert api.post('/add_ips', json={'ips': ips[20:], 'jail': 'nginx'}, headers=auth_headers).status_code == 201
+    assert api.post('/add_ips', json={'ips': ips[:5], 'jail': 'sshd'}, headers=auth_headers).status_code == 201
+    assert stats_mismatches(server) == {}
+
+    # 手动放行
+    for ip in ips[5:10]:
+        assert api.post('/allow_ip', json={'ip': ip}, headers=auth_headers).status_code == 200
+    assert stats_mismatches(server) == {}
+
+    # 状态清理：封禁到期 -> allowed，放行到期 -> known，已知期限已过 -> 删除
+    now = datetime.now()
+    backdate(server, ips[10:15], blocked_until=now - timedelta(seconds=1))
+    backdate(server, ips[5:10], allowed_since=now - server.ALLOWED_DURATION - timedelta(minutes=1))
+    backdate(server, ips[15:20], blocked_until=now - server.KNOWN_DURATION - timedelta(days=2))
+    # StatusSweeper线程每个周期执行的就是update_ip_status()
+    server.update_ip_status()
+    server.update_ip_status()
+    result = statuses(server, ips)
+    assert {result[ip] for ip in ips[10:15]} == {'allowed'}
+    assert {result[ip] for ip in ips[5:10]} == {'known'}
+    assert not any(ip in result for ip in ips[15:20])
+    assert stats_mismatches(server) == {}
+
+    # 已放行和已知的IP再次被上报
+    assert api.post('/add_ips', json={'ips': ips[5:15], 'jail': 'recidive'}, headers=auth_headers).status_code == 201
+    assert stats_mismatches(server) == {}
@@ -0,0 +1,51 @@
+"""性能分析和慢查询日志：默认不包装数据库连接，开启后统计游标迭代的时间，/admin/profile同一时刻只允许一次采集"""
+import sqlite3
+
+
+def test_pool_uses_plain_connections_by_default(server):
+    assert not server.PROFILING
+    assert server.SLOW_QUERY_THRESHOLD == 0
+    conn = server.get_db_connection()
+    try:
+        assert type(conn) is sqlite3.Connection
+    finally:
+        server.db_pool.return_connection(conn)
+
+
+def test_cursor_iteration_is_timed(server):
+    conn = sqlite3.connect(':memory:', factory=server.ProfiledConnection)
+    try:
+        cursor = conn.execute('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 20000) '
+                              'SELECT i FROM n')
+        executed = cursor._statement[2]
+        assert sum(1 for _ in cursor) == 20000
+        assert cursor._statement[2] > executed
+    finally:
+        conn.close()
+
+
+def test_slow_query_logged_when_rows_are_iterated(server, monkeypatch, caplog):
+    monkeypatch.setattr(server, 'SLOW_QUERY_THRESHOLD', 1e-9)
+    conn = sqlite3.connect(':memory:', factory=server.ProfiledConnection)
+    try:
+        with caplog.at_level('WARNING', logger=server.logger.name):
+            for _ in conn.execute('SELECT 1'):
+                pass
+    finally:
+        conn.close()
+    assert any('慢查询' in record.getMessage() for record in caplog.records)
+
+
+def test_admin_profile_refuses_concurrent_runs(server, api, monkeypatch):
+    monkeypatch.setattr(server, 'PROFILING', True)
+    with api.session_transaction() as sess:
+        sess['username'] = 'admin'
+    lock_file = server.acquire_profile_lock()
+    assert lock_file is not None
+    try:
+        assert api.get('/admin/profile?seconds=0.05').status_code == 409
+    finally:
+        lock_file.close()
+    response = api.get('/admin/profile?seconds=0.05')
+    assert response.status_code == 200
+    assert not server.request_profiler.active
@@ -0,0 +1,62 @@
+"""search_ip转换为索引区间条件后，CIDR搜索结果与ipaddress的判断一致"""
+import ipaddress
+
+import pytest
+
+ADDRESSES = ['10.0.0.1', '10.0.15.255', '10.0.16.0', '10.1.2.3', '192.0.2.1', '192.0.2.130',
+             '2001:db8::1', '2001:db8:0:1::1', '2001:db8:7fff::1', '2001:db8:8000::1', '2001:db9::1',
+             '2001::1', '2001:0:1::1', '2001:1::1', 'fd00::1', 'fd00:0:0:ff::1', '::1', '::ffff:10.0.0.1',
+             'not-an-ip']
+
+SEARCHES = ['10.0.0.0/20', '10.0.0.0/8', '192.0.2.128/25', '192.0.2.1/32', '0.0.0.0/0',
+            '2001:db8::/32', '2001:db8::/33', '2001:db8:8000::/33', '2001:db8::/48', '2001:db8::1/128',
+            '2001::/16', '2001::/32', '2001:0:1::/48', 'fd00::/8', 'fd00::/16', 'fd00::/56',
+            '::/96', '::ffff:0:0/96', '::/0']
+
+
+@pytest.fixture(scope='module')
+def searchable(server, auth_headers):
+    response = server.app.test_client().post('/add_ips', json={'ips': ADDRESSES, 'jail': 'search'},
+                                              headers=auth_headers)
+    assert response.status_code == 201
+
+
+def search(server, search_ip):
+    where, params = server.ip_search_sql(search_ip)
+    conn = server.get_db_connection()
+    try:
+        sql = 'SELECT ip_address FROM ip_addresses' + (f' WHERE {where}' if where else '')
+        return {row[0] for row in conn.execute(sql, params)}
+    finally:
+        server.db_pool.return_connection(conn)
+
+
+def all_addresses(server):
+    return search(server, '')
+
+
+@pytest.mark.parametrize('search_ip', SEARCHES)
+def test_cidr_search_matches_ipaddress(server, searchable, search_ip):
+    network = ipaddress.ip_network(search_ip, strict=False)
+    rows = all_addresses(server)
+    # /0 不限制搜索范围
+    expected = set(rows) if network.prefixlen == 0 else set()
+    for ip in rows:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            continue
+        if addr.version == network.version and addr in network:
+            expected.add(ip)
+    assert search(server, search_ip) == expected
+
+
+def test_ipv6_cidr_search_through_api(api, auth_headers, searchable):
+    response = api.get('/get_ips?search_ip=2001:db8::/32&jail=search', headers=auth_headers)
+    assert response.status_code == 200
+    assert sorted(response.get_json()['jails']['search']) == [
+        '2001:db8:0:1::1', '2001:db8:7fff::1', '2001:db8:8000::1', '2001:db8::1']
+
+
+def test_invalid_cidr_search(api, auth_headers):
+    assert api.get('/get_ips?search_ip=10.0.0.0/40', headers=auth_headers).status_code == 400
@@ -0,0 +1,51 @@
+"""无效的请求参数和请求体：Flask接口和asyncio接口都返回400"""
+import asyncio
+import json
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def async_api(server):
+    import async_server
+    api = async_server.AsyncAPI(1, 16, 0.001)
+    yield api
+    api.readers.shutdown(wait=True)
+
+
+def asgi_request(api, method, path, headers, body=b''):
+    """不经过ASGI服务器直接调用应用，返回(状态码, 响应体)"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        'client': ('127.0.0.1', 0),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(api.dispatch(scope, receive, send))
+    status = next(message['status'] for message in messages if message['type'] == 'http.response.start')
+    return status, b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+
+
+@pytest.mark.parametrize('query', ['page=abc', 'per_page=x', 'page=1&per_page=1.5', 'after=1.2.3.4&per_page=ten'])
+def test_invalid_page_args(api, async_api, auth_headers, query):
+    assert api.get(f'/get_ips?{query}', headers=auth_headers).status_code == 400
+    status, body = asgi_request(async_api, 'GET', f'/get_ips?{query}', auth_headers)
+    assert status == 400
+    assert json.loads(body)['error'] == '无效的分页参数'
+
+
+@pytest.mark.parametrize('path', ['/add_ips', '/allow_ip'])
+@pytest.mark.parametrize('body', [b'[1]', b'"1.2.3.4"', b'null', b'{bad'])
+def test_invalid_json_body(api, async_api, auth_headers, path, body):
+    headers = {**auth_headers, 'Content-Type': 'application/json'}
+    assert api.post(path, data=body, headers=headers).status_code == 400
+    status, _ = asgi_request(async_api, 'POST', path, headers, body)
+    assert status == 400